@@ -4,12 +4,18 @@ Audio connections manager for Spinic.
 
 Uses plumberjack.py
 """
+import time
 from spinic import plumberjack
+from spinic import metrics
 from lunch import logger
 from twisted.internet import defer
 
 log = logger.start(name="audioconnector")
 
+_rule_writes = metrics.counter("audioconnector.rule_writes", "Times we wrote the jack.plumbing rules")
+_rule_write_duration = metrics.histogram("audioconnector.rule_write_seconds", "Time to write the jack.plumbing rules")
+_rules_gauge = metrics.gauge("audioconnector.rules", "jack.plumbing rules we manage")
+
 class AudioConnector(object):
     """
     Manages audio connections with JACK for spinic. (SPIN and Milhouse)
@@ -27,11 +33,21 @@ class AudioConnector(object):
         self.app.osc_interface.start_streaming_with_user_signal.connect(self.on_start_streaming_with_user)
         self.app.osc_interface.stopped_streaming_with_user_signal.connect(self.on_stopped_streaming_with_user)
 
+    def _write_rules(self):
+        """
+        Writes the jack.plumbing config file.
+        """
+        start_time = time.time()
+        self.plumber.write_config_to_file()
+        _rule_write_duration.observe(time.time() - start_time)
+        _rule_writes.increment()
+        _rules_gauge.set(len(self.plumber.rules))
+
     def _plug_input_to_every_sender(self):
         name = "to_all_milhouse" 
         text = """(connect-exclusive "system.*:capture_1" "milhouse.*:in.*" )""" # ; all use the same
         self.plumber.add_rule(name, text)
-        self.plumber.write_config_to_file()
+        self._write_rules()
 
     def _plug_pd_outputs(self):
         #TODO: figure out how many outputs we have.
@@ -49,7 +65,7 @@ class AudioConnector(object):
             name = "pd_out_%d" % (count)
             count += 1
             self.plumber.add_rule(name, rule)
-        self.plumber.write_config_to_file()
+        self._write_rules()
 
 #    def create_jack_plumbing_command(self):
 #        return "jack.plumbing"
@@ -99,7 +115,7 @@ class AudioConnector(object):
         else:
             text = """(connect-exclusive "milhouse.*:out_%s*.*" "pure_data.*:input%d")""" % (milhouse_jack_client_name, int(pd_adc_number) - 1)
             self.plumber.add_rule(name, text)
-            self.plumber.write_config_to_file()
+            self._write_rules()
     
     def on_stopped_streaming_with_user(self, scene_id, user_id):
         """
@@ -110,7 +126,7 @@ class AudioConnector(object):
         name = "from_%s" % (user_id)
         if self.plumber.get_rule(name) is not None:
             self.plumber.remove_rule(name)
-            self.plumber.write_config_to_file()
+            self._write_rules()
         else:
             log.error("Could not find a jack.plumbing rule for %s" % (name))
 
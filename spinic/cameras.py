@@ -8,30 +8,127 @@ assert(json.loads) # need Python >= 2.6
 import glob
 from lunch import logger
 from spinic import audioconnector
+from spinic import metrics
 
 log = logger.start(name="cameras")
 
+_streamers_launched = metrics.counter("cameras.streamers_launched", "Times we launched the streamers with a peer")
+_streamers_stopped = metrics.counter("cameras.streamers_stopped", "Times we stopped the streamers with a peer")
+_peers_streaming = metrics.gauge("cameras.peers_streaming", "Peers we are streaming with")
+_total_send_bandwidth = metrics.gauge("cameras.estimated_send_bps", "Estimated bit rate of all the streams we send")
+_total_recv_bandwidth = metrics.gauge("cameras.estimated_recv_bps", "Estimated bit rate of all the streams we receive")
+
 SHM_PREFIX = "spinic-"
 
+# Rough estimate of the bit rate of one mono audio stream, in bits per second, for each milhouse audio codec.
+AUDIO_CODEC_BITRATES = {
+    "raw": 48000 * 32, # 48 kHz float
+    "vorbis": 64000,
+    "mp3": 128000,
+    }
+
+def decode_bool(value):
+    """
+    Decodes a boolean from the config file or from a UserNode param, which is a string.
+    bool("False") is True, so we can't simply cast it.
+    
+    Might raise a ValueError
+    @rtype: C{bool}
+    """
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ("true", "1", "yes", "on"):
+        return True
+    elif text in ("false", "0", "no", "off", ""):
+        return False
+    else:
+        raise ValueError("Invalid boolean value %s" % (value))
+
+def decode_int(value):
+    """
+    Might raise a ValueError
+    @rtype: C{int}
+    """
+    if isinstance(value, float):
+        return int(value)
+    return int(str(value).strip())
+
+def decode_str(value):
+    """
+    @rtype: C{str}
+    """
+    return str(value)
+
+# The camera settings, which are the params of our UserNode. (plus the cameras[n] and number_of_cameras params)
+# (name, decoder, default value)
+CAMERAS_CONFIG_SCHEMA = [
+    ("receiveraddress", decode_str, "127.0.0.1"),
+    ("videosource", decode_str, "videotestsrc"), # "dc1394src"
+    ("videocodec", decode_str, "h263"),
+    ("videobitrate", decode_int, 75000),
+    ("framerate", decode_int, 15),
+    ("grayscale", decode_bool, True),
+    ("height", decode_int, 480),
+    ("width", decode_int, 640),
+    ("display", decode_str, ":0.0"),
+    ("user_audio_src", decode_int, 1), # as seen by pd [adc] Must be unique for each spinics in a scene.
+    ("audio_outputs_layout", decode_str, "stereo"), # How speakers are set up
+    ("send_audio_port", decode_int, 10000),
+    ("audiocodec", decode_str, "raw"), # one of the keys of AUDIO_CODEC_BITRATES
+    ]
+# Params that older spinics don't publish. We use the default value when a peer doesn't have them.
+OPTIONAL_CONFIG_PARAMS = frozenset(["audiocodec"])
+CAMERAS_CONFIG_DECODERS = dict([(name, decoder) for name, decoder, default in CAMERAS_CONFIG_SCHEMA])
+CAMERA_PARAM_PREFIX = "cameras["
+NUMBER_OF_CAMERAS_PARAM = "number_of_cameras"
+
 class CamerasConfig(object):
     """
     System-wide configuration for the cameras, as read in the cameras config file.
+    
+    Also used for the typed settings of the other users, decoded from the params of their UserNode.
     """
+    __slots__ = [name for name, decoder, default in CAMERAS_CONFIG_SCHEMA] + ["cameras"]
+
     def __init__(self):
         # default values:
-        self.receiveraddress = "127.0.0.1"
-        self.videosource = "videotestsrc" # "dc1394src"
-        self.videocodec = "h263"
-        self.videobitrate = 75000
-        self.framerate = 15
-        self.grayscale = True
-        self.height = 480
-        self.width = 640
-        self.display = ":0.0"
-        self.user_audio_src = 1 # as seen by pd [adc] Must be unique for each spinics in a scene.
-        self.audio_outputs_layout = "stereo" # How speakers are set up
-        self.send_audio_port = 10000
+        for name, decoder, default in CAMERAS_CONFIG_SCHEMA:
+            setattr(self, name, default)
         self.cameras = [] # list of 00000000000000@10.10.10.111:10000 which are <camera_id>@<sending_address>:<sending_port>
+
+    def set_param(self, key, value):
+        """
+        Decodes a UserNode param and sets it.
+        Returns False if it's not a camera setting.
+
+        Might raise a ValueError
+        @rtype: C{bool}
+        """
+        decoder = CAMERAS_CONFIG_DECODERS.get(key)
+        if decoder is not None:
+            setattr(self, key, decoder(value))
+        elif key.startswith(CAMERA_PARAM_PREFIX):
+            # cameras[n], with n starting at 1
+            index = decode_int(key[len(CAMERA_PARAM_PREFIX):-1]) - 1
+            if index < 0:
+                raise ValueError("Invalid camera param %s" % (key))
+            if index >= len(self.cameras):
+                self.cameras.extend([None] * (index + 1 - len(self.cameras)))
+            self.cameras[index] = str(value)
+        elif key == NUMBER_OF_CAMERAS_PARAM:
+            # The cameras[n] params come before it in the bundle. Drop the ones the user doesn't have anymore.
+            del self.cameras[decode_int(value):]
+        else:
+            return False
+        return True
+
+    def get_cameras(self):
+        """
+        Returns the cameras we got so far.
+        @rtype: C{list}
+        """
+        return [camera for camera in self.cameras if camera is not None]
     
 def parse_camera_scheme(txt):
     """
@@ -66,6 +163,22 @@ def parse_camera_scheme(txt):
     # log.debug("Camera %s on %s sends on port %d" % (camera_id, hostname, sender_port))
     return (camera_id, hostname, sender_port)
 
+def get_video_sender_identifier(user_id, cam_number):
+    """
+    Returns the lunch identifier of the video sender for one of our cameras to a peer.
+    @param cam_number: Starts at 1.
+    @rtype: C{str}
+    """
+    return "send_%s_%d" % (user_id, cam_number)
+
+def get_video_receiver_identifier(user_id, cam_number):
+    """
+    Returns the lunch identifier of the video receiver for a camera of a peer.
+    @param cam_number: Starts at 1.
+    @rtype: C{str}
+    """
+    return "recv_%s_%d" % (user_id, cam_number)
+
 def get_commands_to_launch_for_pair(local_config, remote_config, user_id):
     """
     Returns a dict of commands to launch locally for the given remote camera config.
@@ -85,11 +198,11 @@ def get_commands_to_launch_for_pair(local_config, remote_config, user_id):
         """
         ret = "milhouse -s --videosource %(videosource)s --width %(width)d --height %(height)d --videobitrate %(videobitrate)d --videocodec %(videocodec)s --framerate %(framerate)d" % {
                 "videosource": config.videosource,
-                "width": int(config.width),
-                "height": int(config.height), 
-                "videobitrate": int(config.videobitrate), 
+                "width": config.width,
+                "height": config.height, 
+                "videobitrate": config.videobitrate, 
                 "videocodec": config.videocodec, 
-                "framerate": int(config.framerate),
+                "framerate": config.framerate,
             }
         if config.grayscale:
             ret += " --grayscale"
@@ -101,8 +214,8 @@ def get_commands_to_launch_for_pair(local_config, remote_config, user_id):
         @type config: L{spinic.cameras.CamerasConfig}
         """
         return "milhouse -r --width %(width)d --height %(height)d --videocodec %(videocodec)s" % {
-                "width": int(config.width),
-                "height": int(config.height), 
+                "width": config.width,
+                "height": config.height, 
                 "videocodec": config.videocodec,
             }
     
@@ -112,8 +225,9 @@ def get_commands_to_launch_for_pair(local_config, remote_config, user_id):
         @type config: L{spinic.cameras.CamerasConfig}
         """
         audioport = config.send_audio_port
-        sender_cmd = "milhouse -s --numchannels 1 --audioport %(audioport)d --audiocodec raw --audiosource jackaudiosrc --disable-jack-autoconnect --jack-client-name %(jackclientname)s" % {
-                "audioport": int(audioport),
+        sender_cmd = "milhouse -s --numchannels 1 --audioport %(audioport)d --audiocodec %(audiocodec)s --audiosource jackaudiosrc --disable-jack-autoconnect --jack-client-name %(jackclientname)s" % {
+                "audioport": audioport,
+                "audiocodec": config.audiocodec,
                 "jackclientname": audioconnector.create_jack_client_name(user_id, "sender"),
             }
         return sender_cmd
@@ -124,8 +238,9 @@ def get_commands_to_launch_for_pair(local_config, remote_config, user_id):
         @type config: L{spinic.cameras.CamerasConfig}
         """
         audioport = config.send_audio_port
-        receiver_cmd = "milhouse -r --numchannels 1 --audioport %(audioport)d --audiocodec raw --audiosink jackaudiosink --disable-jack-autoconnect --jack-client-name %(jackclientname)s" % {
-                "audioport": int(audioport),
+        receiver_cmd = "milhouse -r --numchannels 1 --audioport %(audioport)d --audiocodec %(audiocodec)s --audiosink jackaudiosink --disable-jack-autoconnect --jack-client-name %(jackclientname)s" % {
+                "audioport": audioport,
+                "audiocodec": config.audiocodec,
                 "jackclientname": audioconnector.create_jack_client_name(user_id, "receiver"),
             }
         return receiver_cmd
@@ -135,7 +250,7 @@ def get_commands_to_launch_for_pair(local_config, remote_config, user_id):
     # senders are very likely to be on a different host
     cam_number = 1 # incrementing this XXX
     for local_cam in local_config.cameras:
-        key = "send_%s_%d" % (user_id, cam_number)
+        key = get_video_sender_identifier(user_id, cam_number)
         txt = _get_milhouse_options_for_sender(local_config)
         camera_id, sender_hostname, sender_port = parse_camera_scheme(local_cam)
         #TODO: give it the camera ID
@@ -152,8 +267,8 @@ def get_commands_to_launch_for_pair(local_config, remote_config, user_id):
     # ------------------------------ LOCAL RECEIVER -----------
     # XXX receivers are always on the same host as spinic
     cam_number = 1 # resetting this
-    for remote_cam in remote_config.cameras:
-        key = "recv_%s_%d" % (user_id, cam_number)
+    for remote_cam in remote_config.get_cameras():
+        key = get_video_receiver_identifier(user_id, cam_number)
         txt = _get_milhouse_options_for_receiver(remote_config)
         camera_id, sender_hostname, sender_port = parse_camera_scheme(remote_cam)
         txt += " --address %(address)s --videoport %(port)d" % {"address": sender_hostname, "port": sender_port}
@@ -180,6 +295,40 @@ def get_commands_to_launch_for_pair(local_config, remote_config, user_id):
         }
     return ret
 
+def get_audio_bitrate_for_codec(audiocodec):
+    """
+    Returns the estimated bit rate of a mono audio stream with the given milhouse audio codec.
+
+    Might raise a RuntimeError
+    
+    @param audiocodec: Name of the milhouse audio codec.
+    @type audiocodec: C{str}
+    @rtype: C{int}
+    """
+    try:
+        return AUDIO_CODEC_BITRATES[audiocodec]
+    except KeyError, e:
+        raise RuntimeError("Unknown audio codec %s. Should be one of %s." % (audiocodec, ", ".join(AUDIO_CODEC_BITRATES.keys())))
+
+def estimate_bandwidth_for_pair(local_config, remote_config):
+    """
+    Estimates the bandwidth used by the streams we exchange with a peer.
+
+    Returns a dict whose keys are "video_send", "video_recv", "audio_send" and "audio_recv". Values are in bits per second.
+    
+    @param local_config: Local config
+    @type local_config: L{CamerasConfig}
+    @param remote_config: Remote config
+    @type remote_config: L{CamerasConfig}
+    @rtype: C{dict}
+    """
+    return {
+        "video_send": local_config.videobitrate * len(local_config.cameras),
+        "video_recv": remote_config.videobitrate * len(remote_config.get_cameras()),
+        "audio_send": get_audio_bitrate_for_codec(local_config.audiocodec),
+        "audio_recv": get_audio_bitrate_for_codec(remote_config.audiocodec),
+        }
+
 def get_texture_id_from_camera_codename(camera):
     """
     Given a camera codename, returns the shvid texture id for it.
@@ -207,52 +356,36 @@ def clear_all_dev_shm(delete_them=True):
                 else:
                     log.warning("Deleted %s" % (f))
 
+def format_bandwidth(bandwidth):
+    """
+    Returns a human-readable string for a bandwidth dict.
+    @param bandwidth: dict as returned by estimate_bandwidth_for_pair.
+    @rtype: C{str}
+    """
+    return "video %(video_send)d/%(video_recv)d kbps, audio %(audio_send)d/%(audio_recv)d kbps (send/recv)" % dict([(key, value / 1000) for key, value in bandwidth.iteritems()])
+
 def create_camera_config_for_user_node_info(user_node_info):
     """
+    The params of a UserNode are decoded as they arrive, so this only returns them.
     @param user_node_info: L{spinic.osc.UserNodeInfo}
     @rtype:  L{CamerasConfig}
     """
-    ret = CamerasConfig()
-    def _read_param(key):
-        if user_node_info.params.has_key(key):
-            value = user_node_info.params[key]
-            ret.__dict__[key] = value
-    # XXX: these are super important!
-    #TODO: should be automatic
-    _read_param("receiveraddress")
-    _read_param("videosource")
-    _read_param("videobitrate")
-    _read_param("framerate")
-    _read_param("grayscale")
-    _read_param("width")
-    _read_param("height")
-    _read_param("send_audio_port")
-    _read_param("user_audio_src")
-    
-    cam_number = 1
-    has_more = True
-    while has_more:
-        key = "cameras[%d]" % (cam_number)
-        if user_node_info.params.has_key(key):
-            value = user_node_info.params[key]
-            ret.cameras.append(value)
-            cam_number += 1
-        else:
-            has_more = False
-    return ret
+    return user_node_info.camera_config
 
 class CamerasManager(object):
     """
     Manages the list of cameras.
     """
-    def __init__(self, app):
+    def __init__(self, app, read_config_file=True):
         # attributes:
         self.app = app
         self.cameras_config = CamerasConfig()
+        self.peers_bandwidth = {} # keys are user IDs. Values are dicts, as returned by estimate_bandwidth_for_pair.
         
         # take action:
         self.cameras_config.receiveraddress = self.app.config.user_id # FIXME
-        self.parse_config_file(self.app.config.cameras_config_file)
+        if read_config_file:
+            self.parse_config_file(self.app.config.cameras_config_file)
 
     def get_my_cameras(self):
         """
@@ -273,6 +406,8 @@ class CamerasManager(object):
             all_commands = get_commands_to_launch_for_pair(local_config, remote_config, user_node_info.name)
             display = local_config.display 
             user_node_info.streaming_is_on = True
+            _streamers_launched.increment()
+            self._account_bandwidth_for_peer(user_node_info.name, local_config, remote_config)
             for identifier, data in all_commands.iteritems():
                 command_txt = data["command"]
                 host = data["host"] # receivers are on the same host. sender might very well be on a different host.
@@ -287,10 +422,81 @@ class CamerasManager(object):
             local_config = self.cameras_config
             all_commands = get_commands_to_launch_for_pair(local_config, remote_config, user_node_info.name)
             user_node_info.streaming_is_on = False
+            _streamers_stopped.increment()
+            if self.peers_bandwidth.has_key(user_node_info.name):
+                del self.peers_bandwidth[user_node_info.name]
+            self._update_bandwidth_metrics()
             for identifier, data in all_commands.iteritems():
                 command = data["command"]
                 self._remove_command(identifier)
 
+    def set_video_receivers_paused(self, user_node_info, paused):
+        """
+        Stops or starts again the video receivers for a peer, without removing them.
+        """
+        log.info("CamerasManager.set_video_receivers_paused(%s, %s)" % (user_node_info.name, paused))
+        if user_node_info.streaming_is_on:
+            for index in range(len(user_node_info.camera_config.get_cameras())):
+                self._set_command_paused(get_video_receiver_identifier(user_node_info.name, index + 1), paused)
+
+    def set_video_senders_paused(self, user_node_info, paused):
+        """
+        Stops or starts again our video senders to a peer, without removing them.
+        """
+        log.info("CamerasManager.set_video_senders_paused(%s, %s)" % (user_node_info.name, paused))
+        if user_node_info.streaming_is_on:
+            for index in range(len(self.cameras_config.cameras)):
+                self._set_command_paused(get_video_sender_identifier(user_node_info.name, index + 1), paused)
+
+    def _set_command_paused(self, identifier, paused):
+        if paused:
+            self.app.launcher.suspend_command(identifier)
+        else:
+            self.app.launcher.resume_command(identifier)
+
+    def _account_bandwidth_for_peer(self, user_id, local_config, remote_config):
+        """
+        Stores the estimated bandwidth for the streams with a peer.
+        """
+        try:
+            bandwidth = estimate_bandwidth_for_pair(local_config, remote_config)
+        except RuntimeError, e:
+            log.error("Cannot estimate the bandwidth with %s: %s" % (user_id, e))
+        else:
+            self.peers_bandwidth[user_id] = bandwidth
+            self._update_bandwidth_metrics()
+            log.info("Estimated bandwidth with %s: %s" % (user_id, format_bandwidth(bandwidth)))
+            log.info("Estimated total bandwidth: %s" % (format_bandwidth(self.get_total_bandwidth())))
+
+    def _update_bandwidth_metrics(self):
+        total = self.get_total_bandwidth()
+        _peers_streaming.set(len(self.peers_bandwidth))
+        _total_send_bandwidth.set(total["video_send"] + total["audio_send"])
+        _total_recv_bandwidth.set(total["video_recv"] + total["audio_recv"])
+
+    def get_bandwidth_for_peer(self, user_id):
+        """
+        Returns the estimated bandwidth for the streams with a peer, or None if we are not streaming with it.
+        @rtype: C{dict}
+        """
+        return self.peers_bandwidth.get(user_id)
+
+    def get_total_bandwidth(self):
+        """
+        Returns the aggregate estimated bandwidth for all the peers we stream with.
+        @rtype: C{dict}
+        """
+        ret = {
+            "video_send": 0,
+            "video_recv": 0,
+            "audio_send": 0,
+            "audio_recv": 0,
+            }
+        for bandwidth in self.peers_bandwidth.itervalues():
+            for key, value in bandwidth.iteritems():
+                ret[key] += value
+        return ret
+
     def _remove_command(self, identifier):
         self.app.launcher.remove_command(identifier)
 
@@ -325,19 +531,17 @@ class CamerasManager(object):
         log.debug("Found data %s" % (data))
         
         # Now, let's set the attributes of our CamerasConfig instance.
-        for key, former_value in self.cameras_config.__dict__.iteritems():
-            if key != "cameras": # special case
-                if not data.has_key(unicode(key)):
-                    log.warning("The configuration file should contain key %s" % (key))
+        for key, decoder, default in CAMERAS_CONFIG_SCHEMA:
+            if not data.has_key(unicode(key)):
+                log.warning("The configuration file should contain key %s" % (key))
+            else:
+                try:
+                    value = decoder(data[unicode(key)])
+                except ValueError, e:
+                    log.error("Error with key %s in the config file: %s" % (key, str(e)))
                 else:
-                    cast = type(former_value)
-                    try:
-                        value = cast(data[unicode(key)])
-                    except ValueError, e:
-                        log.error("Error with key %s in the config file: %s" % (key, str(e)))
-                    else:
-                        log.info("Found config %s = %s" % (key, value))
-                        self.cameras_config.__dict__[key] = value
+                    log.info("Found config %s = %s" % (key, value))
+                    setattr(self.cameras_config, key, value)
 
         if not data.has_key(unicode("cameras")):
             log.error("The config file should have a \"cameras\" field.")
@@ -357,6 +561,7 @@ class CamerasManager(object):
         
         # just to validate the camera settings:
         self.get_params_for_my_user_node()
+        get_audio_bitrate_for_codec(self.cameras_config.audiocodec)
 
     def get_params_for_my_user_node(self):
         """
@@ -367,9 +572,8 @@ class CamerasManager(object):
         """
         ret = {}
         number_of_cameras = 0
-        for key, value in self.cameras_config.__dict__.iteritems():
-            if key != "cameras":
-                ret[key] = value
+        for key, decoder, default in CAMERAS_CONFIG_SCHEMA:
+            ret[key] = getattr(self.cameras_config, key)
         camera_number = 1 # Camera indices start at 1
         for camera in self.cameras_config.cameras:
             key = "cameras[%d]" % (camera_number)
@@ -380,6 +584,6 @@ class CamerasManager(object):
             camera_number += 1
             number_of_cameras += 1
 
-        ret["number_of_cameras"] = number_of_cameras
+        ret[NUMBER_OF_CAMERAS_PARAM] = number_of_cameras
         return ret
 
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Captures the datagrams of the info and scene channels to a binary log, and reads them back.
+
+The log starts with MAGIC. Each record is then:
+ * a header packed with RECORD_HEADER: timestamp (double), channel (unsigned char), sender IPv4 address (4 bytes), sender port (unsigned short), length (unsigned int)
+ * the raw datagram, of that length
+
+See L{spinic.replay} to feed a log into a headless SpinicOscInterface.
+"""
+import socket
+import struct
+import time
+import threading
+
+MAGIC = "SPINICAP1\n"
+RECORD_HEADER = struct.Struct(">dB4sHI")
+INFO_CHANNEL = 0
+SCENE_CHANNEL = 1
+CHANNEL_NAMES = {
+    INFO_CHANNEL: "info",
+    SCENE_CHANNEL: "scene",
+    }
+
+class CaptureWriter(object):
+    """
+    Writes the datagrams we receive to a capture file.
+
+    The datagrams can be recorded from the receiver thread and from the reactor thread at the same time.
+
+    Might raise an IOError
+    """
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.datagrams_written = 0
+        self._file = open(file_name, "wb")
+        self._file.write(MAGIC)
+        self._lock = threading.Lock()
+
+    def get_recorder(self, channel):
+        """
+        Returns a callable that takes a datagram and the address of its sender, and records it for the given channel.
+        @param channel: INFO_CHANNEL or SCENE_CHANNEL
+        """
+        def _record(data, address):
+            self.write(channel, data, address)
+        return _record
+
+    def write(self, channel, data, address):
+        try:
+            host = socket.inet_aton(address[0])
+        except socket.error:
+            host = "\0\0\0\0"
+        header = RECORD_HEADER.pack(time.time(), channel, host, address[1], len(data))
+        self._lock.acquire()
+        try:
+            if self._file is not None:
+                self._file.write(header)
+                self._file.write(data)
+                self.datagrams_written += 1
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        finally:
+            self._lock.release()
+
+def read_capture(file_name):
+    """
+    Iterates over the records of a capture file.
+    Yields (timestamp, channel, (host, port), data) tuples.
+
+    Might raise a RuntimeError
+    """
+    f = open(file_name, "rb")
+    try:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise RuntimeError("%s is not a spinic capture file." % (file_name))
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return # end of file, or truncated header
+            timestamp, channel, host, port, length = RECORD_HEADER.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return # truncated by a crash
+            yield (timestamp, channel, (socket.inet_ntoa(host), port), data)
+    finally:
+        f.close()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Local OSC control interface for spinic.
+
+Listens on localhost for messages that do what the buttons of the GUI do, so that spinic can be driven in headless mode:
+ * /spinic/connect <scene_id>
+ * /spinic/refresh
+ * /spinic/rotate_left
+ * /spinic/rotate_right
+ * /spinic/profile (starts or stops the profiler)
+ * /spinic/quit
+"""
+from twisted.internet import reactor
+from twisted.internet import error
+from txosc import dispatch
+from txosc import async
+from lunch import logger
+
+log = logger.start(name="control")
+
+class ControlInterface(object):
+    """
+    Receives control messages on a local UDP port.
+
+    Might raise a RuntimeError
+    """
+    def __init__(self, app, port):
+        self.app = app
+        self.port = port
+        self.receiver = dispatch.Receiver()
+        self.receiver.addCallback("/spinic/connect", self.on_connect)
+        self.receiver.addCallback("/spinic/refresh", self.on_refresh)
+        self.receiver.addCallback("/spinic/rotate_left", self.on_rotate_left)
+        self.receiver.addCallback("/spinic/rotate_right", self.on_rotate_right)
+        self.receiver.addCallback("/spinic/profile", self.on_profile)
+        self.receiver.addCallback("/spinic/quit", self.on_quit)
+        self.receiver.setFallback(self.fallback)
+        try:
+            self._listening_port = reactor.listenUDP(self.port, async.DatagramServerProtocol(self.receiver), interface="127.0.0.1")
+        except error.CannotListenError, e:
+            raise RuntimeError("Cannot listen for control messages: %s" % (e))
+        log.info("Listening for control messages on osc.udp://127.0.0.1:%d" % (self.port))
+
+    def on_connect(self, message, address):
+        """
+        /spinic/connect <scene_id>
+        """
+        try:
+            scene_id = message.getValues()[0]
+        except IndexError:
+            log.error("/spinic/connect needs a scene ID")
+        else:
+            log.info("Connecting to scene %s as asked by %s" % (scene_id, address))
+            self.app.config.default_scene_id = scene_id
+            if self.app.osc_interface.servers.has_key(scene_id):
+                self.app.osc_interface.choose_server(scene_id)
+            else:
+                log.info("Scene %s has not been seen yet. Will connect to it when it is." % (scene_id))
+
+    def on_profile(self, message, address):
+        self.app.profiler.toggle()
+
+    def on_refresh(self, message, address):
+        self.app.osc_interface.send_refresh()
+
+    def on_rotate_left(self, message, address):
+        self.app.osc_interface.rotate_left()
+
+    def on_rotate_right(self, message, address):
+        self.app.osc_interface.rotate_right()
+
+    def on_quit(self, message, address):
+        log.info("Quitting as asked by %s" % (str(address)))
+        reactor.stop()
+
+    def fallback(self, message, address):
+        log.warning("Unknown control message %s from %s" % (message, address))
+
+    def stop(self):
+        """
+        @rettype: L{twisted.internet.defer.Deferred}
+        """
+        return self._listening_port.stopListening()
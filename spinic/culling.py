@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Pauses the video streams of the users we cannot see.
+
+Decoding the video of every peer all the time is wasteful when some of them are behind us or far away. The VisibilityCuller decides, from the users within our view cone, which peers to pause the video receivers of:
+ * A peer is paused once it has been out of view for PAUSE_DELAY seconds, so that looking around quickly does not restart the receivers.
+ * A peer is resumed as soon as it is in view again.
+ * The cone used for this is wider and longer than what we actually see, by some margins, so that the streams are running by the time a peer is on screen.
+
+The audio streams are not paused, since we still hear the peers we don't see.
+
+The IDs of the paused peers are published in the paused_peers param of our UserNode, so that they can pause their video senders to us too.
+"""
+import time
+from spinic import metrics
+
+PAUSED_PEERS_PARAM = "paused_peers"
+DEFAULT_FIELD_OF_VIEW = 90.0 # degrees
+DEFAULT_MAX_DISTANCE = 50.0 # meters
+ANGLE_MARGIN = 30.0 # degrees added on each side of the field of view
+DISTANCE_MARGIN = 10.0 # meters added to the maximum distance
+PAUSE_DELAY = 2.0 # seconds
+
+_paused_gauge = metrics.gauge("culling.paused_peers", "Peers whose video receivers are paused since we cannot see them")
+_pauses = metrics.counter("culling.pauses", "Times we paused the video receivers of a peer")
+_resumes = metrics.counter("culling.resumes", "Times we resumed the video receivers of a peer")
+
+def format_paused_peers(user_ids):
+    """
+    @rtype: C{str}
+    """
+    return ",".join(sorted(user_ids))
+
+def parse_paused_peers(value):
+    """
+    @rtype: C{list}
+    """
+    return [user_id for user_id in str(value).split(",") if user_id != ""]
+
+class VisibilityCuller(object):
+    """
+    Keeps track of the peers whose video is paused.
+    """
+    def __init__(self, field_of_view=DEFAULT_FIELD_OF_VIEW, max_distance=DEFAULT_MAX_DISTANCE):
+        """
+        @param field_of_view: Horizontal angle we see, in degrees.
+        @param max_distance: Distance beyond which we don't need to see the peers, in meters.
+        """
+        self.field_of_view = field_of_view
+        self.max_distance = max_distance
+        self.paused = set() # user IDs
+        self._out_of_view_since = {} # user ID: time
+
+    def get_cone(self):
+        """
+        Returns the (field of view, distance) of the cone that the peers we keep streaming with must be in.
+        @rtype: C{tuple}
+        """
+        return (min(360.0, self.field_of_view + 2 * ANGLE_MARGIN), self.max_distance + DISTANCE_MARGIN)
+
+    def update(self, peers, in_view, now=None):
+        """
+        Returns the peers to pause and the peers to resume, as a tuple of two lists.
+        @param peers: IDs of the peers we stream with.
+        @param in_view: IDs of the users within the cone given by get_cone.
+        """
+        if now is None:
+            now = time.time()
+        in_view = set(in_view)
+        to_pause = []
+        to_resume = []
+        for user_id in peers:
+            if user_id in in_view:
+                if self._out_of_view_since.has_key(user_id):
+                    del self._out_of_view_since[user_id]
+                if user_id in self.paused:
+                    self.paused.discard(user_id)
+                    to_resume.append(user_id)
+                    _resumes.increment()
+            elif user_id not in self.paused:
+                since = self._out_of_view_since.setdefault(user_id, now)
+                if now - since >= PAUSE_DELAY:
+                    del self._out_of_view_since[user_id]
+                    self.paused.add(user_id)
+                    to_pause.append(user_id)
+                    _pauses.increment()
+        _paused_gauge.set(len(self.paused))
+        return (to_pause, to_resume)
+
+    def forget(self, user_id):
+        """
+        Called when we stop streaming with a peer.
+        Returns True if it was paused.
+        @rtype: C{bool}
+        """
+        if self._out_of_view_since.has_key(user_id):
+            del self._out_of_view_since[user_id]
+        if user_id in self.paused:
+            self.paused.discard(user_id)
+            _paused_gauge.set(len(self.paused))
+            return True
+        return False
+
+    def forget_all(self):
+        self.paused.clear()
+        self._out_of_view_since.clear()
+        _paused_gauge.set(0)
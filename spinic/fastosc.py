@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Decodes the global6DOF messages without txosc.
+
+They are by far the most frequent messages on the scene channel:
+
+    /SPIN/<scene>/<node> ,sffffff global6DOF x y z roll pitch yaw
+
+Their type tags and first argument never change, so the last 48 bytes of such a datagram are always the same 24 bytes followed by the six big-endian floats. We check those bytes, read the OSC address, and unpack the floats with a precompiled struct. Any other datagram is left to txosc.
+
+Compare with txosc with:
+
+    python -m spinic.fastosc [iterations]
+"""
+import sys
+import time
+import struct
+from txosc import osc
+
+POSE = struct.Struct(">6f")
+# Type tags and first argument of a global6DOF message, null-padded to multiples of 4 bytes, as they are in a datagram:
+GLOBAL6DOF_TAIL = ",sffffff\0\0\0\0global6DOF\0\0"
+_TAIL_START = -(len(GLOBAL6DOF_TAIL) + POSE.size)
+_POSE_START = -POSE.size
+_MIN_SIZE = 4 + len(GLOBAL6DOF_TAIL) + POSE.size
+
+def decode_global6dof(data):
+    """
+    Decodes a datagram if it is a global6DOF message.
+    Returns a (OSC address, (x, y, z, roll, pitch, yaw)) tuple, or None if it is anything else.
+    @param data: OSC datagram.
+    @type data: C{str}
+    @rtype: C{tuple}
+    """
+    if len(data) < _MIN_SIZE or data[0] != "/" or data[_TAIL_START:_POSE_START] != GLOBAL6DOF_TAIL:
+        return None
+    end = data.find("\0")
+    # The address is padded to 4 bytes, and must end right where the type tags start:
+    if end == -1 or (end & ~3) + 4 != len(data) + _TAIL_START:
+        return None
+    return (data[:end], POSE.unpack_from(data, len(data) + _POSE_START))
+
+def benchmark(iterations=100000):
+    """
+    Measures how long it takes to decode a global6DOF datagram, with txosc and with decode_global6dof.
+    @rtype: C{str}
+    """
+    data = osc.Message("/SPIN/default/kiosk1", "global6DOF", 1.0, -2.5, 0.5, 0.0, 0.0, 90.0).toBinary()
+    start = time.time()
+    for i in xrange(iterations):
+        message = osc._elementFromBinary(data)
+        values = message.getValues()
+    txosc_duration = time.time() - start
+    start = time.time()
+    for i in xrange(iterations):
+        address, values = decode_global6dof(data)
+    fast_duration = time.time() - start
+    lines = []
+    lines.append("Decoding %d global6DOF datagrams of %d bytes:" % (iterations, len(data)))
+    lines.append(" * txosc + getValues: %8.3f s, %6.2f us each" % (txosc_duration, txosc_duration * 1000000.0 / iterations))
+    lines.append(" * decode_global6dof: %8.3f s, %6.2f us each" % (fast_duration, fast_duration * 1000000.0 / iterations))
+    if fast_duration > 0:
+        lines.append(" * %.1f times faster" % (txosc_duration / fast_duration))
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    iterations = 100000
+    if len(sys.argv) > 1:
+        iterations = int(sys.argv[1])
+    print(benchmark(iterations))
@@ -4,6 +4,7 @@ The Spinic GUI
 """
 import os
 import sys
+import time
 import tempfile
 if __name__ == "__main__": # just a reminder
     from twisted.internet import gtk2reactor
@@ -88,6 +89,146 @@ def _set_combobox_value(widget, value=None):
         msg = "ComboBox widget %s doesn't have value \"%s\"." % (widget, value)
         log.debug(msg)
 
+class NodesView(object):
+    """
+    Tree view of the nodes in the SPIN scene.
+
+    Rows are identified by their path, which is a tuple of names. For example: ("UserNode", "alice", "width")
+    Parent rows are created as needed.
+
+    Changes are queued and applied to the gtk.TreeStore incrementally, at most max_rate times per second, and only when the window is visible.
+    """
+    def __init__(self, tree_view, max_rate=4.0):
+        self.tree_view = tree_view
+        self.max_rate = max_rate
+        self.is_visible = True
+        self.tree_store = gtk.TreeStore(str, str) # name, value
+        self._iters = {} # path: gtk.TreeIter (TreeStore iters persist while their row exists)
+        self._pending = {} # path: (change number, value). The value is None to remove it.
+        self._changes = 0 # number of the last change, to apply them in order
+        self._children = {(): set()} # path: set of the names of its children, including the pending changes
+        self._flush_call = None
+        self._last_flush_time = 0.0
+        
+        self.tree_view.set_model(self.tree_store)
+        for index, title in enumerate(["Name", "Value"]):
+            column = gtk.TreeViewColumn(title, gtk.CellRendererText(), text=index)
+            self.tree_view.append_column(column)
+
+    def set_row(self, path, value=""):
+        """
+        Creates or updates a row.
+        @type path: C{tuple}
+        """
+        self._queue(path, str(value))
+    
+    def remove_row(self, path):
+        """
+        Removes a row and its children.
+        @type path: C{tuple}
+        """
+        self._queue(path, None)
+    
+    def set_children(self, path, names):
+        """
+        Makes sure the children of a row are exactly the given names.
+        Children that are already there keep their value and their own children.
+        """
+        wanted = set(names)
+        current = self._children.get(path, set())
+        for name in current - wanted:
+            self.remove_row(path + (name,))
+        for name in wanted - current:
+            self.set_row(path + (name,))
+    
+    def clear(self):
+        """
+        Removes all rows.
+        """
+        for name in list(self._children.get((), [])):
+            self.remove_row((name,))
+
+    def set_visible(self, is_visible):
+        """
+        Called when the window is shown or hidden. Updates are skipped while it is hidden.
+        """
+        self.is_visible = is_visible
+        if is_visible:
+            self._schedule_flush()
+
+    def _queue(self, path, value):
+        if value is None:
+            self._forget_children(path)
+            parent = self._children.get(path[:-1])
+            if parent is not None:
+                parent.discard(path[-1])
+        else:
+            for index in range(len(path)):
+                self._children.setdefault(path[:index], set()).add(path[index])
+        self._changes += 1
+        self._pending[path] = (self._changes, value) # replaces an older change, and moves it to the end
+        self._schedule_flush()
+
+    def _forget_children(self, path):
+        for name in self._children.pop(path, ()):
+            self._forget_children(path + (name,))
+
+    def _schedule_flush(self):
+        if self._flush_call is not None or len(self._pending) == 0 or not self.is_visible:
+            return
+        delay = max(0.0, self._last_flush_time + 1.0 / self.max_rate - time.time())
+        self._flush_call = reactor.callLater(delay, self._flush)
+
+    def _flush(self):
+        """
+        Applies the pending changes to the tree store.
+        """
+        self._flush_call = None
+        if not self.is_visible:
+            return
+        self._last_flush_time = time.time()
+        pending = self._pending
+        self._pending = {}
+        for number, path, value in sorted([(number, path, value) for path, (number, value) in pending.iteritems()]):
+            if value is None:
+                self._remove(path)
+            else:
+                self._set(path, value)
+
+    def _set(self, path, value):
+        tree_iter = self._iters.get(path)
+        if tree_iter is None:
+            parent = None
+            if len(path) > 1:
+                parent = self._iters.get(path[:-1])
+                if parent is None:
+                    parent = self._set(path[:-1], "")
+            tree_iter = self.tree_store.append(parent, [path[-1], value])
+            self._iters[path] = tree_iter
+            if parent is not None and len(path) == 2:
+                self.tree_view.expand_row(self.tree_store.get_path(parent), False)
+        elif self.tree_store.get_value(tree_iter, 1) != value:
+            self.tree_store.set_value(tree_iter, 1, value)
+        return tree_iter
+
+    def _remove(self, path):
+        tree_iter = self._iters.pop(path, None)
+        if tree_iter is None:
+            return
+        self._forget_iters(path, tree_iter)
+        self.tree_store.remove(tree_iter)
+
+    def _forget_iters(self, path, tree_iter):
+        """
+        Forgets the iters of the descendants of a row.
+        """
+        child = self.tree_store.iter_children(tree_iter)
+        while child is not None:
+            child_path = path + (self.tree_store.get_value(child, 0),)
+            self._iters.pop(child_path, None)
+            self._forget_iters(child_path, child)
+            child = self.tree_store.iter_next(child)
+
 class MilhouseWatcher(object):
     """
     Sets up a command line to watch the running milhouse processes.
@@ -144,12 +285,18 @@ class Gui(object):
             large_icon = gtk.gdk.pixbuf_new_from_file(gui.ICON_FILE)
             self.window.set_icon_list(large_icon)
         self.window.connect('delete-event', self.on_main_window_deleted)
+        self.window.connect('map-event', self.on_main_window_mapped)
+        self.window.connect('unmap-event', self.on_main_window_unmapped)
+        self.window.connect('window-state-event', self.on_main_window_state_changed)
         self.spin_scene_widget = self.builder.get_object("spin_scene")
         self.spin_connect_widget = self.builder.get_object("spin_connect")
         self.spin_connected_widget = self.builder.get_object("spin_connected")
         self.cameras_text_view_widget = self.builder.get_object("cameras_text_view")
-        self.nodes_text_view_widget = self.builder.get_object("nodes_text_view")
+        self.nodes_view = NodesView(self.builder.get_object("nodes_tree_view"))
         self.banner_widget = self.builder.get_object("banner")
+        self.profile_menu_item = self.builder.get_object("profilemenuitem")
+        self._is_updating_profile_menu_item = False
+        self.app.profiler.state_changed_signal.connect(self.on_profiler_state_changed)
         if self.app.config.banner_image_file is not None:
             log.info("Loading image for banner: %s" % (self.app.config.banner_image_file))
             self.banner_widget.set_from_file(self.app.config.banner_image_file) # does not raise errors
@@ -157,14 +304,29 @@ class Gui(object):
         self._populate_spin_scenes()
         self.menu_accel_group = self.builder.get_object('accelgroup1')
         self._setup_shortcuts()
-        reactor.callLater(0.01, self._start)
+        self._start()
 
     def _start(self):
+        """
+        Shows the window right away. 
+        The cameras text is updated by the application once the cameras config file has been read.
+        """
         self.window.show()
         self.spin_connect_widget.set_sensitive(False)
-        cameras_txt = "\n".join(self.app.cameras_manager.get_my_cameras())
-        self.update_cameras_text(cameras_txt)
-        self.update_nodes_text("TODO")
+
+    def on_main_window_mapped(self, *args):
+        self.nodes_view.set_visible(True)
+        self.app.on_window_shown()
+        return False
+
+    def on_main_window_unmapped(self, *args):
+        self.nodes_view.set_visible(False)
+        return False
+
+    def on_main_window_state_changed(self, widget, event):
+        iconified = bool(event.new_window_state & gtk.gdk.WINDOW_STATE_ICONIFIED)
+        self.nodes_view.set_visible(not iconified)
+        return False
 
     def _setup_shortcuts(self):
         pass
@@ -218,6 +380,22 @@ class Gui(object):
     def on_help_menu_item_activated(self, *args):
         pass
 
+    def on_profile_menu_item_toggled(self, *args):
+        """
+        Starts or stops the profiler.
+        """
+        if not self._is_updating_profile_menu_item:
+            self.app.profiler.toggle()
+
+    def on_profiler_state_changed(self, is_running):
+        """
+        Slot for the L{spinic.profiling.Profiler.state_changed_signal} signal.
+        The profiler might have been toggled with SIGUSR2, or stopped after its duration.
+        """
+        self._is_updating_profile_menu_item = True
+        self.profile_menu_item.set_active(is_running)
+        self._is_updating_profile_menu_item = False
+
     def update_connected_state(self, connected=False):
         """
         Updates the image.
@@ -275,9 +453,38 @@ class Gui(object):
         log.debug("on_send_clear_clicked")
         self.app.osc_interface.send_clear()
     
-    def update_nodes_text(self, text):
-        #TODO
-        self.nodes_text_view_widget.get_buffer().set_text(unicode(text))
+    def update_node_list(self, node_type, node_list):
+        """
+        Sets the list of nodes of a given type.
+        """
+        self.nodes_view.set_children((node_type,), node_list)
+        if len(node_list) == 0:
+            self.nodes_view.remove_row((node_type,))
+
+    def remove_node(self, node_type, node_id):
+        """
+        Removes a node from the nodes view.
+        """
+        self.nodes_view.remove_row((node_type, node_id))
+
+    def update_user_param(self, user_id, key, value):
+        self.nodes_view.set_row(("UserNode", user_id, key), value)
+
+    def update_stats(self, section, values):
+        """
+        Shows a section of statistics, such as the estimated bandwidth.
+        The section is removed if values is empty.
+        @type values: C{dict}
+        """
+        if len(values) == 0:
+            self.nodes_view.remove_row((section,))
+        else:
+            self.nodes_view.set_children((section,), values.keys())
+            for name, value in values.iteritems():
+                self.nodes_view.set_row((section, name), value)
+
+    def clear_nodes(self):
+        self.nodes_view.clear()
     
     def update_cameras_text(self, text):
         #TODO
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+"""
+Traces how long it takes before we see each peer, phase by phase.
+
+Phases of the whole application (on the "spinic" track):
+ * server_discovery: from startup to the first /SPIN/__server__ of the scene we connect to
+ * connect: from choosing the scene to being connected to it
+
+Phases of each peer (on its own track):
+ * node_list: from being connected to the scene to seeing the UserNode of the peer in a nodeList (zero if it joins after us)
+ * params: from seeing its UserNode to having all its params
+ * launch: from having its params to having added its streamers to lunch
+ * process_spawn: from adding its streamers to a video receiver running
+ * first_frame: from a video receiver running to its shared video memory being created, which happens when it gets its first frame
+ * join: from seeing its UserNode to the first frame
+
+If the shared video memory of a peer is not created within FIRST_FRAME_TIMEOUT seconds of its video receiver running, its join is recorded as timed out, and we stop waiting for it.
+
+The spans are appended to a file as Chrome trace events, in the JSON array format, which can be opened in Perfetto or chrome://tracing. The closing bracket is written at shutdown, but it is optional, so the file can be opened while spinic runs. No event is kept in memory.
+
+The durations of each phase are also summarized as percentiles over the last joins, and recorded in the metrics.
+"""
+import os
+import json
+import time
+from collections import deque
+from twisted.internet import task
+from spinic import metrics
+
+log = None
+
+# Upper bounds of the buckets of the join phase durations, in seconds.
+JOIN_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+PHASES = ["server_discovery", "connect", "node_list", "params", "launch", "process_spawn", "first_frame", "join"]
+SHARED_MEMORY_DIRECTORY = "/dev/shm"
+FIRST_FRAME_POLL_INTERVAL = 0.1 # seconds
+FIRST_FRAME_TIMEOUT = 30.0 # seconds
+MAX_DURATIONS = 1000 # per phase, for the percentiles. The older ones are dropped.
+
+_phase_histograms = dict([(phase, metrics.histogram("join.%s_seconds" % (phase), "Duration of the %s join phase" % (phase), JOIN_BUCKETS)) for phase in PHASES])
+_first_frame_timeouts = metrics.counter("join.first_frame_timeouts", "Joins for which the first frame never came")
+
+def get_percentile(values, percentile):
+    """
+    Nearest-rank percentile of a list of values.
+    @param percentile: In the range [0, 100]
+    @rtype: C{float}
+    """
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    rank = int(round(percentile / 100.0 * len(ordered) + 0.5)) - 1
+    return ordered[max(0, min(rank, len(ordered) - 1))]
+
+class PeerJoin(object):
+    """
+    Timestamps of the join of one peer.
+    """
+    __slots__ = ["user_id", "track", "seen_time", "ready_time", "launched_time", "running_time", "frame_time", "timed_out", "identifiers", "shared_memory_files"]
+
+    def __init__(self, user_id, track, seen_time):
+        self.user_id = user_id
+        self.track = track # tid in the trace
+        self.seen_time = seen_time
+        self.ready_time = None
+        self.launched_time = None
+        self.running_time = None
+        self.frame_time = None
+        self.timed_out = False # True if its first frame never came
+        self.identifiers = [] # lunch identifiers of its video receivers
+        self.shared_memory_files = [] # created by its video receivers
+
+class JoinTracer(object):
+    """
+    Collects the join spans and writes them.
+    """
+    def __init__(self, file_name=None):
+        """
+        @param file_name: Path to the Chrome trace JSON file, or None not to write it.
+        """
+        global log
+        from lunch import logger
+        log = logger.start(name="jointrace")
+        self.file_name = file_name
+        self.start_time = time.time()
+        self.durations = dict([(phase, deque(maxlen=MAX_DURATIONS)) for phase in PHASES])
+        self.peers = {} # keys are user IDs. Values are PeerJoin instances.
+        self._next_track = 1
+        self._has_discovered_server = False
+        self._servers_seen_time = {} # scene ID: time we first got its /SPIN/__server__
+        self._connecting_time = None
+        self._connected_time = None
+        self._identifiers = {} # lunch identifier: user ID
+        self._looping_poll = task.LoopingCall(self._poll_first_frames)
+        self._trace_file = None # opened with the first event
+        self._add_event({"name": "thread_name", "ph": "M", "pid": 1, "tid": 0, "args": {"name": "spinic"}})
+
+    def _add_event(self, event):
+        """
+        Appends an event to the trace file, if we have one.
+        """
+        if self.file_name is None:
+            return
+        try:
+            if self._trace_file is None:
+                file_name = os.path.expanduser(self.file_name)
+                self._trace_file = open(file_name, "w")
+                self._trace_file.write("[\n")
+            else:
+                self._trace_file.write(",\n")
+            self._trace_file.write(json.dumps(event))
+        except IOError, e:
+            log.error("Could not write the join trace to %s: %s. Giving up tracing." % (self.file_name, e))
+            self.file_name = None
+
+    def _add_span(self, phase, track, start, end, args=None):
+        duration = max(0.0, end - start)
+        event = {
+            "name": phase,
+            "cat": "join",
+            "ph": "X",
+            "pid": 1,
+            "tid": track,
+            "ts": int((start - self.start_time) * 1000000),
+            "dur": int(duration * 1000000),
+            }
+        if args is not None:
+            event["args"] = args
+        self._add_event(event)
+        self.durations[phase].append(duration)
+        _phase_histograms[phase].observe(duration)
+
+    def on_server_seen(self, scene_id):
+        """
+        Called when we get a /SPIN/__server__ for a new scene.
+        """
+        if not self._servers_seen_time.has_key(scene_id):
+            self._servers_seen_time[scene_id] = time.time()
+
+    def on_connecting(self, scene_id):
+        """
+        Called when we choose a scene to connect to.
+        """
+        self._connecting_time = time.time()
+        self._connected_time = None
+        if not self._has_discovered_server and self._servers_seen_time.has_key(scene_id):
+            self._has_discovered_server = True
+            self._add_span("server_discovery", 0, self.start_time, self._servers_seen_time[scene_id], {"scene_id": scene_id})
+
+    def on_connected(self, scene_id):
+        self._connected_time = time.time()
+        if self._connecting_time is not None:
+            self._add_span("connect", 0, self._connecting_time, self._connected_time, {"scene_id": scene_id})
+
+    def on_peer_seen(self, user_id):
+        """
+        Called when we see a new UserNode in a nodeList.
+        """
+        now = time.time()
+        peer = PeerJoin(user_id, self._next_track, now)
+        self._next_track += 1
+        self.peers[user_id] = peer
+        self._add_event({"name": "thread_name", "ph": "M", "pid": 1, "tid": peer.track, "args": {"name": user_id}})
+        if self._connected_time is not None:
+            self._add_span("node_list", peer.track, self._connected_time, now)
+
+    def on_peer_ready(self, user_id):
+        """
+        Called when we have all the params of a peer.
+        """
+        peer = self.peers.get(user_id)
+        if peer is not None and peer.ready_time is None:
+            peer.ready_time = time.time()
+            self._add_span("params", peer.track, peer.seen_time, peer.ready_time)
+
+    def on_streamers_launched(self, user_id, receiver_identifiers, shared_memory_ids):
+        """
+        Called once the streamers with a peer have been added to lunch.
+        @param receiver_identifiers: lunch identifiers of its video receivers.
+        @param shared_memory_ids: IDs of the shared video memory of its video receivers.
+        """
+        peer = self.peers.get(user_id)
+        if peer is None or peer.launched_time is not None:
+            return
+        peer.launched_time = time.time()
+        if peer.ready_time is not None:
+            self._add_span("launch", peer.track, peer.ready_time, peer.launched_time)
+        peer.identifiers = list(receiver_identifiers)
+        peer.shared_memory_files = [os.path.join(SHARED_MEMORY_DIRECTORY, shared_memory_id) for shared_memory_id in shared_memory_ids]
+        for identifier in peer.identifiers:
+            self._identifiers[identifier] = user_id
+
+    def on_command_running(self, identifier):
+        """
+        Slot for the L{spinic.launching.ProcessLauncher.child_running_signal} signal.
+        """
+        user_id = self._identifiers.get(identifier)
+        if user_id is None:
+            return
+        peer = self.peers.get(user_id)
+        if peer is None or peer.running_time is not None or peer.launched_time is None:
+            return
+        peer.running_time = time.time()
+        self._add_span("process_spawn", peer.track, peer.launched_time, peer.running_time, {"identifier": identifier})
+        if len(peer.shared_memory_files) != 0 and not self._looping_poll.running:
+            self._looping_poll.start(FIRST_FRAME_POLL_INTERVAL, now=True)
+
+    def _poll_first_frames(self):
+        waiting = False
+        now = time.time()
+        for peer in self.peers.itervalues():
+            if peer.running_time is None or peer.frame_time is not None or peer.timed_out:
+                continue
+            for file_name in peer.shared_memory_files:
+                if os.path.exists(file_name):
+                    peer.frame_time = time.time()
+                    self._add_span("first_frame", peer.track, peer.running_time, peer.frame_time, {"file": file_name})
+                    self._add_span("join", peer.track, peer.seen_time, peer.frame_time)
+                    log.info("Joined with %s in %.1f seconds." % (peer.user_id, peer.frame_time - peer.seen_time))
+                    self.flush()
+                    break
+            else:
+                if now - peer.running_time >= FIRST_FRAME_TIMEOUT:
+                    self._on_first_frame_timeout(peer, now)
+                else:
+                    waiting = True
+        if not waiting:
+            self._looping_poll.stop()
+
+    def _on_first_frame_timeout(self, peer, now):
+        """
+        Records that the shared video memory of a peer was never created. Its phases are not added to the percentiles.
+        """
+        peer.timed_out = True
+        _first_frame_timeouts.increment()
+        self._add_event({
+            "name": "first_frame",
+            "cat": "join",
+            "ph": "X",
+            "pid": 1,
+            "tid": peer.track,
+            "ts": int((peer.running_time - self.start_time) * 1000000),
+            "dur": int((now - peer.running_time) * 1000000),
+            "args": {"timed_out": True, "files": peer.shared_memory_files},
+            })
+        log.warning("No video frame from %s after %.1f seconds. Giving up tracing its join." % (peer.user_id, now - peer.running_time))
+        self.flush()
+
+    def on_peer_left(self, user_id):
+        """
+        Called when we stop tracking a peer. If it comes back, its join is traced again.
+        """
+        peer = self.peers.pop(user_id, None)
+        if peer is not None:
+            for identifier in peer.identifiers:
+                if self._identifiers.get(identifier) == user_id:
+                    del self._identifiers[identifier]
+
+    def get_summary(self):
+        """
+        Returns the percentiles of each phase, as strings.
+        @rtype: C{dict}
+        """
+        ret = {}
+        for phase in PHASES:
+            values = self.durations[phase]
+            if len(values) != 0:
+                ret[phase] = "n=%d p50=%.2fs p90=%.2fs max=%.2fs" % (len(values), get_percentile(values, 50), get_percentile(values, 90), max(values))
+        return ret
+
+    def flush(self):
+        """
+        Makes sure the events so far are in the trace file, if we have one.
+        """
+        if self._trace_file is not None:
+            try:
+                self._trace_file.flush()
+            except IOError, e:
+                log.error("Could not write the join trace to %s: %s" % (self.file_name, e))
+
+    def close(self):
+        """
+        Ends the JSON array of the trace file, if we have one. Called at shutdown.
+        """
+        if self._trace_file is not None:
+            try:
+                self._trace_file.write("\n]\n")
+                self._trace_file.close()
+            except IOError, e:
+                log.error("Could not write the join trace to %s: %s" % (self.file_name, e))
+            self._trace_file = None
+            self.file_name = None
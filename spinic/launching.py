@@ -5,17 +5,43 @@ Spinic uses lunch master as a library to launch spinviewer and milhouse.
 if __name__ == "__main__": # just a reminder
     from twisted.internet import gtk2reactor
     gtk2reactor.install() # has to be done before importing reactor
+import os
 from twisted.internet import reactor
 from twisted.internet import task
+from twisted.internet import utils
+from twisted.python import procutils
 from lunch import master
-from lunch import gui
 from lunch import logger
+from lunch import sig
+from spinic import metrics
 
 log = None
 
+_commands_added = metrics.counter("launching.commands_added", "Commands added to lunch, such as milhouse streamers")
+_commands_removed = metrics.counter("launching.commands_removed", "Commands removed from lunch")
+_run_once_calls = metrics.counter("launching.run_once", "Commands run once, such as firereset")
+
+def run_once(executable, *args):
+    """
+    Runs a command, without looking at its output or return value.
+    Returns a Deferred or None.
+
+    Same as lunch.gui.run_once, but does not import gtk.
+    """
+    try:
+        executable = procutils.which(executable)[0]
+    except IndexError:
+        log.error("Could not find executable %s" % (executable))
+        return None
+    else:
+        log.info("$ %s %s" % (executable, " ".join(list(args))))
+        _run_once_calls.increment()
+        return utils.getProcessValue(executable, args, os.environ, '.', reactor)
+
 class ProcessLauncher(object):
     """
     Process launching with Lunch + a window.
+    In headless mode, there is no lunch window.
 
     Might raise a RuntimeError
     """
@@ -27,6 +53,9 @@ class ProcessLauncher(object):
         self.has_ever_started_viewer = False
         self.spinviewer_fps = spinviewer_fps
         unique_master_id = "spinic"
+        if self.app.config.headless:
+            # many headless spinic instances might run on the same host
+            unique_master_id = "spinic-%s" % (self.user_id)
         log_dir = master.DEFAULT_LOG_DIR
         log_level = 'warning'
         if self.app.config.verbose:
@@ -38,7 +67,11 @@ class ProcessLauncher(object):
         pid_file = master.write_master_pid_file(identifier=unique_master_id, directory=log_dir)
         # might raise a RuntimeError:
         self.lunch_master = master.Master(log_dir=log_dir, pid_file=pid_file, verbose=True)
-        self.lunch_gui = gui.start_gui(self.lunch_master)
+        self.lunch_gui = None
+        self.child_running_signal = sig.Signal() # args: identifier. Triggered when the child process of a command we added is running.
+        if not self.app.config.headless:
+            from lunch import gui
+            self.lunch_gui = gui.start_gui(self.lunch_master)
         self._start()
     
     def _start(self):
@@ -51,7 +84,8 @@ class ProcessLauncher(object):
         _command = self._prepare_spin_viewer_command_line()
         self.lunch_master.add_command(commands.Command("ps aux | grep milhouse | grep -v grep", identifier="list_milhouse", respawn=False))
         # self.lunch_master.add_command(commands.Command("rm /dev/shm/spinic-*@*", identifier="clean_shm", respawn=False))
-        self.lunch_master.add_command(commands.Command(_command, identifier="spinviewer", enabled=False))
+        if not self.app.config.headless: # there is no display to show the viewer in headless mode
+            self.lunch_master.add_command(commands.Command(_command, identifier="spinviewer", enabled=False))
         self.lunch_master.add_command(commands.Command("pd -jack", identifier="puredata", enabled=False)) # this command is changed later on, when we connect to a server
         #self.lunch_master.add_command(commands.Command("spinserver --scene-id %s" % (scene_id), identifier="spinserver"))
         self.lunch_master.add_command(commands.Command("jack.plumbing", identifier="jack_plumbing")) 
@@ -65,18 +99,52 @@ class ProcessLauncher(object):
         if display is not None:
             env["DISPLAY"] = display
         if hostname is None:
-            self.lunch_master.add_command(commands.Command(command_txt, identifier=identifier, env=env))
+            command = commands.Command(command_txt, identifier=identifier, env=env)
         else:
-            self.lunch_master.add_command(commands.Command(command_txt, identifier=identifier, host=hostname, env=env))
+            command = commands.Command(command_txt, identifier=identifier, host=hostname, env=env)
+        command.child_state_changed_signal.connect(self._on_child_state_changed)
+        self.lunch_master.add_command(command)
+        _commands_added.increment()
         # TODO: allow to remove commands as well...
         # TODO: convert hostname to IP if it is not already an IP.
 
+    def _on_child_state_changed(self, command, new_state):
+        """
+        Slot for the child_state_changed_signal of the commands we add.
+        """
+        from lunch import commands
+        if new_state == commands.STATE_RUNNING:
+            self.child_running_signal(command.identifier)
+
     def remove_command(self, identifier):
         """
         Wraps the remove_command method of L{lunch.master.Master}
         """
         self.lunch_master.remove_command(identifier)
+        _commands_removed.increment()
     
+    def suspend_command(self, identifier):
+        """
+        Stops the child process of a command, but keeps the command, so that it can be resumed.
+        """
+        try:
+            command = self.lunch_master.get_command(identifier)
+        except KeyError:
+            log.warning("Cannot suspend unknown command %s" % (identifier))
+        else:
+            command.stop()
+
+    def resume_command(self, identifier):
+        """
+        Starts again the child process of a command stopped with suspend_command.
+        """
+        try:
+            command = self.lunch_master.get_command(identifier)
+        except KeyError:
+            log.warning("Cannot resume unknown command %s" % (identifier))
+        else:
+            command.start()
+
     def _prepare_spin_viewer_command_line(self):
         """
         @rtype: C{str}
@@ -120,8 +188,9 @@ class ProcessLauncher(object):
 
             #FIXME: we should add a method in lunch.commands.Command to update the command line
             #XXX: if those are now running, we'll need to stop and restart them. Right now, we use the hack below. 
-            self.lunch_master.commands["spinviewer"].command = self._prepare_spin_viewer_command_line()
-            self.lunch_master.commands["spinviewer"].enabled = True # Done by calling restart_all() anyways.
+            if self.lunch_master.commands.has_key("spinviewer"):
+                self.lunch_master.commands["spinviewer"].command = self._prepare_spin_viewer_command_line()
+                self.lunch_master.commands["spinviewer"].enabled = True # Done by calling restart_all() anyways.
             self.lunch_master.commands["puredata"].command = self._prepare_pd_command_line()
             self.lunch_master.commands["puredata"].enabled = True # Done by calling restart_all() anyways.
             #TODO:2010-07-28:aalex:Should only restart the spinviewer and pd when we switch scene
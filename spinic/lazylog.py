@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""
+Debug logging for the code that runs for each OSC message we send or receive.
+
+log.debug("Got %s" % (message)) converts the message to a string even when the debug level is disabled, which it is most of the time. With a LazyLogger, the arguments are only formatted if the message is going to be logged, and whether it is is checked with a single attribute lookup.
+
+A LazyLogger can also log only one of every N messages, for the handlers that get many messages per second.
+"""
+import logging
+
+class LazyLogger(object):
+    """
+    Wraps a logger from L{lunch.logger.start}.
+    """
+    def __init__(self, logger, sample_every=1):
+        """
+        @param logger: L{logging.Logger}
+        @param sample_every: Logs only one of every N debug messages.
+        @type sample_every: C{int}
+        """
+        self.logger = logger
+        self.sample_every = max(1, sample_every)
+        self.debug_enabled = False
+        self._count = 0
+        self.refresh_level()
+
+    def refresh_level(self):
+        """
+        Checks again the level of the logger. Should be called if it changes.
+        The lunch logger's level is set when we start it, so it doesn't happen often.
+        """
+        self.debug_enabled = self.logger.isEnabledFor(logging.DEBUG)
+
+    def debug(self, fmt, *args):
+        """
+        Formats and logs the message if the debug level is enabled, for one of every sample_every calls.
+        """
+        if not self.debug_enabled:
+            return
+        if self.sample_every != 1:
+            self._count += 1
+            if self._count % self.sample_every != 0:
+                return
+            fmt = "[1/%d] %s" % (self.sample_every, fmt)
+        if len(args) != 0:
+            self.logger.debug(fmt % args)
+        else:
+            self.logger.debug(fmt)
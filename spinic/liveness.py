@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Tools to forget about things we have not heard of for a while. (SPIN servers, users)
+"""
+import math
+
+class TimerWheel(object):
+    """
+    Hashed timer wheel that finds the keys whose last-seen time is older than a timeout.
+
+    Seeing a key again does not touch the wheel: we only update its last-seen time, wherever it is stored.
+    When the slot of a key comes up, we check its last-seen time, and either expire it or put it back in the slot of its new expiry time.
+    """
+    def __init__(self, timeout, resolution=1.0):
+        """
+        @param timeout: Number of seconds after which a key expires.
+        @param resolution: Number of seconds per slot.
+        """
+        self.timeout = timeout
+        self.resolution = resolution
+        self._slots = [[] for i in range(int(math.ceil(timeout / resolution)) + 2)]
+        self._scheduled = {} # key: tick of the slot it is in. Entries for other ticks in the slots are stale.
+        self._current_tick = None # last tick that has been swept
+
+    def _tick_for_time(self, t):
+        return int(t / self.resolution)
+
+    def add(self, key, last_seen):
+        """
+        Starts tracking a key. Does nothing if it is already tracked.
+        """
+        if key in self._scheduled:
+            return
+        tick = self._tick_for_time(last_seen + self.timeout) + 1
+        if self._current_tick is not None and tick <= self._current_tick:
+            tick = self._current_tick + 1
+        self._scheduled[key] = tick
+        self._slots[tick % len(self._slots)].append(key)
+
+    def discard(self, key):
+        """
+        Stops tracking a key. It is removed from its slot lazily.
+        """
+        self._scheduled.pop(key, None)
+
+    def sweep(self, now, get_last_seen):
+        """
+        Returns the list of keys that expired.
+
+        @param now: Current time.
+        @param get_last_seen: Callable that returns the last-seen time of a key, or None if it is not tracked anymore.
+        @rtype: C{list}
+        """
+        expired = []
+        now_tick = self._tick_for_time(now)
+        if self._current_tick is None:
+            self._current_tick = now_tick - 1
+        # We never need to look at more than a full turn of the wheel.
+        first_tick = max(self._current_tick + 1, now_tick - len(self._slots) + 1)
+        for tick in range(first_tick, now_tick + 1):
+            self._current_tick = tick
+            index = tick % len(self._slots)
+            keys = self._slots[index]
+            self._slots[index] = []
+            for key in keys:
+                scheduled_tick = self._scheduled.get(key)
+                if scheduled_tick is None or scheduled_tick % len(self._slots) != index:
+                    continue # stale entry
+                if scheduled_tick > tick:
+                    self._slots[index].append(key) # for the next turn
+                    continue
+                del self._scheduled[key]
+                last_seen = get_last_seen(key)
+                if last_seen is None:
+                    pass
+                elif last_seen + self.timeout <= now:
+                    expired.append(key)
+                else:
+                    self.add(key, last_seen)
+        self._current_tick = now_tick
+        return expired
+
+    def __len__(self):
+        return len(self._scheduled)
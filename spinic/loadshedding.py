@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""
+Sheds some load when the reactor falls behind.
+
+The lag measured by L{spinic.metrics.LagProbe} is smoothed, and mapped to a tier:
+ * 0, normal: everything runs.
+ * 1, throttle_gui: the statistics in the GUI are updated less often.
+ * 2, decimate_6dof: we choose the cameras we see the users with less often, after their global6DOF messages.
+ * 3, defer_sends: the messages that can wait, such as the automatic refresh, are sent once we recover. The ping of our UserNode is always sent, since the other users forget it if they do not hear from it.
+
+Each tier includes the ones below it. We enter a tier as soon as the smoothed lag reaches its threshold, and leave it one tier at a time, once the lag has been well below its threshold for a while.
+
+This module does not start its logger at import time, since it is imported by modules that are imported before lunch's logging is set up.
+"""
+import time
+from lunch import sig
+from spinic import metrics
+
+log = None
+
+TIER_NAMES = ["normal", "throttle_gui", "decimate_6dof", "defer_sends"]
+TIER_THROTTLE_GUI = 1
+TIER_DECIMATE_6DOF = 2
+TIER_DEFER_SENDS = 3
+DEFAULT_THRESHOLDS = (0.05, 0.15, 0.4) # seconds of smoothed lag to enter tiers 1, 2 and 3
+SMOOTHING = 0.3 # weight of the last lag in the moving average
+RECOVERY_RATIO = 0.5 # we leave a tier once the lag is below this fraction of its threshold...
+RECOVERY_TIME = 2.0 # ...for this many seconds
+GUI_THROTTLE_FACTOR = 5 # in tier 1 and up, the statistics are updated once every N times
+SIX_DOF_DECIMATION = 4 # in tier 2 and up, the cameras are chosen N times less often...
+MIN_DECIMATED_INTERVAL = 0.1 # ...and at most every this many seconds
+
+_tier_gauge = metrics.gauge("loadshedding.tier", "Current load shedding tier. 0 is normal.")
+_smoothed_lag_gauge = metrics.gauge("loadshedding.smoothed_lag_seconds", "Smoothed reactor lag used to choose the tier")
+_tier_changes = metrics.counter("loadshedding.tier_changes", "Times the load shedding tier changed")
+_tier_entered = [metrics.counter("loadshedding.entered.%s" % (name), "Times we entered the %s tier" % (name)) for name in TIER_NAMES]
+_skipped_gui_updates = metrics.counter("loadshedding.skipped_gui_updates", "Updates of the GUI statistics skipped")
+_decimated_camera_selections = metrics.counter("loadshedding.decimated_camera_selections", "Camera selections delayed since the reactor lags")
+_deferred_sends = metrics.counter("loadshedding.deferred_sends", "Sends deferred until we recover")
+
+def parse_thresholds(txt):
+    """
+    Parses comma-separated lag thresholds, in seconds, such as "0.05,0.15,0.4".
+
+    Might raise a RuntimeError
+    @rtype: C{tuple}
+    """
+    try:
+        thresholds = tuple([float(value) for value in txt.split(",")])
+    except ValueError, e:
+        raise RuntimeError("Invalid lag thresholds %s: %s" % (txt, e))
+    if len(thresholds) != len(TIER_NAMES) - 1:
+        raise RuntimeError("There should be %d lag thresholds, not %d." % (len(TIER_NAMES) - 1, len(thresholds)))
+    if list(thresholds) != sorted(thresholds):
+        raise RuntimeError("The lag thresholds should be in increasing order: %s" % (txt))
+    return thresholds
+
+class LoadShedder(object):
+    """
+    Chooses the tier from the reactor lag, and tells the other objects what to skip.
+    """
+    def __init__(self, thresholds=DEFAULT_THRESHOLDS):
+        """
+        @param thresholds: Smoothed lag, in seconds, at which we enter each tier above normal.
+        """
+        global log
+        from lunch import logger
+        log = logger.start(name="loadshedding")
+        self.thresholds = tuple(thresholds)
+        self.tier = 0
+        self.smoothed_lag = 0.0
+        self.tier_changed_signal = sig.Signal() # args: tier
+        self._recovering_since = None
+        self._gui_updates = 0
+        self._deferred = {} # keys are names, so that a send deferred twice is only done once. Values are (function, args).
+        self._deferred_order = []
+
+    def on_lag(self, lag):
+        """
+        Slot for the L{spinic.metrics.LagProbe.tick_signal} signal.
+        """
+        self.smoothed_lag += SMOOTHING * (lag - self.smoothed_lag)
+        _smoothed_lag_gauge.set(self.smoothed_lag)
+        tier = 0
+        for index, threshold in enumerate(self.thresholds):
+            if self.smoothed_lag >= threshold:
+                tier = index + 1
+        if tier > self.tier:
+            self._recovering_since = None
+            self._set_tier(tier)
+        elif self.tier > 0 and self.smoothed_lag < self.thresholds[self.tier - 1] * RECOVERY_RATIO:
+            now = time.time()
+            if self._recovering_since is None:
+                self._recovering_since = now
+            elif now - self._recovering_since >= RECOVERY_TIME:
+                self._recovering_since = None
+                self._set_tier(self.tier - 1)
+        else:
+            self._recovering_since = None
+
+    def _set_tier(self, tier):
+        log.warning("Reactor lag is %.0f ms. Load shedding tier: %s -> %s" % (self.smoothed_lag * 1000.0, TIER_NAMES[self.tier], TIER_NAMES[tier]))
+        self.tier = tier
+        _tier_gauge.set(tier)
+        _tier_changes.increment()
+        _tier_entered[tier].increment()
+        if tier < TIER_DEFER_SENDS:
+            self._flush_deferred()
+        self.tier_changed_signal(tier)
+
+    def should_update_gui_stats(self):
+        """
+        Called each time the statistics in the GUI are due.
+        @rtype: C{bool}
+        """
+        if self.tier < TIER_THROTTLE_GUI:
+            return True
+        self._gui_updates += 1
+        if self._gui_updates % GUI_THROTTLE_FACTOR == 0:
+            return True
+        _skipped_gui_updates.increment()
+        return False
+
+    def get_camera_selection_interval(self, interval):
+        """
+        Called each time the cameras are to be chosen after some global6DOF messages.
+        @param interval: Minimum number of seconds between two camera selections, when the reactor does not lag.
+        @rtype: C{float}
+        """
+        if self.tier < TIER_DECIMATE_6DOF:
+            return interval
+        _decimated_camera_selections.increment()
+        return max(interval * SIX_DOF_DECIMATION, MIN_DECIMATED_INTERVAL)
+
+    def send_or_defer(self, name, function, *args):
+        """
+        Calls the function, or defers it until we leave the defer_sends tier.
+        If a send with the same name is already deferred, it is replaced.
+        @param name: Identifies the send, such as "refresh".
+        """
+        if self.tier < TIER_DEFER_SENDS:
+            function(*args)
+        else:
+            _deferred_sends.increment()
+            if not self._deferred.has_key(name):
+                self._deferred_order.append(name)
+            self._deferred[name] = (function, args)
+
+    def _flush_deferred(self):
+        deferred = self._deferred
+        order = self._deferred_order
+        self._deferred = {}
+        self._deferred_order = []
+        for name in order:
+            function, args = deferred[name]
+            try:
+                function(*args)
+            except Exception, e:
+                log.error("Deferred send %s failed: %s" % (name, e))
+
+    def get_summary(self):
+        """
+        @rtype: C{dict}
+        """
+        return {
+            "tier": TIER_NAMES[self.tier],
+            "smoothed lag": "%.0f ms" % (self.smoothed_lag * 1000.0),
+            "deferred sends": str(len(self._deferred)),
+            }
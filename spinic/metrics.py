@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+"""
+Counters, gauges and histograms for the spinic subsystems.
+
+The modules get their metrics once, at import time, and update them in place:
+
+    _messages = metrics.counter("osc.messages", "OSC messages received")
+    ...
+    _messages.increment()
+
+Histograms have fixed buckets, so that observing a value only increments an integer in a preallocated list.
+
+The whole registry can be exported as JSON or as text, through a local HTTP endpoint and in a snapshot file that is rewritten periodically. See L{MetricsExporter}.
+
+This module does not start its logger at import time, since it is imported by modules that are imported before lunch's logging is set up. It does not import the reactor at import time either, since it is imported before the reactor is installed.
+"""
+import os
+import json
+import time
+import bisect
+from twisted.internet import task
+from lunch import sig
+
+log = None
+
+# Upper bounds of the buckets of histograms of durations, in seconds. There is an overflow bucket after the last one.
+DURATION_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+class Counter(object):
+    """
+    Value that only increases.
+    """
+    __slots__ = ["name", "help", "value"]
+    kind = "counter"
+
+    def __init__(self, name, help=""):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def increment(self, amount=1):
+        self.value += amount
+
+    def to_dict(self):
+        return {"type": self.kind, "value": self.value}
+
+class Gauge(Counter):
+    """
+    Value that can go up and down.
+    """
+    __slots__ = []
+    kind = "gauge"
+
+    def set(self, value):
+        self.value = value
+
+class Histogram(object):
+    """
+    Distribution of values, counted in fixed buckets.
+    """
+    __slots__ = ["name", "help", "buckets", "counts", "count", "sum", "max"]
+    kind = "histogram"
+
+    def __init__(self, name, help="", buckets=DURATION_BUCKETS):
+        """
+        @param buckets: Sorted upper bounds of the buckets.
+        """
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # the last one is for values greater than the last bound
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def get_percentile(self, percentile):
+        """
+        Returns the upper bound of the bucket the given percentile falls in.
+        Returns the maximum if it falls in the overflow bucket, and 0.0 if there are no values.
+        @param percentile: In the range [0, 100]
+        @rtype: C{float}
+        """
+        if self.count == 0:
+            return 0.0
+        rank = self.count * percentile / 100.0
+        total = 0
+        for index, count in enumerate(self.counts):
+            total += count
+            if total >= rank and count != 0:
+                if index < len(self.buckets):
+                    return self.buckets[index]
+                return self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            "type": self.kind,
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "buckets": [[bound, count] for bound, count in zip(self.buckets, self.counts)] + [["+Inf", self.counts[-1]]],
+            "p50": self.get_percentile(50),
+            "p99": self.get_percentile(99),
+            }
+
+class Registry(object):
+    """
+    All the metrics, by name.
+    """
+    def __init__(self):
+        self.metrics = {}
+        self.start_time = time.time()
+
+    def _get_or_create(self, cls, name, *args):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = cls(name, *args)
+            self.metrics[name] = metric
+        elif not isinstance(metric, cls) or metric.kind != cls.kind:
+            raise RuntimeError("Metric %s is already registered as a %s." % (name, metric.kind))
+        return metric
+
+    def counter(self, name, help=""):
+        """
+        @rtype: L{Counter}
+        """
+        return self._get_or_create(Counter, name, help)
+
+    def gauge(self, name, help=""):
+        """
+        @rtype: L{Gauge}
+        """
+        return self._get_or_create(Gauge, name, help)
+
+    def histogram(self, name, help="", buckets=DURATION_BUCKETS):
+        """
+        @rtype: L{Histogram}
+        """
+        return self._get_or_create(Histogram, name, help, buckets)
+
+    def snapshot(self):
+        """
+        @rtype: C{dict}
+        """
+        ret = {}
+        for name, metric in self.metrics.iteritems():
+            ret[name] = metric.to_dict()
+        return {
+            "time": time.time(),
+            "uptime": time.time() - self.start_time,
+            "metrics": ret,
+            }
+
+    def to_json(self):
+        """
+        @rtype: C{str}
+        """
+        return json.dumps(self.snapshot(), indent=1, sort_keys=True)
+
+    def to_text(self):
+        """
+        One line per value, in the Prometheus text format.
+        @rtype: C{str}
+        """
+        lines = []
+        for name in sorted(self.metrics.keys()):
+            metric = self.metrics[name]
+            prefix = "spinic_" + name.replace(".", "_")
+            if metric.help:
+                lines.append("# HELP %s %s" % (prefix, metric.help))
+            lines.append("# TYPE %s %s" % (prefix, metric.kind))
+            if metric.kind == "histogram":
+                total = 0
+                for bound, count in zip(metric.buckets, metric.counts):
+                    total += count
+                    lines.append("%s_bucket{le=\"%s\"} %d" % (prefix, bound, total))
+                lines.append("%s_bucket{le=\"+Inf\"} %d" % (prefix, metric.count))
+                lines.append("%s_sum %s" % (prefix, metric.sum))
+                lines.append("%s_count %d" % (prefix, metric.count))
+            else:
+                lines.append("%s %s" % (prefix, metric.value))
+        return "\n".join(lines) + "\n"
+
+# The registry every module records into:
+registry = Registry()
+
+def counter(name, help=""):
+    """
+    @rtype: L{Counter}
+    """
+    return registry.counter(name, help)
+
+def gauge(name, help=""):
+    """
+    @rtype: L{Gauge}
+    """
+    return registry.gauge(name, help)
+
+def histogram(name, help="", buckets=DURATION_BUCKETS):
+    """
+    @rtype: L{Histogram}
+    """
+    return registry.histogram(name, help, buckets)
+
+class LagProbe(object):
+    """
+    Measures how late the reactor runs a call scheduled at a fixed interval.
+    When the reactor is busy (GUI redraws, process launching, handlers), the lag grows.
+    """
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.lag = 0.0 # seconds, for the last tick
+        self.histogram = histogram("reactor.lag_seconds", "How late the reactor runs a call scheduled every %s seconds" % (interval))
+        self.gauge = gauge("reactor.lag_last_seconds", "Lag of the reactor at the last tick")
+        self.tick_signal = sig.Signal() # args: lag
+        self._expected_time = None
+        self._delayed_call = None
+
+    def start(self):
+        self._schedule()
+
+    def stop(self):
+        if self._delayed_call is not None and self._delayed_call.active():
+            self._delayed_call.cancel()
+        self._delayed_call = None
+
+    def _schedule(self):
+        from twisted.internet import reactor
+        self._expected_time = time.time() + self.interval
+        self._delayed_call = reactor.callLater(self.interval, self._tick)
+
+    def _tick(self):
+        self.lag = max(0.0, time.time() - self._expected_time)
+        self.histogram.observe(self.lag)
+        self.gauge.set(self.lag)
+        self._schedule()
+        self.tick_signal(self.lag)
+
+class MetricsExporter(object):
+    """
+    Serves the metrics over HTTP on localhost, and writes them periodically to a file.
+     * http://127.0.0.1:<port>/metrics: text
+     * http://127.0.0.1:<port>/metrics.json: JSON
+
+    Might raise a RuntimeError
+    """
+    def __init__(self, port=None, snapshot_file=None, snapshot_interval=10.0):
+        global log
+        from lunch import logger
+        log = logger.start(name="metrics")
+        self.port = port
+        self.snapshot_file = snapshot_file
+        self.snapshot_interval = snapshot_interval
+        self._listening_port = None
+        self._looping_snapshot = task.LoopingCall(self.write_snapshot)
+
+    def start(self):
+        if self.port is not None:
+            self._start_http_endpoint()
+        if self.snapshot_file is not None:
+            log.info("Writing the metrics to %s every %s seconds." % (self.snapshot_file, self.snapshot_interval))
+            self._looping_snapshot.start(self.snapshot_interval, now=False)
+            from twisted.internet import reactor
+            reactor.addSystemEventTrigger("before", "shutdown", self.write_snapshot)
+
+    def _start_http_endpoint(self):
+        from twisted.internet import error
+        from twisted.internet import reactor
+        from twisted.web import server
+        from twisted.web import resource
+
+        class _MetricsResource(resource.Resource):
+            isLeaf = True
+            def render_GET(self, request):
+                if request.path == "/metrics.json":
+                    request.setHeader("Content-Type", "application/json")
+                    return registry.to_json()
+                elif request.path in ("/", "/metrics"):
+                    request.setHeader("Content-Type", "text/plain; version=0.0.4")
+                    return registry.to_text()
+                else:
+                    request.setResponseCode(404)
+                    return "Not found. Try /metrics or /metrics.json\n"
+
+        try:
+            self._listening_port = reactor.listenTCP(self.port, server.Site(_MetricsResource()), interface="127.0.0.1")
+        except error.CannotListenError, e:
+            raise RuntimeError("Cannot serve the metrics: %s" % (e))
+        log.info("Serving the metrics on http://127.0.0.1:%d/metrics" % (self.port))
+
+    def write_snapshot(self):
+        """
+        Writes the JSON snapshot to a temporary file, and renames it, so that readers never see a partial file.
+        """
+        file_name = os.path.expanduser(self.snapshot_file)
+        tmp_name = file_name + ".tmp"
+        try:
+            f = open(tmp_name, "w")
+            try:
+                f.write(registry.to_json())
+            finally:
+                f.close()
+            os.rename(tmp_name, file_name)
+        except (IOError, OSError), e:
+            log.error("Could not write the metrics to %s: %s" % (file_name, e))
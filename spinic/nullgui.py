@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""
+GUI that does nothing, for the headless mode.
+
+It does not import gtk.
+"""
+from lunch import logger
+
+log = logger.start(name="nullgui")
+
+class NullGui(object):
+    """
+    Implements the methods of L{spinic.gui.Gui} that the other objects of spinic call, but does not display anything.
+    """
+    def __init__(self, app=None):
+        self.app = app
+        self.process_launcher = app.launcher
+        self.app.on_window_shown() # there is no window to wait for
+
+    def update_server_list(self, servers):
+        log.debug("update_server_list %s" % (servers))
+
+    def choose_server_and_click_connect(self, scene_id):
+        """
+        Called from the OSC interface if the user has set a default scene ID from the command line interface. 
+        """
+        log.debug("choose_server_and_click_connect %s" % (scene_id))
+        if self.app.osc_interface is None:
+            log.error("Cannot switch server. No OSC interface set yet.")
+        else:
+            self.app.osc_interface.choose_server(scene_id)
+
+    def update_connected_state(self, connected=False):
+        log.info("Connected: %s" % (connected))
+
+    def update_node_list(self, node_type, node_list):
+        pass
+
+    def remove_node(self, node_type, node_id):
+        pass
+
+    def update_user_param(self, user_id, key, value):
+        pass
+
+    def update_stats(self, section, values):
+        pass
+
+    def clear_nodes(self):
+        pass
+
+    def update_cameras_text(self, text):
+        log.info("Cameras: %s" % (text.replace("\n", " ")))
+
@@ -12,12 +12,13 @@ Lexicon:
 
 When spinic sees two user nodes with cameras, he launches a Milhouse sender for his user nodes cameras to the other user's reciver host and port.
 """
-#TODO: Clear servers that are dead. (after a timeout of 30 s)
 #TODO: Stop streamers when I leave a scene.
 #TODO: restart spinviewer when we choose another server
 
 import sys
 import math
+import time
+import array
 from twisted.internet import reactor
 from twisted.internet import defer
 from twisted.internet import error
@@ -28,17 +29,79 @@ from txosc import dispatch
 from txosc import async
 from lunch import logger
 from spinic import cameras
+from spinic import oscthread
+from spinic import udpstats
+from spinic import liveness
+from spinic import tcpsender
+from spinic import userparams
+from spinic import lazylog
+from spinic import metrics
+from spinic import capture
+from spinic import jointrace
+from spinic import fastosc
+from spinic import sendcache
+from spinic import spatial
+from spinic import culling
 from lunch import sig
 
 log = logger.start(name="osc")
 
+THREAD_DROPS_WARNING_INTERVAL = 10.0 # seconds between two warnings about the elements dropped by the receiver thread
+REPUBLISH_DELAY = 1.0 # seconds we wait before creating our UserNode again, once the scene deleted it, so that a restarting spinviewer can create it first
+
+_spin_server_messages = metrics.counter("osc.handler.spin_server", "/SPIN/__server__ messages handled")
+_spin_any_messages = metrics.counter("osc.handler.spin_any", "/SPIN/<scene> messages handled")
+_spin_any_any_messages = metrics.counter("osc.handler.spin_any_any", "/SPIN/<scene>/<node> messages handled")
+_user_param_messages = metrics.counter("osc.handler.user_param", "setParam messages handled for UserNode nodes")
+_user_6dof_messages = metrics.counter("osc.handler.user_6dof", "global6DOF messages handled for UserNode nodes")
+_invalid_poses = metrics.counter("osc.invalid_poses", "global6DOF messages ignored since their pose was not finite")
+_user_6dof_duration = metrics.histogram("osc.user_6dof_seconds", "Time to store the pose of a global6DOF message")
+_camera_selections = metrics.counter("osc.camera_selections", "Passes choosing the camera we see the users that moved with")
+_camera_selection_duration = metrics.histogram("osc.camera_selection_seconds", "Time to choose the camera we see the users that moved with")
+_camera_switches = metrics.counter("osc.camera_switches", "Times we switched the camera we see a user with")
+_sent_udp = metrics.counter("osc.sent_udp", "OSC elements sent with UDP")
+_sent_tcp = metrics.counter("osc.sent_tcp", "OSC elements sent with TCP")
+_servers_gauge = metrics.gauge("osc.servers", "SPIN servers we know of")
+_users_gauge = metrics.gauge("osc.users", "UserNode nodes in the current scene")
+_receiver_queue_gauge = metrics.gauge("osc.receiver_queue_length", "Elements waiting in the queue of the receiver thread")
+_info_rate_gauge = metrics.gauge("udp.info_rate", "Datagrams per second on the info channel")
+_scene_rate_gauge = metrics.gauge("udp.scene_rate", "Datagrams per second on the scene channel")
+_info_drops_gauge = metrics.gauge("udp.info_drops", "Datagrams dropped by the kernel on the info channel")
+_scene_drops_gauge = metrics.gauge("udp.scene_drops", "Datagrams dropped by the kernel on the scene channel")
+
+class CountingMulticastDatagramServerProtocol(async.MulticastDatagramServerProtocol):
+    """
+    Counts the datagrams it receives in a L{spinic.udpstats.ChannelStats}, and records them if we capture them.
+
+    If it has a pose handler, the global6DOF messages are decoded with L{spinic.fastosc} and given to it, instead of to the txosc receiver.
+    """
+    def __init__(self, receiver, multicast_addr, stats, capture=None, pose_handler=None):
+        async.MulticastDatagramServerProtocol.__init__(self, receiver, multicast_addr=multicast_addr)
+        self.stats = stats
+        self.capture = capture
+        self.pose_handler = pose_handler
+
+    def datagramReceived(self, data, address):
+        self.stats.datagrams_received += 1
+        if self.capture is not None:
+            self.capture(data, address)
+        if self.pose_handler is not None:
+            decoded = fastosc.decode_global6dof(data)
+            if decoded is not None and self.pose_handler(decoded[0], decoded[1], address):
+                return
+        async.MulticastDatagramServerProtocol.datagramReceived(self, data, address)
+
 class ServerInfo(object):
     """
     Info about a SPIN server / scene
     """
+    __slots__ = ["scene_id", "server_host", "server_recv_addr", "server_recv_port", "server_send_addr", "server_send_port", "server_tcp_recv_port", "last_seen"]
+
     #TODO: use kwargs instead of args.
-    def __init__(self, scene_id, server_recv_addr, server_recv_port, server_send_addr, server_send_port, server_tcp_recv_port):
+    def __init__(self, scene_id, server_recv_addr, server_recv_port, server_send_addr, server_send_port, server_tcp_recv_port, server_host=None):
         self.scene_id = scene_id
+        # IP of the host the server runs on. (the address it announces itself from)
+        self.server_host = server_host
         # Server receives:
         self.server_recv_addr = server_recv_addr
         self.server_recv_port = int(server_recv_port)
@@ -48,29 +111,41 @@ class ServerInfo(object):
         # Other receive ports:
         #self.sync_port = sync_port
         self.server_tcp_recv_port = int(server_tcp_recv_port)
-        
-        log.info("ServerInfo: ID: %s. Server recv: %s:%s. Server send: %s:%s. TCP port: %s" % ( scene_id, server_recv_addr, server_recv_port, server_send_addr, server_send_port, server_tcp_recv_port))
+        self.last_seen = time.time() # updated each time we get a /SPIN/__server__ for it
+
+    def __str__(self):
+        return "ServerInfo: ID: %s. Server recv: %s:%s. Server send: %s:%s. TCP port: %s" % (self.scene_id, self.server_recv_addr, self.server_recv_port, self.server_send_addr, self.server_send_port, self.server_tcp_recv_port)
 
 class UserNodeInfo(object):
     """
     Information regarding a user node in the SPIN scene graph.
+    
+    The position and orientation arrays are updated in place, so that handling the 6DOF messages does not allocate anything.
     """
-    # TODO: not used yet!
+    __slots__ = ["name", "position", "orientation", "current_camera", "params", "camera_config", "streaming_is_on", "senders_paused", "readiness", "last_activity"]
+
     def __init__(self, name):
         self.name = name
-        self.position = [0.0, 0.0, 0.0] # x y z
-        self.orientation = [0.0, 0.0, 0.0] # roll pitch yaw
+        self.position = array.array("d", [0.0, 0.0, 0.0]) # x y z
+        self.orientation = array.array("d", [0.0, 0.0, 0.0]) # roll pitch yaw
         self.current_camera = None # str
-        self.params = {} # list of params. The cameras are in the form cameras[1]: <camera_id>@<from_address>
+        self.params = {} # list of params, as strings. The cameras are in the form cameras[1]: <camera_id>@<from_address>
+        self.camera_config = cameras.CamerasConfig() # the params, decoded as they arrive
         self.streaming_is_on = False
+        self.senders_paused = False # True if the user paused its video receivers for us. See spinic.culling
+        self.readiness = userparams.ReadinessTracker() # tells us when we have all its params
+        self.last_activity = time.time() # updated each time we get a message for that node
 
 class SceneInfo(object):
     """
     Information regarding a SPIN scene graph.
     """
+    __slots__ = ["all_nodes", "user_nodes", "spatial_index"]
+
     def __init__(self):
         self.all_nodes = {} # nodeType: list of node names
         self.user_nodes = {} #TODO: not used yet.
+        self.spatial_index = spatial.GridIndex() # positions of the users, updated with their global6DOF
     
 class SpinicOscInterface(object):
     """
@@ -97,64 +172,174 @@ class SpinicOscInterface(object):
         self._scene_sender_protocol = None
         self.scene_receiver = None
         self.scene_sender = None
+        self.tcp_sender = None # for the messages that change the state of the scene
+        self.message_cache = sendcache.EncodedMessageCache() # the messages we send often, already encoded
+        
+        # Statistics on the sockets of both channels:
+        self.info_stats = udpstats.ChannelStats("info")
+        self.scene_stats = udpstats.ChannelStats("scene")
+        self._last_auto_refresh_time = 0.0
+        
+        # Capture of the datagrams of both channels, if enabled:
+        self.capture_writer = None
+        if self.app.config.capture_file is not None:
+            try:
+                self.capture_writer = capture.CaptureWriter(self.app.config.capture_file)
+            except IOError, e:
+                log.error("Cannot capture the OSC messages: %s" % (e))
+            else:
+                log.warning("Capturing the OSC messages we receive to %s" % (self.app.config.capture_file))
+                reactor.addSystemEventTrigger("after", "shutdown", self.capture_writer.close)
+
+        # Timeline of the join with each peer:
+        self.join_tracer = jointrace.JoinTracer(file_name=self.app.config.join_trace_file)
+        self.app.launcher.child_running_signal.connect(self.join_tracer.on_command_running)
+        if self.app.config.join_trace_file is not None:
+            reactor.addSystemEventTrigger("before", "shutdown", self.join_tracer.close)
+
+        # Receiver thread, which owns the sockets of both channels, if enabled:
+        self.receiver_thread = None
+        if self.app.config.enable_receiver_thread:
+            self.receiver_thread = oscthread.ReceiverThread()
+        self._unreported_thread_drops = 0
+        self._last_thread_drops_warning_time = 0.0
 
         # Tracking SPIN scenes/servers:
         self.servers = {} # keys are their names. Values are ServerInfo instances.
+        self._servers_wheel = liveness.TimerWheel(self.app.config.server_timeout)
+        self._users_wheel = liveness.TimerWheel(self.app.config.user_timeout)
         self.scenes = {} # keys are their names. Values are SceneInfo instances.
         self.current_server_id = None # str
         self.my_user_id = self.app.config.user_id # ID of the user for the spinviewer
+
+        # Debug logging for the code that runs for each message:
+        self._hot_log = lazylog.LazyLogger(log)
+        self._sampled_log = lazylog.LazyLogger(log, sample_every=self.app.config.debug_log_sampling) # only for the global6DOF messages
+        self._params_publishers = {} # keys are scene IDs. Values are ParamsPublisher instances for our UserNode.
+        self._republish_call = None # DelayedCall to publish our params again, once our UserNode has been deleted
         
         # Tracking the position of everyone in the scene:
         self.my_yaw = 0.0 # to change our user position
+        self._moved_users = set() # IDs of the users whose pose changed since we last chose the cameras
+        self._camera_selection_call = None # DelayedCall for the next time we choose the cameras
+        self._last_camera_selection_time = 0.0
         self.scenes_info = {}
+        # Pausing the video of the users we cannot see:
+        self.culler = culling.VisibilityCuller(self.app.config.culling_field_of_view, self.app.config.culling_max_distance)
         
         # Cameras IDs
         # TODO: we need to store my user's camera id, 
         # and the textures for each user nodes.
         self.cameras = ["north", "east", "south", "west"] # FIXME: we will use the camera ids later on
         
-        # Start taking action:
-        self._start_info_listener()
         self._looping_print = task.LoopingCall(self._print_debug_infos)
-        self._looping_print.start(2.0, now=False)
         self._looping_ping = task.LoopingCall(self._keep_user_alive)
+        self._looping_stats = task.LoopingCall(self._update_network_stats)
+        self._looping_prune_servers = task.LoopingCall(self._prune_dead_servers)
+        self._looping_reap_users = task.LoopingCall(self._reap_dead_users)
+        self._looping_cull = task.LoopingCall(self._cull_peers)
+
+    def start(self):
+        """
+        Starts listening to the info channel. 
+        
+        Called by the application once the cameras config has been read.
+        """
+        if self.receiver_thread is not None:
+            self.receiver_thread.start()
+        self._start_info_listener()
+        self._looping_print.start(2.0, now=False)
         self._looping_ping.start(15.0, now=False)
+        self._looping_stats.start(1.0, now=False)
+        self._looping_prune_servers.start(self._servers_wheel.resolution, now=False)
+        self._looping_reap_users.start(self._users_wheel.resolution, now=False)
+        if self.app.config.enable_culling:
+            self._looping_cull.start(0.25, now=False)
 
     def _keep_user_alive(self):
         if self.current_server_id is not None:
-            self.send_to_node_in_scene(self.my_user_id, "ping")
+            self.send_to_node_in_scene(self.my_user_id, "ping") # never deferred, so that the other users do not forget us
     
     def _print_debug_infos(self):
         """
-        Updates the text views in the GUI with the list of nodes in the scene.
+        Updates the statistics shown in the GUI.
+        
+        The nodes themselves are updated incrementally, as we receive them.
         """
         #TODO: rename this.
-        known_user_nodes = sorted(self.get_current_scene().user_nodes.keys())
-        #log.debug("Known user nodes: %s" % (known_user_nodes))
-        txt = ""
-        try:
-            if len(known_user_nodes) != 0:
-                txt = "UserNode nodes:\n"
-                for n in known_user_nodes:
-                    txt += " * %s\n" % (n)
-            for node_type, nodes in self.get_current_scene().all_nodes.iteritems():
-                if node_type == "UserNode":
-                    pass
-                else:
-                    if len(nodes) != 0:
-                        txt += "%s nodes:\n" % (node_type)
-                        for node in nodes:
-                            txt += " * %s\n" % (node)
-        except KeyError, e:
-            log.warning(str(e))
-        if len(known_user_nodes) != 0:
-            txt += "UserNode params:\n"
-            for name, user in sorted(self.get_current_scene().user_nodes.items()):
-                txt += " * %s: {\n" % (name)
-                for key, value in user.params.iteritems():
-                    txt += "     %s: %s\n" % (key, value)
-                txt += " }\n"
-        self.gui.update_nodes_text(txt)
+        if not self.app.load_shedder.should_update_gui_stats():
+            return
+        bandwidth_stats = {}
+        if len(self.app.cameras_manager.peers_bandwidth) != 0:
+            for user_id, bandwidth in self.app.cameras_manager.peers_bandwidth.iteritems():
+                bandwidth_stats[user_id] = cameras.format_bandwidth(bandwidth)
+            bandwidth_stats["total"] = cameras.format_bandwidth(self.app.cameras_manager.get_total_bandwidth())
+        self.gui.update_stats("Estimated bandwidth", bandwidth_stats)
+        join_stats = {}
+        for user_id, readiness in self.get_join_progress().iteritems():
+            join_stats[user_id] = readiness.get_progress()
+        self.gui.update_stats("Join progress", join_stats)
+        self.gui.update_stats("Join phases", self.join_tracer.get_summary())
+        self.gui.update_stats("Load shedding", self.app.load_shedder.get_summary())
+        if self.app.config.enable_culling:
+            self.gui.update_stats("Culling", {"paused peers": culling.format_paused_peers(self.culler.paused)})
+        network_stats = {
+            "info channel": str(self.info_stats),
+            "scene channel": str(self.scene_stats),
+            "send cache": str(self.message_cache),
+            }
+        if self.receiver_thread is not None:
+            network_stats["receiver thread"] = str(self.receiver_thread)
+        self.gui.update_stats("Network", network_stats)
+
+    def _update_network_stats(self):
+        """
+        Updates the receive rate and drops of our sockets.
+        If the kernel dropped some scene messages, we might have missed some state. We then ask for a refresh.
+        """
+        self.info_stats.update()
+        self.scene_stats.update()
+        _info_rate_gauge.set(self.info_stats.rate)
+        _scene_rate_gauge.set(self.scene_stats.rate)
+        _info_drops_gauge.set(self.info_stats.drops)
+        _scene_drops_gauge.set(self.scene_stats.drops)
+        _servers_gauge.set(len(self.servers))
+        if self.current_server_id is not None:
+            _users_gauge.set(len(self.get_all_user_nodes()))
+        if self.receiver_thread is not None:
+            self.receiver_thread.update()
+            _receiver_queue_gauge.set(self.receiver_thread.get_queue_length())
+            if self.receiver_thread.new_decode_errors != 0:
+                log.warning("The receiver thread could not decode %d datagrams." % (self.receiver_thread.new_decode_errors))
+        if self.info_stats.new_drops != 0:
+            log.warning("The kernel dropped %d datagrams on the info channel." % (self.info_stats.new_drops))
+        if self.scene_stats.new_drops != 0:
+            log.warning("The kernel dropped %d datagrams on the scene channel." % (self.scene_stats.new_drops))
+            self._auto_refresh()
+        if self.receiver_thread is not None and self.receiver_thread.new_drops != 0:
+            self._unreported_thread_drops += self.receiver_thread.new_drops
+            now = time.time()
+            if now - self._last_thread_drops_warning_time >= THREAD_DROPS_WARNING_INTERVAL:
+                self._last_thread_drops_warning_time = now
+                log.warning("The receiver thread dropped %d OSC elements, since the reactor is late. %s" % (self._unreported_thread_drops, self.receiver_thread))
+                self._unreported_thread_drops = 0
+            if self.receiver_thread.new_elements_dropped != 0:
+                # Some of them might be state we don't get again, as for the kernel drops.
+                # The dropped poses are replaced by the next ones, so asking for the whole scene again would only make us later.
+                self._auto_refresh()
+
+    def _auto_refresh(self):
+        """
+        Sends a refresh to the scene, at most once every auto_refresh_interval seconds.
+        """
+        interval = self.app.config.auto_refresh_interval
+        if interval is None or self.current_server_id is None or not self.is_connected():
+            return
+        now = time.time()
+        if now - self._last_auto_refresh_time >= interval:
+            self._last_auto_refresh_time = now
+            log.warning("Asking the scene %s for a refresh since we lost some messages." % (self.current_server_id))
+            self.app.load_shedder.send_or_defer("refresh", self.send_refresh)
 
     def _start_info_listener(self):
         """
@@ -162,16 +347,20 @@ class SpinicOscInterface(object):
         
         Exits (!!!) in case of error.
         """
-        self.info_receiver = dispatch.Receiver()
-        server_protocol = async.MulticastDatagramServerProtocol(self.info_receiver, multicast_addr=self.info_multicast_group)
+        self._create_info_receiver()
         try:
-            self._info_datagram_protocol = reactor.listenMulticast(self.info_port_number, server_protocol, listenMultiple=True) 
+            self._info_datagram_protocol = self._listen_multicast(self.info_port_number, self.info_multicast_group, self.info_receiver, self.info_stats, self.app.config.info_receive_buffer_size, capture.INFO_CHANNEL)
         except error.CannotListenError, e:
             print(e)
             print("Giving up!")
             sys.exit(1)
         log.info("Listening on osc.udp://localhost:%s" % (self.info_port_number))
-        # adding callbacks:
+
+    def _create_info_receiver(self):
+        """
+        Creates the OSC receiver for the info channel, and adds our callbacks to it.
+        """
+        self.info_receiver = dispatch.Receiver()
         self.info_receiver.addCallback("/SPIN/__server__", self.recv_spin_server)
         self.info_receiver.addCallback("/SPIN/__user__", self.spin_user_handler) 
         self.info_receiver.setFallback(self.info_channel_fallback)
@@ -193,11 +382,24 @@ class SpinicOscInterface(object):
          * int Sync port
         """
         # log.debug("recv_spin_server: Got %s from %s" % (message, address))
+        _spin_server_messages.increment()
+        # Most of the time, it's a server we already know. Avoid creating anything then.
+        arguments = message.arguments
+        scene_id = arguments[0].value
+        server_recv_addr = arguments[1].value
+        server_info = self.servers.get(scene_id)
+        if server_info is not None:
+            if server_info.server_recv_addr == server_recv_addr:
+                server_info.last_seen = time.time()
+                return
+            # If the address changed, we delete the previous entry we had:
+            #self._stop_communication_with_server(scene_id)
+            log.info("Scene %s has changed its receiving address to %s." % (scene_id, server_recv_addr))
+            del self.servers[scene_id]
+        
+        # We care about the server sending/receiving ports and addresses
         arguments = message.getValues()
         #log.debug("args: %s" % (arguments))
-        # We care about the server sending/receiving ports and addresses
-        scene_id = arguments[0]
-        server_recv_addr = arguments[1]
         server_recv_port = arguments[2]
         server_tcp_recv_port = arguments[3]
         
@@ -205,19 +407,41 @@ class SpinicOscInterface(object):
         server_send_port = arguments[5]
         #server_sync_port = arguments[6]
         
-        # If the address changed, we delete the previous entry we had:
-        if self.servers.has_key(scene_id) and self.servers[scene_id].server_recv_addr != server_recv_addr: 
-            #self._stop_communication_with_server(scene_id)
-            log.info("Scene %s has changed its receiving address to %s." % (scene_id, server_recv_addr))
-            del self.servers[scene_id]
-        # If the entry is not already tracked, we add it:
-        if scene_id not in self.servers.keys():
-            log.info("Scene %s has receiving address %s." % (scene_id, server_recv_addr))
-            self.servers[scene_id] = ServerInfo(scene_id, server_recv_addr, server_recv_port, server_send_addr, server_send_port, server_tcp_recv_port)
-            #self._start_communication_with_server(scene_id)
-            # We now need to update the list of server
-            self._server_list_updated()
+        server_info = ServerInfo(scene_id, server_recv_addr, server_recv_port, server_send_addr, server_send_port, server_tcp_recv_port, server_host=address[0])
+        log.info("New scene. %s" % (server_info))
+        self.servers[scene_id] = server_info
+        self._servers_wheel.add(scene_id, server_info.last_seen)
+        self.join_tracer.on_server_seen(scene_id)
+        #self._start_communication_with_server(scene_id)
+        # We now need to update the list of server
+        self._server_list_updated()
     
+    def _get_server_last_seen(self, scene_id):
+        server_info = self.servers.get(scene_id)
+        if server_info is None:
+            return None
+        return server_info.last_seen
+
+    def _prune_dead_servers(self):
+        """
+        Forgets the servers we have not heard of for server_timeout seconds.
+        The one we are connected to is kept, since we might still get messages from its scene.
+        """
+        expired = self._servers_wheel.sweep(time.time(), self._get_server_last_seen)
+        has_changed = False
+        for scene_id in expired:
+            if scene_id == self.current_server_id:
+                log.warning("We have not heard of the server of our scene %s for %d seconds." % (scene_id, self.app.config.server_timeout))
+                self._servers_wheel.add(scene_id, time.time())
+            else:
+                log.info("Forgetting scene %s since its server has been silent for %d seconds." % (scene_id, self.app.config.server_timeout))
+                del self.servers[scene_id]
+                if self._params_publishers.has_key(scene_id):
+                    del self._params_publishers[scene_id] # if it comes back, it might have lost our params
+                has_changed = True
+        if has_changed:
+            self._server_list_updated()
+
     def _server_list_updated(self):
         """
         Time to update the list of servers.
@@ -240,7 +464,10 @@ class SpinicOscInterface(object):
         Does what need to be done in this class when we connect to a SPIN server.
          * Set the params of my spinviewer's UserNode (which tells everyone what's my cameras setup)
          * Create the statesets that everyone will use to identify the sharedvideotexture they see from my user.
+
+        All our params are sent again, since we don't know what the scene kept of them while we were away.
         """
+        self._forget_published_params()
         self._set_params_for_my_user_node()
         self._create_statesets_for_my_user_and_cameras()
         self.connected_to_scene_signal(self.current_server_id)
@@ -260,17 +487,20 @@ class SpinicOscInterface(object):
             # FIXME: this is quite temporary!!
             #self.proto_create_some_nodes()
             self.gui.update_connected_state(True) # FIXME
-            self.gui.process_launcher.switch_to_scene(server_id) # FIXME: we should add an application class.
+            self.join_tracer.on_connected(server_id)
+            self.app.launcher.switch_to_scene(server_id)
             self.on_connected_to_spin_server()
             deferred.callback(None)
         
         def _on_disconnected(result):
+            self.join_tracer.on_connecting(server_id)
             if self.current_server_id is not None:
                 self._stop_streaming_with_all_user()
                 self._delete_all_nodes()
             self.current_server_id = server_id
             deferred3 = self._start_scene_listener()
             self._start_scene_sender()
+            self._start_tcp_sender()
             deferred3.addCallback(_on_started_again)
             
         if self.current_server_id == server_id:
@@ -287,20 +517,39 @@ class SpinicOscInterface(object):
             disconnection_deferred.addCallback(_on_disconnected)
             return deferred
     
-    def send_element(self, element):
+    def send_element(self, element, reliable=False):
         """
-        @param element: OSC Bundle or Message.
+        @param element: OSC Bundle or Message, or L{spinic.sendcache.EncodedMessage}.
+        @param reliable: If True, sends it over TCP, if we can.
         """
         if self.current_server_id is None:
             raise RuntimeError("You should choose a server first")
+        if reliable and self.tcp_sender is not None:
+            if self._hot_log.debug_enabled:
+                self._log_sent_element("Sending over TCP", element)
+            _sent_tcp.increment()
+            self.tcp_sender.send(element)
+        else:
+            self._send_element_with_udp(element)
+
+    def _send_element_with_udp(self, element):
         send_addr = self.servers[self.current_server_id].server_recv_addr
         send_port = self.servers[self.current_server_id].server_recv_port
+        if self._hot_log.debug_enabled:
+            self._log_sent_element("Sending", element)
+        _sent_udp.increment()
+        self.scene_sender.send(element, (send_addr, send_port))
+
+    def _log_sent_element(self, prefix, element):
+        """
+        Logs each message of a bundle, or the message.
+        Costly: check self._hot_log.debug_enabled first.
+        """
         if isinstance(element, osc.Bundle):
             for message in element.elements:
-                log.debug("Sending " + str(message))
+                self._hot_log.debug("%s %s", prefix, message)
         else:
-            log.debug("Sending " + str(element))
-        self.scene_sender.send(element, (send_addr, send_port))
+            self._hot_log.debug("%s %s", prefix, element)
 
     def send_to_scene(self, *args):
         """
@@ -309,7 +558,7 @@ class SpinicOscInterface(object):
         if self.current_server_id is None:
             raise RuntimeError("You should choose a server first")
         osc_path = "/SPIN/%s" % (self.current_server_id)
-        self.send_element(osc.Message(osc_path, *args))
+        self.send_element(self.message_cache.get_message(osc_path, args))
 
     def send_to_node_in_scene(self, node_name, *args):
         """
@@ -318,7 +567,25 @@ class SpinicOscInterface(object):
         if self.current_server_id is None:
             raise RuntimeError("You should choose a server first")
         osc_path = "/SPIN/%s/%s" % (self.current_server_id, node_name)
-        self.send_element(osc.Message(osc_path, *args))
+        self.send_element(self.message_cache.get_message(osc_path, args))
+
+    def send_reliably_to_scene(self, *args):
+        """
+        Sends a message that changes the state of the scene to /SPIN/<scene>, over TCP if we can.
+        """
+        if self.current_server_id is None:
+            raise RuntimeError("You should choose a server first")
+        osc_path = "/SPIN/%s" % (self.current_server_id)
+        self.send_element(self.message_cache.get_message(osc_path, args), reliable=True)
+
+    def send_reliably_to_node_in_scene(self, node_name, *args):
+        """
+        Sends a message that changes the state of a node to /SPIN/<scene>/<node_name>, over TCP if we can.
+        """
+        if self.current_server_id is None:
+            raise RuntimeError("You should choose a server first")
+        osc_path = "/SPIN/%s/%s" % (self.current_server_id, node_name)
+        self.send_element(self.message_cache.get_message(osc_path, args), reliable=True)
         
     def _start_scene_listener(self):
         """
@@ -330,22 +597,47 @@ class SpinicOscInterface(object):
         multicast_group = server_infos.server_send_addr
         recv_port = server_infos.server_send_port
         
-        self.scene_receiver = dispatch.Receiver()
-        server_protocol = async.MulticastDatagramServerProtocol(self.scene_receiver, multicast_addr=multicast_group)
+        self._create_scene_receiver()
         try:
-            self._scene_receiver_protocol = reactor.listenMulticast(recv_port, server_protocol, listenMultiple=True) 
+            self._scene_receiver_protocol = self._listen_multicast(recv_port, multicast_group, self.scene_receiver, self.scene_stats, self.app.config.scene_receive_buffer_size, capture.SCENE_CHANNEL, self.handle_global6dof)
         except error.CannotListenError, e:
             log.error(str(e))
             self._scene_receiver_protocol = None
         else:
             log.info("Spinic is listening on osc.udp://%s:%d" % (multicast_group, recv_port))
-            # adding callbacks:
-            self.scene_receiver.addCallback("/SPIN/*", self.spin_any_handler)
-            self.scene_receiver.addCallback("/SPIN/*/*", self.spin_any_any_handler)
-            #self.info_receiver.addCallback("/SPIN/__server__", self.recv_spin_server)
-            self.info_receiver.setFallback(self.scene_channel_fallback)
         return defer.succeed(None)
 
+    def _create_scene_receiver(self):
+        """
+        Creates the OSC receiver for the scene channel, and adds our callbacks to it.
+        """
+        self.scene_receiver = dispatch.Receiver()
+        self.scene_receiver.addCallback("/SPIN/*", self.spin_any_handler)
+        self.scene_receiver.addCallback("/SPIN/*/*", self.spin_any_any_handler)
+        self.scene_receiver.setFallback(self.scene_channel_fallback)
+
+    def _listen_multicast(self, port, multicast_group, receiver, stats, receive_buffer_size=None, channel=None, pose_handler=None):
+        """
+        Listens to a multicast group, either in the receiver thread or in the reactor.
+
+        Might raise a L{twisted.internet.error.CannotListenError}
+        @param stats: L{spinic.udpstats.ChannelStats} for that channel.
+        @param receive_buffer_size: SO_RCVBUF for the socket, or None for the kernel default.
+        @param channel: L{spinic.capture.INFO_CHANNEL} or L{spinic.capture.SCENE_CHANNEL}, to capture its datagrams.
+        @param pose_handler: Called with the global6DOF messages decoded by L{spinic.fastosc}. See L{handle_global6dof}.
+        @return: Object with a stopListening method.
+        """
+        recorder = None
+        if self.capture_writer is not None and channel is not None:
+            recorder = self.capture_writer.get_recorder(channel)
+        if self.receiver_thread is not None:
+            listening_port = self.receiver_thread.listen_multicast(port, multicast_group, receiver, stats, recorder, pose_handler)
+        else:
+            server_protocol = CountingMulticastDatagramServerProtocol(receiver, multicast_group, stats, recorder, pose_handler)
+            listening_port = reactor.listenMulticast(port, server_protocol, listenMultiple=True) 
+        stats.set_socket(listening_port.socket, receive_buffer_size)
+        return listening_port
+
     def _start_scene_sender(self):
         """
         Starts an OSC sender to send messages to a SPIN server.
@@ -360,6 +652,26 @@ class SpinicOscInterface(object):
         self._scene_sender_protocol = reactor.listenMulticast(0, self.scene_sender)
         self._set_multicast_options_for_sender(self._scene_sender_protocol)
     
+    def _start_tcp_sender(self):
+        """
+        Connects to the TCP receiving port of the current server, for the messages that must not be lost.
+        Those messages are sent with UDP if TCP is disabled or if we cannot connect.
+        """
+        self._stop_tcp_sender()
+        server_infos = self.servers[self.current_server_id]
+        if not self.app.config.enable_tcp_sender:
+            return
+        if server_infos.server_host is None or server_infos.server_tcp_recv_port == 0:
+            log.warning("We don't know the TCP address of the server of scene %s. Will use UDP only." % (self.current_server_id))
+            return
+        self.tcp_sender = tcpsender.TcpSender(server_infos.server_host, server_infos.server_tcp_recv_port, fallback=self._send_element_with_udp)
+        self.tcp_sender.start()
+
+    def _stop_tcp_sender(self):
+        if self.tcp_sender is not None:
+            self.tcp_sender.stop()
+            self.tcp_sender = None
+
     def _set_multicast_options_for_sender(self, sender):
         """
         Sets the TTL, and stuff for a MulticastDatagramServerProtocol.
@@ -400,7 +712,8 @@ class SpinicOscInterface(object):
         """
         Handles /SPIN/* messages from the scene channel
         """
-        log.debug("spin_any: Got %s" % (message))
+        self._hot_log.debug("spin_any: Got %s", message)
+        _spin_any_messages.increment()
         tokens = message.address.split("/")
         scene_id = tokens[2]
         if scene_id == self.current_server_id:
@@ -413,7 +726,7 @@ class SpinicOscInterface(object):
                     node_id = arguments[1]
                     self._handle_delete_node(node_id)
                 else:
-                    log.debug("Received %s" % (message))
+                    self._hot_log.debug("Received %s", message)
             except KeyError, e:
                 log.error(str(e))
         else:
@@ -430,13 +743,54 @@ class SpinicOscInterface(object):
         for node_type in current_scene.all_nodes.iterkeys():
             if node_id in current_scene.all_nodes[node_type]:
                 if DELETE_THEM:
-                    del current_scene.all_nodes[node_type]
+                    current_scene.all_nodes[node_type].remove(node_id)
+                    self.gui.remove_node(node_type, node_id)
                     log.debug("Stopped tracking %s since it has been deleted." % (node_id))
                 break
-        if node_id in current_scene.user_nodes and node_id != self.my_user_id:
+        if node_id == self.my_user_id:
+            # Its params are gone with it. Create it again with all of them.
+            self._forget_published_params()
+            if self._republish_call is None:
+                self._republish_call = reactor.callLater(REPUBLISH_DELAY, self._republish_params, self.current_server_id)
+        elif node_id in current_scene.user_nodes:
             if DELETE_THEM:
-                self._stop_streaming_with_user(node_id)
-                del current_scene.user_nodes[node_id]
+                self._forget_user_node(node_id)
+
+    def _forget_user_node(self, user_id):
+        """
+        Stops streaming with a user and stops tracking it.
+        """
+        self._stop_streaming_with_user(user_id)
+        if self.culler.forget(user_id):
+            self._set_params_for_my_user_node()
+        del self.get_current_scene().user_nodes[user_id]
+        self.get_current_scene().spatial_index.remove(user_id)
+        self._users_wheel.discard(user_id)
+        self.join_tracer.on_peer_left(user_id)
+        self.gui.remove_node("UserNode", user_id)
+
+    def _get_user_last_activity(self, user_id):
+        user_node_info = self.get_all_user_nodes().get(user_id)
+        if user_node_info is None:
+            return None
+        return user_node_info.last_activity
+
+    def _reap_dead_users(self):
+        """
+        Stops streaming with the users we have not heard of for user_timeout seconds, 
+        and deletes the billboard we see them in.
+        
+        They probably crashed without deleting their UserNode.
+        If they come back, they will be listed again in a nodeList and we'll start over with them.
+        """
+        expired = self._users_wheel.sweep(time.time(), self._get_user_last_activity)
+        for user_id in expired:
+            if user_id == self.my_user_id:
+                continue
+            log.warning("User %s has been silent for %d seconds. Stopping to stream with it." % (user_id, self.app.config.user_timeout))
+            self._forget_user_node(user_id)
+            if self.is_connected():
+                self.send_reliably_to_scene("deleteNode", self._get_shapenode_for_user(user_id))
     
     def _stop_streaming_with_all_user(self):
         """
@@ -451,8 +805,13 @@ class SpinicOscInterface(object):
     def _delete_all_nodes(self):
         current_scene = self.get_current_scene()
         log.warning("Deleting all our nodes tracking !")
+        for user_id in current_scene.user_nodes.iterkeys():
+            self.join_tracer.on_peer_left(user_id)
         current_scene.all_nodes = {}
         current_scene.user_nodes = {}
+        current_scene.spatial_index.clear()
+        self.culler.forget_all()
+        self.gui.clear_nodes()
     
     def _stop_streaming_with_user(self, user_id):
         """
@@ -463,6 +822,7 @@ class SpinicOscInterface(object):
         if user_node_info.streaming_is_on:
             log.warning("Will stop streaming with %s." % (user_id))
             self.app.cameras_manager.stop_streamers_with_peer(user_node_info)
+            user_node_info.senders_paused = False
             self.stopped_streaming_with_user_signal(self.current_server_id, user_id)
         else:
             log.debug("We were not streaming with %s" % (user_id))
@@ -478,6 +838,7 @@ class SpinicOscInterface(object):
             self._store_user_nodes(node_list)
         else:
             self.get_current_scene().all_nodes[node_type] = node_list
+            self.gui.update_node_list(node_type, node_list)
             
             #scene_info = self.get_current_scene()
             # log.debug("TODO: store every node, just for info")
@@ -492,11 +853,19 @@ class SpinicOscInterface(object):
         #TODO: remove the node if not listed anymore
         log.debug("User nodes: %s" % (str(user_nodes)))
         
+        has_new_user_nodes = False
         for user_node in user_nodes:
             if user_node not in self.get_current_scene().user_nodes.keys():
                 if user_node != self.my_user_id: #Not able to see myself right now.
                     self._create_billboards_for_user_node(user_node)
-                self.get_current_scene().user_nodes[user_node] = UserNodeInfo(user_node)
+                user_node_info = UserNodeInfo(user_node)
+                self.get_current_scene().user_nodes[user_node] = user_node_info
+                if user_node != self.my_user_id:
+                    self._users_wheel.add(user_node, user_node_info.last_activity)
+                    self.join_tracer.on_peer_seen(user_node)
+                has_new_user_nodes = True
+        if has_new_user_nodes:
+            self.gui.update_node_list("UserNode", self.get_current_scene().user_nodes.keys())
 
     def _create_billboards_for_user_node(self, other_node):
         """
@@ -520,9 +889,9 @@ class SpinicOscInterface(object):
         log.info("Creating a billboard seen by us for %s" % (other_node))
         # create it:
         bundle = osc.Bundle()
-        self.send_element(osc.Message(scene_path, "createNode", other_node, "UserNode"))
-        self.send_element(osc.Message(scene_path, "createNode", billboard_name, "ShapeNode"))
-        self.send_element(bundle)
+        self.send_element(osc.Message(scene_path, "createNode", other_node, "UserNode"), reliable=True)
+        self.send_element(osc.Message(scene_path, "createNode", billboard_name, "ShapeNode"), reliable=True)
+        self.send_element(bundle, reliable=True)
         # set its attributes:
         bundle = osc.Bundle()
         bundle.add(osc.Message(billboard_path, "setParent", other_node))
@@ -533,7 +902,7 @@ class SpinicOscInterface(object):
         bundle.add(osc.Message(billboard_path, "setShape", 6.0))
         bundle.add(osc.Message(billboard_path, "setLighting", 0.0))
         bundle.add(osc.Message(billboard_path, "setContext", self.my_user_id)) # XXX: Only seen by us!
-        self.send_element(bundle)
+        self.send_element(bundle, reliable=True)
         
 #        if using_fake_images:
 #            self._create_state_set_images(other_node)
@@ -553,14 +922,16 @@ class SpinicOscInterface(object):
         Useful to handle the following first arguments:
          * global6DOF (calls handle_user_6dof)
         """
-        log.debug("spin_any: Got %s" % (message))
+        self._hot_log.debug("spin_any_any: Got %s", message)
+        _spin_any_any_messages.increment()
         tokens = message.address.split("/")
         scene_id = tokens[2]
         obj_id = tokens[3]
         if scene_id == self.current_server_id:
-            log.debug("Received %s" % (message))
             method = message.arguments[0].value
-            if obj_id in self.get_all_user_nodes().keys():
+            user_node_info = self.get_all_user_nodes().get(obj_id)
+            if user_node_info is not None:
+                user_node_info.last_activity = time.time()
                 if method == "global6DOF":
                     self._handle_user_6dof(obj_id, message)
                 elif method == "setParam":
@@ -572,27 +943,63 @@ class SpinicOscInterface(object):
             pass 
             #log.debug("spin_any_any: Wrong scene %s. Our scene is %s. Got %s from %s." % (scene_id, self.current_server_id, message, address))
 
+    def handle_global6dof(self, osc_address, pose, address):
+        """
+        Handles a global6DOF message decoded by L{spinic.fastosc.decode_global6dof}, as spin_any_any_handler would.
+
+        Returns False if its address is not /SPIN/<scene>/<node>, so that it is given to the txosc receiver instead.
+        @param pose: (x, y, z, roll, pitch, yaw) tuple
+        @rtype: C{bool}
+        """
+        tokens = osc_address.split("/")
+        if len(tokens) != 4 or tokens[1] != "SPIN":
+            return False
+        _spin_any_any_messages.increment()
+        if tokens[2] == self.current_server_id:
+            user_node_info = self.get_all_user_nodes().get(tokens[3])
+            if user_node_info is not None:
+                user_node_info.last_activity = time.time()
+                self._store_user_pose(tokens[3], user_node_info, pose)
+        return True
+
     def _handle_user_param(self, user_id, message):
         """
         Handles /SPIN/<scene>/<node> setParam <key> <value> for UserNode nodes
         """
-        log.debug("_handle_user_param %s %s" % (user_id, message))
+        self._hot_log.debug("_handle_user_param %s %s", user_id, message)
+        _user_param_messages.increment()
         all_user_nodes = self.get_all_user_nodes()
         
         key = message.arguments[1].value
         value = message.arguments[2].value
-        if user_id in all_user_nodes.keys():
-            if not all_user_nodes[user_id].params.has_key(key):
-                log.debug("Got param %s=%s for UserNode %s" % (key, value, user_id))
-                all_user_nodes[user_id].params[key] = value
-            elif all_user_nodes[user_id].params[key] != value:
-                all_user_nodes[user_id].params[key] = value
+        if user_id in all_user_nodes:
+            user_node_info = all_user_nodes[user_id]
+            is_new = not user_node_info.params.has_key(key)
+            changed = not is_new and user_node_info.params[key] != value
+            if is_new:
+                self._hot_log.debug("Got param %s=%s for UserNode %s", key, value, user_id)
+                user_node_info.params[key] = value
+                self.gui.update_user_param(user_id, key, value)
+            elif changed:
+                user_node_info.params[key] = value
+                self.gui.update_user_param(user_id, key, value)
                 log.info("Got new param value %s=%s for UserNode %s" % (key, value, user_id))
             else:
-                log.debug("We already had that param")
+                self._hot_log.debug("We already had that param")
+            if is_new or changed:
+                try:
+                    user_node_info.camera_config.set_param(key, value)
+                except ValueError, e:
+                    log.error("Invalid param %s=%s for UserNode %s: %s" % (key, value, user_id, e))
+            try:
+                user_node_info.readiness.on_param(key, value, user_node_info.params, is_new)
+            except RuntimeError, e:
+                log.error("UserNode %s: %s" % (user_id, e))
             # start to stream with peer if ready:
             if user_id != self.my_user_id:
                 self._start_streaming_if_ready(user_id)
+                if key == culling.PAUSED_PEERS_PARAM and (is_new or changed):
+                    self._apply_paused_peers(user_node_info)
     
         #if user_id != self.my_user_id:
         #    if user_id in all_user_nodes.keys():
@@ -618,45 +1025,80 @@ class SpinicOscInterface(object):
         """
         # TODO: set the shared video texture ID param
         user_node_info = self.get_all_user_nodes()[user_id]
-        has_all_params = True
-        keys = cameras.CamerasConfig().__dict__.keys()
-        keys.append("number_of_cameras")
-        for key in keys:
-            if key == "cameras":
-                pass
-            else:
-                if not user_node_info.params.has_key(key):
-                    log.debug("UserNode %s does not have param %s set yet." % (user_id, key))
-                    has_all_params = False
-
-        if user_node_info.params.has_key("number_of_cameras"):
-            number_of_cameras = int(user_node_info.params["number_of_cameras"])
-            for number in range(number_of_cameras):
-                key = "cameras[%d]" % (number + 1)
-                if not user_node_info.params.has_key(key):
-                    log.debug("UserNode %s does not have param %s." % (user_node_info.name, key))
-                    has_all_params = False
-                
-        if has_all_params:
-            if not user_node_info.streaming_is_on:
-                log.info("Will start streaming. We have all params to stream with %s" % (user_id))
-                self.start_streaming_with_user_signal(self.current_server_id, user_id)
-                self.app.cameras_manager.launch_streamers_with_peer(user_node_info)
-            else:
-                log.debug("Already streaming with %s" % (user_id))
+        if user_node_info.streaming_is_on:
+            self._hot_log.debug("Already streaming with %s", user_id)
+        elif user_node_info.readiness.is_ready():
+            log.info("Will start streaming. We have all params to stream with %s" % (user_id))
+            self.join_tracer.on_peer_ready(user_id)
+            self.start_streaming_with_user_signal(self.current_server_id, user_id)
+            self.app.cameras_manager.launch_streamers_with_peer(user_node_info)
+            remote_cameras = user_node_info.camera_config.get_cameras()
+            self.join_tracer.on_streamers_launched(user_id,
+                [cameras.get_video_receiver_identifier(user_id, index + 1) for index in range(len(remote_cameras))],
+                [cameras.get_texture_id_from_camera_codename(camera) for camera in remote_cameras])
+            self._apply_paused_peers(user_node_info)
         else:
-            log.debug("Not ready to stream with %s yet." % (user_id))
+            self._hot_log.debug("Not ready to stream with %s yet.", user_id)
+
+    def _apply_paused_peers(self, user_node_info):
+        """
+        Pauses or resumes our video senders to a peer, depending on whether it paused its receivers for us.
+        """
+        if not user_node_info.streaming_is_on or not user_node_info.params.has_key(culling.PAUSED_PEERS_PARAM):
+            return
+        paused = self.my_user_id in culling.parse_paused_peers(user_node_info.params[culling.PAUSED_PEERS_PARAM])
+        if paused != user_node_info.senders_paused:
+            user_node_info.senders_paused = paused
+            self.app.cameras_manager.set_video_senders_paused(user_node_info, paused)
+
+    def _cull_peers(self):
+        """
+        Pauses the video receivers of the peers we have not seen for a while, and resumes the ones we see again.
+        The peers are told through the paused_peers param of our UserNode.
+        """
+        if self.current_server_id is None:
+            return
+        user_nodes = self.get_current_scene().user_nodes
+        peers = [user_id for user_id, user_node_info in user_nodes.iteritems() if user_id != self.my_user_id and user_node_info.streaming_is_on]
+        spatial_index = self.get_current_scene().spatial_index
+        if self.my_user_id not in spatial_index:
+            return
+        field_of_view, max_distance = self.culler.get_cone()
+        in_view = self.get_users_in_view(field_of_view, max_distance)
+        # We don't know where the peers that did not move since we joined are. They might be right in front of us.
+        in_view.extend([user_id for user_id in peers if user_id not in spatial_index])
+        to_pause, to_resume = self.culler.update(peers, in_view)
+        for user_id in to_pause:
+            log.info("Pausing the video of %s, since we cannot see it." % (user_id))
+            self.app.cameras_manager.set_video_receivers_paused(user_nodes[user_id], True)
+        for user_id in to_resume:
+            log.info("Resuming the video of %s, since we are about to see it." % (user_id))
+            self.app.cameras_manager.set_video_receivers_paused(user_nodes[user_id], False)
+        if len(to_pause) != 0 or len(to_resume) != 0:
+            self._set_params_for_my_user_node()
+
+    def get_join_progress(self):
+        """
+        Returns the join progress of each other user in the current scene.
+        Keys are user IDs. Values are L{spinic.userparams.ReadinessTracker} instances.
+        @rtype: C{dict}
+        """
+        ret = {}
+        if self.current_server_id is not None:
+            for user_id, user_node_info in self.get_all_user_nodes().iteritems():
+                if user_id != self.my_user_id:
+                    ret[user_id] = user_node_info.readiness
+        return ret
     
     def _handle_user_6dof(self, user_id, message):
         """
         Handles specifically the /SPIN/<scene ID>/<node ID> global6DOF method
         
         Called by spin_any_any_handler.
+
+        Only the pose of the user is stored. The cameras are chosen later, once for all the poses received in the meantime. See L{_schedule_camera_selection}.
         """
         # /SPIN/spinicserver/dummy ,sffffff s:global6DOF  f:-0.0416663214564  f:-10.7916717529  f:0.5  f:0.0  f:-0.0  f:0.0 
-        log.debug("6DOF message received for user %s" % (user_id))
-        args = message.getValues()
-        
         user_info = self.get_current_scene().user_nodes[user_id]
         #if user_info.current_camera is None and user_id != self.my_user_id:
         #    textures = self.get_textures_for_user(user_id)
@@ -664,31 +1106,121 @@ class SpinicOscInterface(object):
         #        user_info.current_camera = textures[0] #self.cameras[0] # sets the camera for this user to the default one.
         #    except IndexError, e:
         #        log.error(str(e))
-        position = args[1:4] # we don't need the first string
-        orientation = args[4:7] # we don't need the first string
-        user_info.position = position
-        user_info.orientation = orientation
-        # Now, let's do it:
-        self._calculate_angles_between_each_user()
+        # we don't need the first string
+        self._store_user_pose(user_id, user_info, [argument.value for argument in message.arguments[1:7]])
+
+    def _store_user_pose(self, user_id, user_info, pose):
+        """
+        Stores the pose of a user, and schedules choosing the cameras.
+        Called for the global6DOF messages, whether they were decoded by txosc or by L{spinic.fastosc}.
+        The poses with a NaN or infinite value are ignored, since we could not choose the cameras with them.
+        @param pose: x, y, z, roll, pitch, yaw
+        """
+        self._sampled_log.debug("6DOF message received for user %s", user_id)
+        _user_6dof_messages.increment()
+        for value in pose:
+            if not spatial.is_finite(value):
+                _invalid_poses.increment()
+                self._sampled_log.debug("Ignoring the pose %s of user %s, since it is not finite", pose, user_id)
+                return
+        start_time = time.time()
+        position = user_info.position
+        position[0] = pose[0]
+        position[1] = pose[1]
+        position[2] = pose[2]
+        orientation = user_info.orientation
+        orientation[0] = pose[3]
+        orientation[1] = pose[4]
+        orientation[2] = pose[5]
+        self.get_current_scene().spatial_index.update(user_id, pose[0], pose[1])
+        self._moved_users.add(user_id)
+        self._schedule_camera_selection()
+        _user_6dof_duration.observe(time.time() - start_time)
+
+    def _schedule_camera_selection(self):
+        """
+        Makes sure the cameras are chosen soon, for the users that moved.
+
+        It's done at most camera_selection_rate times per second, or once per reactor iteration if it is 0, so that its cost depends on that rate, not on the rate of the global6DOF messages.
+        When the reactor lags, the load shedder makes us do it less often.
+        """
+        if self._camera_selection_call is not None:
+            return
+        interval = 0.0
+        if self.app.config.camera_selection_rate:
+            interval = 1.0 / self.app.config.camera_selection_rate
+        interval = self.app.load_shedder.get_camera_selection_interval(interval)
+        delay = max(0.0, self._last_camera_selection_time + interval - time.time())
+        self._camera_selection_call = reactor.callLater(delay, self._select_cameras)
 
-    def _calculate_angles_between_each_user(self):
+    def _select_cameras(self):
         """
-        Called by handle_user_6dof. (which is called by spin_any_any_handler)
+        Chooses the cameras for the users that moved since the last time.
+        If we moved, they are chosen for everyone.
+        """
+        self._camera_selection_call = None
+        self._last_camera_selection_time = time.time()
+        moved_users = self._moved_users
+        self._moved_users = set()
+        if self.current_server_id is None:
+            return
+        _camera_selections.increment()
+        if self.my_user_id in moved_users:
+            self._calculate_angles_between_each_user()
+        else:
+            self._calculate_angles_between_each_user(moved_users)
+        _camera_selection_duration.observe(time.time() - self._last_camera_selection_time)
+
+    def get_nearest_users(self, count):
+        """
+        Returns the IDs of the other users closest to our user, closest first.
+        @rtype: C{list}
+        """
+        scene = self.get_current_scene()
+        position = scene.spatial_index.get_position(self.my_user_id)
+        if position is None:
+            return []
+        return scene.spatial_index.get_nearest(position[0], position[1], count, exclude=self.my_user_id)
+
+    def get_users_in_view(self, field_of_view, max_distance, yaw=None):
+        """
+        Returns the IDs of the other users we see, closest first.
+        @param field_of_view: Horizontal angle we see, in degrees.
+        @param max_distance: How far we see.
+        @param yaw: Direction we look at, in degrees. Defaults to the yaw of our UserNode.
+        @rtype: C{list}
+        """
+        scene = self.get_current_scene()
+        position = scene.spatial_index.get_position(self.my_user_id)
+        if position is None:
+            return []
+        if yaw is None:
+            yaw = scene.user_nodes[self.my_user_id].orientation[2]
+        return scene.spatial_index.get_in_view(position[0], position[1], yaw, field_of_view, max_distance, exclude=self.my_user_id)
+
+    def _calculate_angles_between_each_user(self, user_ids=None):
+        """
+        Called by _select_cameras.
+        @param user_ids: IDs of the users to choose the camera for. All of them if None.
         """
         my_user_pos = None
+        user_nodes = self.get_current_scene().user_nodes
         try:
-            my_user_pos = self.get_current_scene().user_nodes[self.my_user_id].position
+            my_user_pos = user_nodes[self.my_user_id].position
         except KeyError, e:
             log.warning("We don't have our user's (%s) coordinates yet." % (self.my_user_id))
         else:
             my_x = my_user_pos[0]
             my_y = my_user_pos[1]
-            for user_id, user_info in self.get_current_scene().user_nodes.iteritems():
-                if user_id != self.my_user_id:
+            if user_ids is None:
+                user_ids = user_nodes.keys()
+            for user_id in user_ids:
+                user_info = user_nodes.get(user_id)
+                if user_info is not None and user_id != self.my_user_id:
                     textures = self.get_textures_for_user(user_id)
                     num_cameras = len(textures)
                     if num_cameras == 0:
-                        log.debug("User %s has no shared video textures!" % (user_id))
+                        self._hot_log.debug("User %s has no shared video textures!", user_id)
                     else:
                         angle_between_each_camera = 360.0 / num_cameras
                         pos = user_info.position
@@ -701,21 +1233,22 @@ class SpinicOscInterface(object):
                         yaw = orientation[2]
                         
                         angle = (math.degrees(math.atan2(my_y - y, my_x - x))  - 90 - yaw * -1 ) % 360
-                        log.debug("The angle from which we see %s is %s" % (user_id, angle))
+                        self._hot_log.debug("The angle from which we see %s is %s", user_id, angle)
                         old_camera = user_info.current_camera
                         new_camera = None
                         offset = (angle_between_each_camera / 2) - 90
                         new_camera_number = int(((angle - offset) % 360.0) / angle_between_each_camera)
-                        log.debug("Texture for %s is %d (%s)" % (user_id, new_camera_number, textures[new_camera_number]))
                         try:
                             new_camera = textures[new_camera_number]
-                        except KeyError, e:
+                        except IndexError, e:
                             log.error("Bad camera number: %s" % (e))
                         else:
+                            self._hot_log.debug("Texture for %s is %d (%s)", user_id, new_camera_number, new_camera)
                             if new_camera != old_camera:
                                 log.info("SWITCHING TO CAMERA %s for us looking at user %s ------------- " % (new_camera, user_id))
                                 # save the new camera ID for that user node
                                 user_info.current_camera = new_camera
+                                _camera_switches.increment()
                                 # send the OSC messages
                                 # self._switch_camera_for_user(new_camera, user_id)
                                 self.choose_sharedvideotexture_for_user(user_id, new_camera)
@@ -780,17 +1313,43 @@ class SpinicOscInterface(object):
     def _set_params_for_my_user_node(self):
         """
         Populate the server with my user node info.
+        
+        Sends them as one bundle, with a manifest. Only the params that changed since we last published them in this scene are sent.
         """
         log.debug("_set_params_for_my_user_node")
         # re-create it just in case
-        self.send_to_scene("createNode", self.my_user_id, "UserNode")
-        #FIXME: should we wait a bit here?
+        self.send_reliably_to_scene("createNode", self.my_user_id, "UserNode")
+        # No need to wait here: over TCP, the params arrive after the node is created.
         # set the params
+        if not self._params_publishers.has_key(self.current_server_id):
+            self._params_publishers[self.current_server_id] = userparams.ParamsPublisher()
+        publisher = self._params_publishers[self.current_server_id]
         params = self.app.cameras_manager.get_params_for_my_user_node()
-        for key, value in params.iteritems():
-            #FIXME: it seems like cameras are sent last...
-            self.send_to_node_in_scene(self.my_user_id, "setParam", key, str(value))
+        params[culling.PAUSED_PEERS_PARAM] = culling.format_paused_peers(self.culler.paused)
+        node_path = "/SPIN/%s/%s" % (self.current_server_id, self.my_user_id)
+        bundle = publisher.create_bundle(node_path, params)
+        if bundle is None:
+            log.debug("Our params are already published in scene %s." % (self.current_server_id))
+        else:
+            log.info("Publishing %d params for our UserNode. Version %d." % (len(bundle.elements) - 1, publisher.version))
+            self.send_element(bundle, reliable=True)
     
+    def _republish_params(self, scene_id):
+        """
+        Creates our UserNode again, with all our params, if we are still in the scene that deleted it.
+        """
+        self._republish_call = None
+        if self.current_server_id == scene_id and self.is_connected():
+            log.warning("Our UserNode %s has been deleted. Creating it again with our params." % (self.my_user_id))
+            self._set_params_for_my_user_node()
+
+    def _forget_published_params(self):
+        """
+        Forgets which params of our UserNode the current scene has. The next bundle will contain all of them.
+        """
+        if self._params_publishers.has_key(self.current_server_id):
+            self._params_publishers[self.current_server_id].forget()
+
     def _create_statesets_for_my_user_and_cameras(self):
         """
         Everyone creates their own statesets at init time.
@@ -808,8 +1367,8 @@ class SpinicOscInterface(object):
         for cam in _cameras:
             (camera_id, hostname, sender_port) = cameras.parse_camera_scheme(cam)
             stateset_id = cameras.get_texture_id_from_camera_codename(cam) #  "%s@%s" % (camera_id, hostname)
-            self.send_to_scene("createStateSet", stateset_id, "SharedVideoTexture")
-            self.send_to_node_in_scene(stateset_id, "setTextureID", stateset_id) # same as its own name!
+            self.send_reliably_to_scene("createStateSet", stateset_id, "SharedVideoTexture")
+            self.send_reliably_to_node_in_scene(stateset_id, "setTextureID", stateset_id) # same as its own name!
         
     def choose_sharedvideotexture_for_user(self, user_id, texture_id):
         """
@@ -824,7 +1383,7 @@ class SpinicOscInterface(object):
         After you create the stateset, you still have to setTextureID
         We cannot create stateSet at init time, but must wait after we know all the other user node's params.
         """
-        self.send_to_node_in_scene(self._get_shapenode_for_user(user_id), "setStateSet", texture_id)
+        self.send_reliably_to_node_in_scene(self._get_shapenode_for_user(user_id), "setStateSet", texture_id)
     
     def get_textures_for_user(self, user_id):
         ret = []
@@ -834,10 +1393,10 @@ class SpinicOscInterface(object):
             log.warning("We don't have user info yet for " + user_id + ": " + str(e))
         else:
             if user_node_info.streaming_is_on:
-                for cam in cameras.create_camera_config_for_user_node_info(user_node_info).cameras:
+                for cam in user_node_info.camera_config.get_cameras():
                     ret.append(cameras.get_texture_id_from_camera_codename(cam))
             else:
-                log.debug("get_textures_for_user: Not yet streaming with %s" % (user_id))
+                self._hot_log.debug("get_textures_for_user: Not yet streaming with %s", user_id)
         return ret
                 
     def _get_shapenode_for_user(self, user_id):
@@ -912,7 +1471,7 @@ class SpinicOscInterface(object):
         self.send_to_scene("clear")
 
     def send_create_grid(self):
-        self.send_to_scene("createNode", "grid", "GridNode")
+        self.send_reliably_to_scene("createNode", "grid", "GridNode")
 
 #TODO: create another GUI for creating/moving one dummy model around. 
 # it will be useful for prototypes.
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+"""
+Receives and decodes OSC datagrams in a dedicated thread.
+
+The gtk2reactor can be busy redrawing the GUI or launching processes for a while. When the sockets are read by the reactor, datagrams pile up in the kernel receive buffer and get dropped when it is full.
+
+The ReceiverThread owns the sockets of the info and scene channels. It reads them as soon as datagrams arrive, decodes them, and pushes the OSC elements to a queue. The reactor thread drains that queue in batches and dispatches the elements to the txosc receivers. Consecutive global6DOF messages for the same node in a batch are coalesced, so that only the latest pose is handled.
+
+The handlers still run in the reactor thread, since they use lunch and gtk, which are not thread-safe.
+
+If the reactor is late by too much, the queue is bounded: the global6DOF messages are dropped first, since the next ones replace them. The other messages, such as nodeList and setParam, are only dropped beyond a much higher limit.
+"""
+import os
+import socket
+import struct
+import select
+import threading
+from collections import deque
+from twisted.internet import reactor
+from twisted.internet import error
+from txosc import osc
+from lunch import logger
+from spinic import fastosc
+from spinic import metrics
+
+log = logger.start(name="oscthread")
+
+MAX_QUEUE_LENGTH = 10000 # elements. Newer global6DOF messages are dropped when the reactor is late by that much.
+MAX_CONTROL_QUEUE_LENGTH = 5 * MAX_QUEUE_LENGTH # elements. Any newer element is dropped beyond that.
+
+_poses_dropped_gauge = metrics.gauge("oscthread.poses_dropped", "global6DOF messages dropped since the queue of the receiver thread was full")
+_elements_dropped_gauge = metrics.gauge("oscthread.elements_dropped", "Other OSC elements dropped since the queue of the receiver thread was full")
+_decode_errors_gauge = metrics.gauge("oscthread.decode_errors", "Datagrams that could not be decoded by the receiver thread")
+_elements_coalesced_gauge = metrics.gauge("oscthread.elements_coalesced", "global6DOF messages skipped since a newer one for the same node was in the same batch")
+MAX_DATAGRAM_SIZE = 65535
+
+class ListeningPort(object):
+    """
+    Returned by L{ReceiverThread.listen_multicast}.
+    Same interface as the port returned by reactor.listenMulticast.
+    """
+    def __init__(self, thread, sock, receiver, stats=None, capture=None, pose_handler=None):
+        self.thread = thread
+        self.socket = sock
+        self.receiver = receiver
+        self.stats = stats # L{spinic.udpstats.ChannelStats} or None
+        self.capture = capture # callable that records the datagrams, or None
+        self.pose_handler = pose_handler # callable for the global6DOF messages decoded by spinic.fastosc, or None
+
+    def stopListening(self):
+        """
+        Closes the socket in the receiver thread.
+        @return: None
+        """
+        self.thread.remove_listener(self)
+        return None
+
+    def getHost(self):
+        return self.socket.getsockname()
+
+class ReceiverThread(threading.Thread):
+    """
+    Owns multicast UDP sockets, reads and decodes the OSC datagrams they receive.
+    """
+    def __init__(self):
+        threading.Thread.__init__(self, name="spinic-osc-receiver")
+        self.daemon = True
+        self.datagrams_received = 0
+        self.decode_errors = 0
+        self.poses_dropped = 0 # global6DOF messages
+        self.elements_dropped = 0 # any other element
+        self.elements_coalesced = 0
+        self.new_drops = 0 # poses and elements dropped since the previous update
+        self.new_elements_dropped = 0 # only the elements that are not poses, since the previous update
+        self.new_decode_errors = 0 # idem
+        self._previous_drops = 0
+        self._previous_elements_dropped = 0
+        self._previous_decode_errors = 0
+        self._running = False
+        self._listeners = {} # socket: ListeningPort. Replaced, never changed in place, since the receiver thread reads it.
+        self._to_close = deque() # sockets that the receiver thread must close
+        self._queue = deque() # (ListeningPort, element, address) tuples, for the reactor thread
+        self._drain_is_scheduled = False
+        self._wake_read, self._wake_write = os.pipe()
+
+    def start(self):
+        self._running = True
+        threading.Thread.start(self)
+        reactor.addSystemEventTrigger("before", "shutdown", self.stop)
+
+    def stop(self):
+        self._running = False
+        self._wake_up()
+
+    def listen_multicast(self, port, multicast_addr, receiver, stats=None, capture=None, pose_handler=None):
+        """
+        Listens to a multicast group, dispatching the elements to a txosc receiver in the reactor thread.
+
+        Might raise a L{twisted.internet.error.CannotListenError}
+        @param receiver: L{txosc.dispatch.Receiver}
+        @param stats: L{spinic.udpstats.ChannelStats} to count the datagrams with, or None.
+        @param capture: Callable that records each datagram and the address of its sender, or None. Called in the receiver thread.
+        @param pose_handler: Callable that takes the OSC address, pose and sender address of the global6DOF messages, which are then decoded with L{spinic.fastosc}. Returns False if it did not handle it. Called in the reactor thread.
+        @rtype: L{ListeningPort}
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            # like listenMultiple=True in reactor.listenMulticast:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, "SO_REUSEPORT"):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(("", port))
+            membership = struct.pack("4s4s", socket.inet_aton(multicast_addr), socket.inet_aton("0.0.0.0"))
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+            sock.setblocking(False)
+        except socket.error, e:
+            sock.close()
+            raise error.CannotListenError(multicast_addr, port, e)
+        listener = ListeningPort(self, sock, receiver, stats, capture, pose_handler)
+        listeners = dict(self._listeners)
+        listeners[sock] = listener
+        self._listeners = listeners
+        self._wake_up()
+        return listener
+
+    def remove_listener(self, listener):
+        listeners = dict(self._listeners)
+        if listeners.has_key(listener.socket):
+            del listeners[listener.socket]
+            self._listeners = listeners
+            self._to_close.append(listener.socket)
+            self._wake_up()
+
+    def get_queue_length(self):
+        return len(self._queue)
+
+    def update(self):
+        """
+        Updates the metrics and the new drops. Should be called periodically, in the reactor thread.
+        """
+        drops = self.poses_dropped + self.elements_dropped
+        self.new_drops = drops - self._previous_drops
+        self._previous_drops = drops
+        self.new_elements_dropped = self.elements_dropped - self._previous_elements_dropped
+        self._previous_elements_dropped = self.elements_dropped
+        self.new_decode_errors = self.decode_errors - self._previous_decode_errors
+        self._previous_decode_errors = self.decode_errors
+        _poses_dropped_gauge.set(self.poses_dropped)
+        _elements_dropped_gauge.set(self.elements_dropped)
+        _decode_errors_gauge.set(self.decode_errors)
+        _elements_coalesced_gauge.set(self.elements_coalesced)
+
+    def __str__(self):
+        return "%d queued, %d global6DOF and %d other elements dropped, %d coalesced, %d decode errors" % (len(self._queue), self.poses_dropped, self.elements_dropped, self.elements_coalesced, self.decode_errors)
+
+    def _wake_up(self):
+        os.write(self._wake_write, "x")
+
+    def run(self):
+        """
+        Receiver thread main loop.
+        """
+        while self._running:
+            while len(self._to_close) != 0:
+                self._to_close.popleft().close()
+            listeners = self._listeners
+            try:
+                readable = select.select(listeners.keys() + [self._wake_read], [], [], 1.0)[0]
+            except select.error, e:
+                continue
+            for sock in readable:
+                if sock == self._wake_read:
+                    os.read(self._wake_read, 4096)
+                else:
+                    self._read_all(sock, listeners[sock])
+        for sock in self._listeners.keys():
+            sock.close()
+
+    def _read_all(self, sock, listener):
+        """
+        Reads all the datagrams waiting on a socket. Called in the receiver thread.
+        """
+        while True:
+            try:
+                data, address = sock.recvfrom(MAX_DATAGRAM_SIZE)
+            except socket.error, e:
+                return # EAGAIN
+            self.datagrams_received += 1
+            if listener.stats is not None:
+                listener.stats.datagrams_received += 1
+            if listener.capture is not None:
+                listener.capture(data, address)
+            element = None
+            if listener.pose_handler is not None:
+                element = fastosc.decode_global6dof(data) # (OSC address, pose) tuple
+            if element is None:
+                try:
+                    element = osc._elementFromBinary(data)
+                except Exception, e:
+                    self.decode_errors += 1
+                    continue
+            if len(self._queue) >= MAX_QUEUE_LENGTH:
+                if is_pose(element):
+                    self.poses_dropped += 1
+                    continue
+                elif len(self._queue) >= MAX_CONTROL_QUEUE_LENGTH:
+                    self.elements_dropped += 1
+                    continue
+            self._queue.append((listener, element, address))
+            if not self._drain_is_scheduled:
+                self._drain_is_scheduled = True
+                reactor.callFromThread(self._drain)
+
+    def _drain(self):
+        """
+        Dispatches the queued elements. Called in the reactor thread.
+        """
+        # The flag must be cleared before we pop, so that the receiver thread schedules another drain for what it pushes after.
+        self._drain_is_scheduled = False
+        batch = []
+        try:
+            while True:
+                batch.append(self._queue.popleft())
+        except IndexError:
+            pass
+        for listener, element, address in coalesce_poses(batch, self):
+            if listener.socket in self._listeners:
+                try:
+                    if type(element) is tuple:
+                        if listener.pose_handler(element[0], element[1], address):
+                            continue
+                        element = osc.Message(element[0], "global6DOF", *element[1])
+                    listener.receiver.dispatch(element, address)
+                except Exception, e:
+                    log.error("Error while handling %s: %s" % (element, e))
+
+def is_pose(element):
+    """
+    Tells if an element is a global6DOF message.
+    @param element: Either an OSC element, or a (OSC address, pose) tuple decoded by L{spinic.fastosc}.
+    @rtype: C{bool}
+    """
+    if type(element) is tuple:
+        return True
+    return isinstance(element, osc.Message) and len(element.arguments) != 0 and element.arguments[0].value == "global6DOF"
+
+def coalesce_poses(batch, stats=None):
+    """
+    Keeps only the latest global6DOF message for each OSC address in a batch.
+    The other elements are kept in their order.
+    @param batch: list of (listener, element, address) tuples. The element is either an OSC element, or a (OSC address, pose) tuple for the global6DOF messages decoded by L{spinic.fastosc}.
+    @rtype: C{list}
+    """
+    seen_addresses = set()
+    ret = []
+    for item in reversed(batch):
+        element = item[1]
+        if is_pose(element):
+            if type(element) is tuple:
+                osc_address = element[0]
+            else:
+                osc_address = element.address
+            if osc_address in seen_addresses:
+                if stats is not None:
+                    stats.elements_coalesced += 1
+                continue
+            seen_addresses.add(osc_address)
+        ret.append(item)
+    ret.reverse()
+    return ret
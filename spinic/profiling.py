@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""
+On-demand profiling of a running spinic.
+
+The profiler is started from the File menu, or by sending SIGUSR2 to the process:
+
+    kill -USR2 `pgrep -f scripts/spinic`
+
+It runs cProfile in the reactor thread for a given number of seconds, or until it is toggled again. It then writes a pstats file named spinic-<user_id>-<timestamp>.pstats, and a report next to it, which attributes the time to the OSC handlers, the CamerasManager, GTK and the rest.
+
+A report can also be printed for an existing pstats file:
+
+    python -m spinic.profiling spinic-kiosk1-20101019-153012.pstats
+"""
+import os
+import sys
+import time
+import signal
+import pstats
+import cProfile
+from twisted.internet import reactor
+from lunch import sig
+
+log = None
+
+DEFAULT_DIRECTORY = "~/.spinic/profiles"
+NUMBER_OF_FUNCTIONS_IN_REPORT = 25
+
+# (group name, test on the pstats (file name, function name)). The first that matches is used.
+GROUPS = [
+    ("SpinicOscInterface", lambda file_name, function_name: file_name.endswith(os.path.join("spinic", "osc.py"))),
+    ("OSC receiver thread (drain)", lambda file_name, function_name: file_name.endswith(os.path.join("spinic", "oscthread.py"))),
+    ("CamerasManager", lambda file_name, function_name: file_name.endswith(os.path.join("spinic", "cameras.py"))),
+    ("spinic GUI", lambda file_name, function_name: file_name.endswith(os.path.join("spinic", "gui.py"))),
+    ("GTK", lambda file_name, function_name: "gtk" in file_name or (file_name == "~" and ("gtk" in function_name or "gobject" in function_name))),
+    ("other spinic", lambda file_name, function_name: os.sep + "spinic" + os.sep in file_name),
+    ("txosc", lambda file_name, function_name: "txosc" in file_name),
+    ("lunch", lambda file_name, function_name: os.sep + "lunch" + os.sep in file_name),
+    ("twisted", lambda file_name, function_name: "twisted" in file_name),
+    ]
+
+def get_group(file_name, function_name):
+    """
+    @rtype: C{str}
+    """
+    for name, test in GROUPS:
+        if test(file_name, function_name):
+            return name
+    return "other"
+
+def create_report(stats_file):
+    """
+    Returns a human-readable report for a pstats file.
+    The time is attributed to groups using the time spent in the functions themselves, so that the groups add up to the total.
+    @rtype: C{str}
+    """
+    stats = pstats.Stats(stats_file)
+    total = stats.total_tt
+    groups = {}
+    handlers = []
+    for (file_name, line, function_name), (primitive_calls, calls, own_time, cumulative_time, callers) in stats.stats.iteritems():
+        group = get_group(file_name, function_name)
+        groups[group] = groups.get(group, 0.0) + own_time
+        if group in ("SpinicOscInterface", "CamerasManager"):
+            handlers.append((cumulative_time, calls, own_time, "%s:%d(%s)" % (os.path.basename(file_name), line, function_name)))
+    lines = []
+    lines.append("Profile %s" % (stats_file))
+    lines.append("Total time: %.3f s" % (total))
+    lines.append("")
+    lines.append("Time spent in each group of functions, excluding what they call:")
+    for name, own_time in sorted(groups.items(), key=lambda item: item[1], reverse=True):
+        percent = 0.0
+        if total > 0:
+            percent = own_time * 100.0 / total
+        lines.append(" * %-30s %8.3f s %5.1f %%" % (name, own_time, percent))
+    lines.append("")
+    lines.append("SpinicOscInterface and CamerasManager functions, by cumulative time:")
+    lines.append("   %10s %8s %10s  %s" % ("cumulative", "calls", "own", "function"))
+    handlers.sort(reverse=True)
+    for cumulative_time, calls, own_time, description in handlers[:NUMBER_OF_FUNCTIONS_IN_REPORT]:
+        lines.append(" * %10.3f %8d %10.3f  %s" % (cumulative_time, calls, own_time, description))
+    return "\n".join(lines) + "\n"
+
+class Profiler(object):
+    """
+    Starts and stops cProfile, and writes its results.
+    """
+    def __init__(self, user_id, directory=DEFAULT_DIRECTORY, duration=30.0):
+        """
+        @param duration: Number of seconds after which we stop profiling.
+        """
+        global log
+        from lunch import logger
+        log = logger.start(name="profiling")
+        self.user_id = user_id
+        self.directory = os.path.expanduser(directory)
+        self.duration = duration
+        self.state_changed_signal = sig.Signal() # args: is_running
+        self._profile = None
+        self._delayed_stop = None
+
+    def is_running(self):
+        """
+        @rtype: C{bool}
+        """
+        return self._profile is not None
+
+    def toggle(self):
+        if self.is_running():
+            self.stop()
+        else:
+            self.start()
+
+    def start(self):
+        if self.is_running():
+            log.warning("The profiler is already running.")
+            return
+        log.warning("Profiling for %d seconds." % (self.duration))
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        self._delayed_stop = reactor.callLater(self.duration, self.stop)
+        self.state_changed_signal(True)
+
+    def stop(self):
+        """
+        Stops profiling and writes the results.
+        Returns the path to the pstats file, or None.
+        @rtype: C{str}
+        """
+        if not self.is_running():
+            return None
+        self._profile.disable()
+        profile = self._profile
+        self._profile = None
+        if self._delayed_stop is not None and self._delayed_stop.active():
+            self._delayed_stop.cancel()
+        self._delayed_stop = None
+        self.state_changed_signal(False)
+        return self._write_results(profile)
+
+    def _write_results(self, profile):
+        file_name = os.path.join(self.directory, "spinic-%s-%s.pstats" % (self.user_id, time.strftime("%Y%m%d-%H%M%S")))
+        report_file_name = os.path.splitext(file_name)[0] + ".txt"
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            profile.dump_stats(file_name)
+            f = open(report_file_name, "w")
+            try:
+                f.write(create_report(file_name))
+            finally:
+                f.close()
+        except (IOError, OSError), e:
+            log.error("Could not write the profile to %s: %s" % (self.directory, e))
+            return None
+        log.warning("Wrote the profile to %s and its report to %s" % (file_name, report_file_name))
+        return file_name
+
+    def install_signal_handler(self, signal_number=signal.SIGUSR2):
+        """
+        Toggles the profiler when the process gets a signal.
+        """
+        def _handler(signal_number, frame):
+            # We might be interrupting anything. Let the reactor do it.
+            reactor.callFromThread(self.toggle)
+        signal.signal(signal_number, _handler)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m spinic.profiling <file.pstats>...")
+        sys.exit(1)
+    for stats_file in sys.argv[1:]:
+        print(create_report(stats_file))
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+"""
+Replays a capture of SPIN OSC traffic into a headless SpinicOscInterface.
+
+Capture the traffic of a kiosk with spinic --capture-file, and replay it with:
+
+    python -m spinic.replay --user-id kiosk1 --speed 4 capture.bin
+
+Nothing is sent on the network and no process is launched: the messages we would send are counted, and the commands we would launch or stop are listed. At the end, we print the handler throughput and the command sequence, so that two builds can be compared on the same input.
+"""
+import time
+from optparse import OptionParser
+from twisted.internet import reactor
+from twisted.internet import defer
+from txosc import osc
+from lunch import logger
+from lunch import sig
+from spinic import capture
+from spinic import fastosc
+from spinic import loadshedding
+from spinic import metrics
+from spinic import runner
+
+log = logger.start(name="replay")
+
+MAX_SPEED_BATCH_SIZE = 1000 # datagrams handled before we give the reactor a chance to run, at maximum speed
+
+class ReplayLauncher(object):
+    """
+    Records the commands spinic would launch and stop, instead of launching them.
+    Same interface as the parts of L{spinic.launching.ProcessLauncher} that the other objects call.
+    """
+    def __init__(self, replayer):
+        self.replayer = replayer
+        self.lunch_gui = None
+        self.commands = [] # (replay time, action, identifier, command) tuples
+        self.child_running_signal = sig.Signal() # never triggered, since nothing is launched
+
+    def add_command_on_host(self, command_txt, identifier, hostname=None, display=None):
+        self.commands.append((self.replayer.get_replay_time(), "add", identifier, command_txt))
+
+    def remove_command(self, identifier):
+        self.commands.append((self.replayer.get_replay_time(), "remove", identifier, None))
+
+    def suspend_command(self, identifier):
+        self.commands.append((self.replayer.get_replay_time(), "suspend", identifier, None))
+
+    def resume_command(self, identifier):
+        self.commands.append((self.replayer.get_replay_time(), "resume", identifier, None))
+
+    def switch_to_scene(self, scene_id):
+        self.commands.append((self.replayer.get_replay_time(), "switch_to_scene", scene_id, None))
+
+class _NullListeningPort(object):
+    def stopListening(self):
+        return None
+
+def _create_osc_interface_class():
+    """
+    Defines the replay OSC interface. spinic.osc is imported here, since it starts its logging.
+    """
+    from spinic import osc
+
+    class ReplayOscInterface(osc.SpinicOscInterface):
+        """
+        SpinicOscInterface without sockets. The datagrams are given to its receivers by the L{Replayer}.
+        """
+        def __init__(self, app=None):
+            osc.SpinicOscInterface.__init__(self, app)
+            self.elements_sent = 0
+
+        def _start_info_listener(self):
+            self._create_info_receiver()
+
+        def _start_scene_listener(self):
+            self._create_scene_receiver()
+            self._scene_receiver_protocol = _NullListeningPort()
+            return defer.succeed(None)
+
+        def _start_scene_sender(self):
+            pass
+
+        def _start_tcp_sender(self):
+            pass
+
+        def _send_element_with_udp(self, element):
+            self.elements_sent += 1
+            return defer.succeed(None)
+
+        def _server_list_updated(self):
+            # Connect to the first scene we see, if none was chosen.
+            if self.current_server_id is None and self.app.config.default_scene_id is None and len(self.servers) != 0:
+                self.app.config.default_scene_id = self.servers.keys()[0]
+            osc.SpinicOscInterface._server_list_updated(self)
+
+    return ReplayOscInterface
+
+class ReplayApplication(object):
+    """
+    Headless application, with the same attributes as L{spinic.runner.Application}, for replaying.
+    """
+    def __init__(self, config, replayer):
+        from spinic import cameras
+        from spinic import nullgui
+        self.config = config
+        self.launcher = ReplayLauncher(replayer)
+        self.profiler = None
+        self.load_shedder = loadshedding.LoadShedder(config.lag_thresholds) # stays in the normal tier, since there is no lag probe
+        self.gui = nullgui.NullGui(app=self)
+        self.cameras_manager = cameras.CamerasManager(self, read_config_file=False)
+        if config.cameras_config_file is not None:
+            self.cameras_manager.parse_config_file(config.cameras_config_file)
+        self.osc_interface = _create_osc_interface_class()(app=self)
+        self.osc_interface._start_info_listener()
+
+    def on_window_shown(self):
+        pass
+
+class Replayer(object):
+    """
+    Feeds the records of a capture file to the receivers of a ReplayOscInterface.
+    """
+    def __init__(self, app_config, file_name, speed=1.0):
+        """
+        @param speed: 1.0 for real time, 2.0 for twice as fast, or None for as fast as possible.
+        """
+        self.file_name = file_name
+        self.speed = speed
+        self.records = capture.read_capture(file_name)
+        self.datagrams = {capture.INFO_CHANNEL: 0, capture.SCENE_CHANNEL: 0}
+        self.elements = 0
+        self.decode_errors = 0
+        self.handler_errors = 0
+        self.handling_duration = 0.0 # seconds spent in the receivers
+        self._first_timestamp = None
+        self._last_timestamp = None
+        self._start_time = None
+        self._end_time = None
+        self._next_record = None
+        self.done = defer.Deferred()
+        self.app = ReplayApplication(app_config, self)
+
+    def get_replay_time(self):
+        """
+        Returns the time of the datagram being handled, relative to the first one in the capture.
+        @rtype: C{float}
+        """
+        if self._first_timestamp is None or self._last_timestamp is None:
+            return 0.0
+        return self._last_timestamp - self._first_timestamp
+
+    def start(self):
+        self._start_time = time.time()
+        reactor.callLater(0, self._feed)
+        return self.done
+
+    def _feed(self):
+        """
+        Handles the datagrams that are due, and schedules the next call.
+        """
+        count = 0
+        while True:
+            if self._next_record is None:
+                try:
+                    self._next_record = self.records.next()
+                except StopIteration:
+                    self._end_time = time.time()
+                    self.done.callback(None)
+                    return
+                except RuntimeError, e:
+                    self.done.errback(e)
+                    return
+            timestamp = self._next_record[0]
+            if self._first_timestamp is None:
+                self._first_timestamp = timestamp
+            if self.speed is None:
+                if count >= MAX_SPEED_BATCH_SIZE:
+                    reactor.callLater(0, self._feed)
+                    return
+            else:
+                delay = (timestamp - self._first_timestamp) / self.speed - (time.time() - self._start_time)
+                if delay > 0:
+                    reactor.callLater(delay, self._feed)
+                    return
+            self._handle_record(self._next_record)
+            self._next_record = None
+            count += 1
+
+    def _handle_record(self, record):
+        timestamp, channel, address, data = record
+        self._last_timestamp = timestamp
+        self.datagrams[channel] = self.datagrams.get(channel, 0) + 1
+        osc_interface = self.app.osc_interface
+        if channel == capture.SCENE_CHANNEL and osc_interface.scene_receiver is not None:
+            # Like the listener of the scene channel does:
+            decoded = fastosc.decode_global6dof(data)
+            if decoded is not None and self._call_handler(osc_interface.handle_global6dof, decoded[0], decoded[1], address) is not False:
+                return
+        try:
+            element = osc._elementFromBinary(data)
+        except Exception, e:
+            self.decode_errors += 1
+            return
+        if channel == capture.INFO_CHANNEL:
+            receiver = osc_interface.info_receiver
+        else:
+            receiver = osc_interface.scene_receiver
+            if receiver is None:
+                return # not connected to a scene yet
+        self._call_handler(receiver.dispatch, element, address)
+
+    def _call_handler(self, function, *args):
+        """
+        Calls a handler with a decoded element, counting the elements and measuring the time spent in the handlers.
+        Returns what it returns, or None if it raised an error.
+        """
+        self.elements += 1
+        start_time = time.time()
+        ret = None
+        try:
+            ret = function(*args)
+        except Exception, e:
+            self.handler_errors += 1
+            log.error("Error while handling %s: %s" % (args[0], e))
+        if ret is False:
+            self.elements -= 1 # given to txosc instead
+        self.handling_duration += time.time() - start_time
+        return ret
+
+    def get_report(self):
+        """
+        @rtype: C{str}
+        """
+        lines = []
+        duration = (self._end_time or time.time()) - self._start_time
+        total = sum(self.datagrams.values())
+        lines.append("Replayed %s at %s speed" % (self.file_name, self.speed is None and "maximum" or "%sx" % (self.speed)))
+        lines.append("Capture duration: %.3f s. Replay duration: %.3f s." % (self.get_replay_time(), duration))
+        for channel, count in sorted(self.datagrams.items()):
+            lines.append(" * %s channel: %d datagrams" % (capture.CHANNEL_NAMES.get(channel, channel), count))
+        lines.append(" * %d elements dispatched, %d decode errors, %d handler errors" % (self.elements, self.decode_errors, self.handler_errors))
+        if self.handling_duration > 0:
+            lines.append(" * Handlers: %.3f s, %.0f elements/s" % (self.handling_duration, self.elements / self.handling_duration))
+        if duration > 0:
+            lines.append(" * Overall: %.0f datagrams/s" % (total / duration))
+        lines.append(" * %d elements would have been sent" % (self.app.osc_interface.elements_sent))
+        lines.append("")
+        lines.append("Handlers:")
+        for name, metric in sorted(metrics.registry.metrics.items()):
+            if name.startswith("osc.") and metric.kind == "counter":
+                lines.append(" * %-30s %d" % (name, metric.value))
+            elif name.startswith("osc.") and metric.kind == "histogram":
+                lines.append(" * %-30s count %d, p50 <= %s s, p99 <= %s s, max %.6f s" % (name, metric.count, metric.get_percentile(50), metric.get_percentile(99), metric.max))
+        lines.append("")
+        lines.append("Join phases:")
+        for phase, summary in sorted(self.app.osc_interface.join_tracer.get_summary().items()):
+            lines.append(" * %-30s %s" % (phase, summary))
+        lines.append("")
+        lines.append("Commands:")
+        for replay_time, action, identifier, command in self.app.launcher.commands:
+            if command is None:
+                lines.append(" * %9.3f %-16s %s" % (replay_time, action, identifier))
+            else:
+                lines.append(" * %9.3f %-16s %s: %s" % (replay_time, action, identifier, command))
+        return "\n".join(lines) + "\n"
+
+def run():
+    parser = OptionParser(usage="%prog [options] <capture file>")
+    parser.add_option("-u", "--user-id", type="string", help="User ID of the spinic that captured the traffic.")
+    parser.add_option("-s", "--scene-id", type="string", help="SPIN scene ID to connect to. Defaults to the first one in the capture.")
+    parser.add_option("-c", "--config-file", type="string", help="Path to the config file for the cameras. By default, we have no cameras.")
+    parser.add_option("-x", "--speed", type="float", default=1.0, help="Replay speed. 1 for real time, 10 for ten times as fast. Defaults to 1.")
+    parser.add_option("-m", "--max-speed", action="store_true", help="Replays as fast as possible.")
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("Please give one capture file.")
+    config = runner.Configuration()
+    config.headless = True
+    config.enable_tcp_sender = False
+    config.cameras_config_file = options.config_file
+    config.default_scene_id = options.scene_id
+    if options.user_id is not None:
+        config.user_id = options.user_id
+    speed = options.speed
+    if options.max_speed:
+        speed = None
+    replayer = Replayer(config, args[0], speed=speed)
+    def _done(result):
+        print(replayer.get_report())
+        reactor.stop()
+    def _error(failure):
+        print("Error: %s" % (failure.getErrorMessage()))
+        reactor.stop()
+    replayer.start().addCallbacks(_done, _error)
+    reactor.run()
+
+if __name__ == "__main__":
+    run()
@@ -7,7 +7,16 @@ import socket
 import os
 import sys
 import gc
+import time
 import warnings
+from twisted.internet import defer
+from spinic import loadshedding
+from spinic import spindefaults
+
+log = None # started once lunch master's logging has been set up
+
+DEFAULT_CAMERAS_CONFIG_FILE = "~/.spinic.json"
+
 # HACK to raise an exception when we get a GtkWarning
 def custom_show_warning(message, category, filename, lineno, file=None, line=None):
         """ 
@@ -18,22 +27,70 @@ def custom_show_warning(message, category, filename, lineno, file=None, line=Non
         if "could not open display" in message:
             raise RuntimeError("Error: Could not open display. Spinic needs a $DISPLAY.")
 
-warnings.showwarning = custom_show_warning
-try:
-    from twisted.internet import gtk2reactor
-    gtk2reactor.install()
-    import gtk
-except RuntimeError, e:
-    print(str(e))
-    sys.exit(1)
-if not os.environ.has_key("DISPLAY"):
-    print("Error: Could not open display. Spinic needs a $DISPLAY.")
-    sys.exit(1)
-from twisted.internet import reactor
-from twisted.internet import defer
-from spinic import spindefaults
+def _install_gtk_reactor():
+    """
+    Installs the gtk2reactor and imports gtk.
 
-DEFAULT_CAMERAS_CONFIG_FILE = "~/.spinic.json"
+    Exits if there is no $DISPLAY.
+    This is done when we run, not when this module is imported, since importing gtk is slow.
+    """
+    warnings.showwarning = custom_show_warning
+    try:
+        from twisted.internet import gtk2reactor
+        gtk2reactor.install()
+        import gtk
+    except RuntimeError, e:
+        print(str(e))
+        sys.exit(1)
+    if not os.environ.has_key("DISPLAY"):
+        print("Error: Could not open display. Spinic needs a $DISPLAY.")
+        sys.exit(1)
+
+def _install_epoll_reactor():
+    """
+    Installs the epoll reactor, for the headless mode. Falls back to the default reactor if epoll is not available.
+    """
+    try:
+        from twisted.internet import epollreactor
+        epollreactor.install()
+    except ImportError, e:
+        print("Could not install the epoll reactor: %s. Using the default one." % (e))
+
+class StartupTimer(object):
+    """
+    Measures how long each phase of the startup takes.
+    """
+    def __init__(self):
+        self.start_time = time.time()
+        self.phases = [] # list of (name, start, end) tuples, in the order they started
+        self._started = {} # name: start time for the phases that are not done yet
+    
+    def start_phase(self, name):
+        self._started[name] = time.time()
+    
+    def end_phase(self, name):
+        try:
+            start = self._started.pop(name)
+        except KeyError:
+            log.error("Startup phase %s was never started." % (name))
+        else:
+            self.phases.append((name, start, time.time()))
+    
+    def mark(self, name):
+        """
+        Records an instantaneous event, such as the window being shown.
+        """
+        now = time.time()
+        self.phases.append((name, now, now))
+    
+    def get_summary(self):
+        """
+        @rtype: C{str}
+        """
+        lines = []
+        for name, start, end in sorted(self.phases, key=lambda phase: phase[1]):
+            lines.append(" * %-20s at %6.1f ms took %6.1f ms" % (name, (start - self.start_time) * 1000.0, (end - start) * 1000.0))
+        return "\n".join(lines)
 
 class Configuration(object):
     """
@@ -52,12 +109,35 @@ class Configuration(object):
         self.clear_old_shared_memory_files = True
         self.enable_firereset = True
         self.banner_image_file = None
+        self.headless = False
+        self.control_port = None
+        self.enable_receiver_thread = False
+        self.info_receive_buffer_size = None # bytes. None for the kernel default.
+        self.scene_receive_buffer_size = None # bytes. None for the kernel default.
+        self.server_timeout = 30.0 # seconds after which we forget a SPIN server we have not heard of
+        self.user_timeout = 60.0 # seconds after which we stop streaming with a user we have not heard of. They ping every 15 seconds.
+        self.enable_tcp_sender = True # sends the messages that change the state of the scene over TCP
+        self.auto_refresh_interval = 10.0 # minimum number of seconds between two automatic refreshes. None to disable them.
+        self.debug_log_sampling = 100 # in debug mode, logs one of every N global6DOF messages received
+        self.metrics_port = None # local HTTP port to serve the metrics on. None to disable it.
+        self.metrics_file = None # JSON file to write the metrics to periodically. None to disable it.
+        self.metrics_snapshot_interval = 10.0 # seconds
+        self.profile_directory = "~/.spinic/profiles" # where the profiler started with SIGUSR2 or the menu writes its results
+        self.profile_duration = 30.0 # seconds
+        self.capture_file = None # binary log to capture the OSC datagrams we receive to. See spinic.replay
+        self.camera_selection_rate = 30.0 # maximum number of times per second we choose the cameras we see the users with. 0 for once per reactor iteration.
+        self.enable_culling = False # pauses the video of the users we cannot see. See spinic.culling
+        self.culling_field_of_view = 90.0 # degrees we see in spinviewer
+        self.culling_max_distance = 50.0 # meters beyond which we don't need to see the users
+        self.enable_load_shedding = True # skips some work when the reactor lags. See spinic.loadshedding
+        self.lag_thresholds = loadshedding.DEFAULT_THRESHOLDS # seconds of smoothed reactor lag to enter each load shedding tier
+        self.join_trace_file = None # Chrome trace JSON file to write the join timeline of each peer to. See spinic.jointrace
 
 class Application(object):
     """
     Application singleton which contains all the important objects.
     """
-    def __init__(self, config):
+    def __init__(self, config, startup_timer=None):
         # attributes:
         self.config = config
         self.gui = None
@@ -65,6 +145,15 @@ class Application(object):
         self.launcher = None
         self.cameras_manager = None
         self.audio_connector = None
+        self.control_interface = None
+        self.lag_probe = None
+        self.profiler = None
+        self.load_shedder = None
+        self.metrics_exporter = None
+        self.startup_timer = startup_timer
+        if self.startup_timer is None:
+            self.startup_timer = StartupTimer()
+        self._window_has_been_shown = False
         
         # action!
         self._start()
@@ -72,34 +161,159 @@ class Application(object):
     def _start(self):
         """
         Called only once at startup.
+
+        Creates the window first, and then schedules the other initialization steps on the reactor.
         """
+        global log
+        timer = self.startup_timer
+        timer.start_phase("launcher")
         from spinic.launching import ProcessLauncher
         try:
             self.launcher = ProcessLauncher(app=self)
             # Logging has started in lunch after this point.
         except RuntimeError, e: # an other lunch master with the same id is running
             _exit_with_error(str(e))
+        timer.end_phase("launcher")
         #XXX Importing those modules starts their logging.
         # it must be done once lunch master's logging has been set up
         from lunch import logger
         log = logger.start(name="spinic.runner")
+        from spinic import profiling
+        self.profiler = profiling.Profiler(self.config.user_id, directory=self.config.profile_directory, duration=self.config.profile_duration)
+        self.profiler.install_signal_handler()
+        self.load_shedder = loadshedding.LoadShedder(self.config.lag_thresholds)
+        timer.start_phase("imports")
         from spinic.osc import SpinicOscInterface
-        from spinic.gui import Gui
+        if self.config.headless:
+            from spinic.nullgui import NullGui as Gui
+        else:
+            from spinic.gui import Gui
         from spinic import cameras
         from spinic import audioconnector
-        if self.config.enable_firereset:
-            from lunch import gui
-            log.warning("Calling firereset")
-            deferred = gui.run_once("firereset")
+        timer.end_phase("imports")
         
-        cameras.clear_all_dev_shm(self.config.clear_old_shared_memory_files)
+        timer.start_phase("gui")
         self.gui = Gui(app=self)
-        self.osc_interface = SpinicOscInterface(app=self)
+        timer.end_phase("gui")
         try:
-            self.cameras_manager = cameras.CamerasManager(self)
+            self.cameras_manager = cameras.CamerasManager(self, read_config_file=False)
         except RuntimeError, e:
             _exit_with_error(str(e))
+        self.osc_interface = SpinicOscInterface(app=self)
         self.audio_connector = audioconnector.AudioConnector(self)
+        from twisted.internet import reactor
+        reactor.callLater(0, self._start_init_steps)
+
+    def _start_init_steps(self):
+        """
+        Runs the initialization steps that do not depend on each other concurrently.
+        
+        The info listener is started once the cameras config file is parsed,
+        since connecting to a scene requires the params of our UserNode.
+        @rettype: L{twisted.internet.defer.Deferred}
+        """
+        from twisted.internet import threads
+        from spinic import cameras
+        from spinic import launching
+        deferreds = []
+        if self.config.enable_firereset:
+            log.warning("Calling firereset")
+            deferreds.append(self._run_init_step("firereset", launching.run_once, "firereset"))
+        if self.config.control_port is not None:
+            deferreds.append(self._run_init_step("control_listener", self._start_control_interface))
+        deferreds.append(self._run_init_step("metrics", self._start_metrics))
+        deferreds.append(self._run_init_step("clear_dev_shm", threads.deferToThread, cameras.clear_all_dev_shm, self.config.clear_old_shared_memory_files))
+        deferred = self._run_init_step("cameras_config", self._parse_cameras_config)
+        deferred.addCallback(self._start_info_listener)
+        deferreds.append(deferred)
+        deferred_list = defer.DeferredList(deferreds)
+        def _cb(result):
+            log.info("Startup timing:\n%s" % (self.startup_timer.get_summary()))
+            return result
+        deferred_list.addCallback(_cb)
+        return deferred_list
+
+    def _run_init_step(self, name, function, *args):
+        """
+        Calls a function that might return a Deferred and measures how long it takes.
+        Errors are logged, not propagated. If the step tried to exit, we exit with an error dialog.
+        @rettype: L{twisted.internet.defer.Deferred}
+        """
+        self.startup_timer.start_phase(name)
+        def _cb(result):
+            self.startup_timer.end_phase(name)
+            return result
+        def _eb(failure):
+            if failure.check(SystemExit):
+                _exit_with_error("Startup step %s failed. Giving up!" % (name))
+            else:
+                log.error("Startup step %s failed: %s" % (name, failure.getErrorMessage()))
+            return None
+        deferred = defer.maybeDeferred(function, *args)
+        deferred.addErrback(_eb)
+        deferred.addCallback(_cb)
+        return deferred
+
+    def _start_info_listener(self, is_configured):
+        """
+        Starts listening to the info channel, unless we could not read the cameras config.
+        @param is_configured: Result of _parse_cameras_config. None if it failed.
+        """
+        if not is_configured:
+            log.error("Not joining any scene, since we could not read the cameras config.")
+            return None
+        return self._run_init_step("info_listener", self.osc_interface.start)
+
+    def _start_control_interface(self):
+        """
+        Starts listening for control messages.
+        """
+        from spinic import control
+        try:
+            self.control_interface = control.ControlInterface(self, self.config.control_port)
+        except RuntimeError, e:
+            _exit_with_error(str(e))
+
+    def _start_metrics(self):
+        """
+        Starts measuring the reactor lag, and exports the metrics if asked to.
+        """
+        from spinic import metrics
+        self.lag_probe = metrics.LagProbe()
+        if self.config.enable_load_shedding:
+            self.lag_probe.tick_signal.connect(self.load_shedder.on_lag)
+        self.lag_probe.start()
+        if self.config.metrics_port is not None or self.config.metrics_file is not None:
+            self.metrics_exporter = metrics.MetricsExporter(port=self.config.metrics_port, snapshot_file=self.config.metrics_file, snapshot_interval=self.config.metrics_snapshot_interval)
+            try:
+                self.metrics_exporter.start()
+            except RuntimeError, e:
+                log.error(str(e))
+
+    def _parse_cameras_config(self):
+        """
+        Reads the cameras config file. Exits with an error dialog if it is invalid.
+        Returns True if it is valid.
+        @rtype: C{bool}
+        """
+        try:
+            self.cameras_manager.parse_config_file(self.config.cameras_config_file)
+        except RuntimeError, e:
+            _exit_with_error(str(e))
+            return False
+        else:
+            self.gui.update_cameras_text("\n".join(self.cameras_manager.get_my_cameras()))
+            return True
+
+    def on_window_shown(self):
+        """
+        Called by the GUI each time its main window is shown. Only the first time matters.
+        """
+        if self._window_has_been_shown:
+            return
+        self._window_has_been_shown = True
+        self.startup_timer.mark("window_shown")
+        log.info("Time to interactive: %.1f ms" % ((time.time() - self.startup_timer.start_time) * 1000.0))
 
     def __del__(self):
         """
@@ -110,24 +324,42 @@ class Application(object):
         from spinic import cameras
         cameras.clear_all_dev_shm(app.config.clear_old_shared_memory_files)
 
+_exit_status = 0
+_is_headless = False # no error dialog in headless mode
+
 def _exit_with_error(error_message):
     """
     Exits with an error dialog
     """
+    global _exit_status
+    from twisted.internet import reactor
+    if _is_headless:
+        print(error_message)
+        if reactor.running:
+            _exit_status = 1
+            reactor.stop()
+            return
+        else:
+            sys.exit(1)
     from lunch import dialogs
     deferred = defer.Deferred()
     def _cb(result):
         reactor.stop()
     deferred.addCallback(_cb)
     error_dialog = dialogs.ErrorDialog(deferred, error_message)
-    reactor.run()
-    sys.exit(1)
+    if reactor.running:
+        # we are in one of the init steps. run() will exit once the dialog is closed.
+        _exit_status = 1
+    else:
+        reactor.run()
+        sys.exit(1)
 
 
 def run(datadir=None, version=None):
     """
     Reads the command-line options, instanciates the application and runs the reactor.
     """
+    global _is_headless
     # Instanciate the Configuration object:
     #FIXME:2010-07-28:aalex:Should not print anything before parsing command-line options
     config = Configuration()
@@ -145,9 +377,37 @@ def run(datadir=None, version=None):
     parser.add_option("-C", "--disable-shared-memory-deletion", action="store_true", help="If not provided, Spinic clears old /dev/shm/spinic-* files at startup")
     parser.add_option("-F", "--disable-firereset", action="store_true", help="If not provided, Spinic calls firereset at startup")
     parser.add_option("-b", "--banner", type="string", help="Provides a path to an image file to be displayed as a banner.")
+    parser.add_option("-H", "--headless", action="store_true", help="Runs without any GUI nor $DISPLAY. Use it with --scene-id and/or --control-port.")
+    parser.add_option("-o", "--control-port", type="int", help="Local UDP port to listen to for OSC control messages such as /spinic/connect <scene_id>")
+    parser.add_option("-T", "--receiver-thread", action="store_true", help="Receives and decodes the SPIN OSC messages in a dedicated thread, so that a busy GUI does not delay them.")
+    parser.add_option("-i", "--info-receive-buffer", type="int", help="Size of the receive buffer of the info channel socket, in bytes. Defaults to the kernel default.")
+    parser.add_option("-r", "--scene-receive-buffer", type="int", help="Size of the receive buffer of the scene channel socket, in bytes. Defaults to the kernel default.")
+    parser.add_option("-R", "--disable-auto-refresh", action="store_true", help="If not provided, Spinic asks the scene for a refresh when the kernel drops some of its messages")
+    parser.add_option("-l", "--debug-log-sampling", type="int", help="In debug mode, logs only one of every N global6DOF messages received. Defaults to 100. Use 1 to log them all.")
+    parser.add_option("-m", "--metrics-port", type="int", help="Local HTTP port to serve the metrics on, as text on /metrics and as JSON on /metrics.json")
+    parser.add_option("-M", "--metrics-file", type="string", help="Path to a JSON file to write the metrics to periodically")
+    parser.add_option("-w", "--capture-file", type="string", help="Writes the OSC datagrams received on the info and scene channels to a binary log, that can be replayed with python -m spinic.replay")
+    parser.add_option("-J", "--join-trace-file", type="string", help="Writes the timeline of the join with each peer to a Chrome trace JSON file, that can be opened in Perfetto or chrome://tracing")
+    parser.add_option("-k", "--camera-selection-rate", type="float", help="Maximum number of times per second Spinic chooses the cameras it sees the users with, after they moved. Use 0 to do it once per reactor iteration. Defaults to 30.")
+    parser.add_option("-V", "--enable-culling", action="store_true", help="Pauses the video streams of the users outside our field of view or too far, and resumes them before they come into view")
+    parser.add_option("-f", "--field-of-view", type="float", help="Horizontal field of view of spinviewer, in degrees, for --enable-culling. Defaults to 90.")
+    parser.add_option("-D", "--max-distance", type="float", help="Distance, in meters, beyond which the video of the users is paused, with --enable-culling. Defaults to 50.")
+    parser.add_option("-L", "--lag-thresholds", type="string", help="Comma-separated reactor lags, in seconds, at which Spinic throttles its GUI statistics, decimates the global6DOF messages and defers the sends that can wait. Defaults to %s" % (",".join([str(threshold) for threshold in loadshedding.DEFAULT_THRESHOLDS])))
+    parser.add_option("-S", "--disable-load-shedding", action="store_true", help="If not provided, Spinic skips some work when its reactor lags")
+    parser.add_option("-U", "--disable-tcp", action="store_true", help="If not provided, Spinic sends the messages that change the state of the scene to the TCP port of the SPIN server")
     (options, args) = parser.parse_args()
+    startup_timer = StartupTimer()
+    startup_timer.start_phase("reactor")
+    if options.headless:
+        _is_headless = True
+        _install_epoll_reactor()
+    else:
+        _install_gtk_reactor()
+    startup_timer.end_phase("reactor")
     
+    startup_timer.start_phase("spin_defaults")
     defaults = spindefaults.read_spin_defaults()
+    startup_timer.end_phase("spin_defaults")
     print("Welcome to Spinic!")
     if defaults is None:
         print("Could not read SPIN defaults.")
@@ -179,15 +439,43 @@ def run(datadir=None, version=None):
     config.show_puredata_gui = options.show_puredata_gui
     config.clear_old_shared_memory_files = not options.disable_shared_memory_deletion
     config.enable_firereset = not options.disable_firereset
+    config.headless = bool(options.headless)
+    config.control_port = options.control_port
+    config.enable_receiver_thread = bool(options.receiver_thread)
+    config.info_receive_buffer_size = options.info_receive_buffer
+    config.scene_receive_buffer_size = options.scene_receive_buffer
+    config.enable_tcp_sender = not options.disable_tcp
+    config.metrics_port = options.metrics_port
+    config.capture_file = options.capture_file
+    config.join_trace_file = options.join_trace_file
+    config.enable_load_shedding = not options.disable_load_shedding
+    config.enable_culling = bool(options.enable_culling)
+    if options.field_of_view is not None:
+        config.culling_field_of_view = options.field_of_view
+    if options.max_distance is not None:
+        config.culling_max_distance = options.max_distance
+    if options.camera_selection_rate is not None:
+        config.camera_selection_rate = options.camera_selection_rate
+    if options.lag_thresholds is not None:
+        try:
+            config.lag_thresholds = loadshedding.parse_thresholds(options.lag_thresholds)
+        except RuntimeError, e:
+            parser.error(str(e))
+    config.metrics_file = options.metrics_file
+    if options.debug_log_sampling is not None:
+        config.debug_log_sampling = options.debug_log_sampling
+    if options.disable_auto_refresh:
+        config.auto_refresh_interval = None
     
     # instanciate the application. (might exit with error)
-    app = Application(config)
+    app = Application(config, startup_timer=startup_timer)
     
     # run the reactor:
+    from twisted.internet import reactor
     reactor.run()
     del app
     #FIXME:2010-07-28:aalex:For some reason, the destructor is never called.
     gc.collect() # Forcing garbage collection to try to call the desctructor
     print("\nGoodbye.")
-    sys.exit(0)
+    sys.exit(_exit_status)
 
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+Keeps the OSC messages we send often already encoded.
+
+Spinic sends the same messages again and again: the ping of our UserNode, the setStateSet of a billboard when the camera we see a user with flips back and forth, the refresh of the scene... Encoding them with txosc creates an argument object per argument, and then the binary string. The EncodedMessageCache keeps the last ones encoded, keyed on their address and arguments, so that sending them again is a dict lookup.
+
+The cached elements have the toBinary method of the txosc elements, so they can be given to the UDP and TCP senders as is.
+
+The least recently used order is kept in a circular doubly linked list, whose links are found with a dict, since collections.OrderedDict is not in Python 2.6.
+"""
+from txosc import osc
+from spinic import metrics
+
+DEFAULT_MAX_SIZE = 256 # messages
+# Indices in the links of the least recently used list:
+_PREVIOUS = 0
+_NEXT = 1
+_KEY = 2
+_MESSAGE = 3
+
+_hits = metrics.counter("sendcache.hits", "Outgoing OSC messages that were already encoded")
+_misses = metrics.counter("sendcache.misses", "Outgoing OSC messages we had to encode")
+_evictions = metrics.counter("sendcache.evictions", "Encoded OSC messages dropped from the cache since it was full")
+_size_gauge = metrics.gauge("sendcache.size", "Encoded OSC messages in the cache")
+
+class EncodedMessage(object):
+    """
+    OSC message that has already been encoded.
+    """
+    __slots__ = ["address", "arguments", "data"]
+
+    def __init__(self, address, arguments, data):
+        self.address = address
+        self.arguments = arguments # tuple of Python values
+        self.data = data
+
+    def toBinary(self):
+        """
+        Same as L{txosc.osc.Message.toBinary}.
+        @rtype: C{str}
+        """
+        return self.data
+
+    def __str__(self):
+        return "%s %s" % (self.address, " ".join([str(argument) for argument in self.arguments]))
+
+class EncodedMessageCache(object):
+    """
+    Least recently used OSC messages, encoded.
+    """
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._links = {} # keys are (address, arguments, their types). Values are [previous, next, key, message] links.
+        self._root = [] # sentinel of the list. Its next link is the least recently used one.
+        self._root[:] = [self._root, self._root, None, None]
+
+    def get_message(self, address, arguments):
+        """
+        Returns the encoded message for an OSC address and its arguments.
+        @param arguments: tuple of Python values, as given to L{txosc.osc.Message}.
+        @rtype: L{EncodedMessage}
+        """
+        # 1 and 1.0 are equal, but are encoded differently:
+        key = (address, arguments, tuple([type(argument) for argument in arguments]))
+        try:
+            link = self._links.get(key)
+        except TypeError:
+            # Some argument cannot be hashed. Do not cache it.
+            return self._encode(address, arguments)
+        root = self._root
+        if link is not None:
+            # Move it to the end, since it is now the most recently used:
+            link[_PREVIOUS][_NEXT] = link[_NEXT]
+            link[_NEXT][_PREVIOUS] = link[_PREVIOUS]
+            last = root[_PREVIOUS]
+            link[_PREVIOUS] = last
+            link[_NEXT] = root
+            last[_NEXT] = link
+            root[_PREVIOUS] = link
+            self.hits += 1
+            _hits.increment()
+            return link[_MESSAGE]
+        message = self._encode(address, arguments)
+        last = root[_PREVIOUS]
+        link = [last, root, key, message]
+        last[_NEXT] = link
+        root[_PREVIOUS] = link
+        self._links[key] = link
+        if len(self._links) > self.max_size:
+            oldest = root[_NEXT]
+            root[_NEXT] = oldest[_NEXT]
+            oldest[_NEXT][_PREVIOUS] = root
+            del self._links[oldest[_KEY]]
+            _evictions.increment()
+        _size_gauge.set(len(self._links))
+        return message
+
+    def _encode(self, address, arguments):
+        self.misses += 1
+        _misses.increment()
+        return EncodedMessage(address, arguments, osc.Message(address, *arguments).toBinary())
+
+    def get_keys(self):
+        """
+        Returns the keys of the cached messages, the least recently used first.
+        @rtype: C{list}
+        """
+        ret = []
+        link = self._root[_NEXT]
+        while link is not self._root:
+            ret.append(link[_KEY])
+            link = link[_NEXT]
+        return ret
+
+    def clear(self):
+        self._links.clear()
+        self._root[:] = [self._root, self._root, None, None]
+        _size_gauge.set(0)
+
+    def __str__(self):
+        total = self.hits + self.misses
+        ratio = 0.0
+        if total != 0:
+            ratio = self.hits * 100.0 / total
+        return "%d hits, %d misses (%.0f%% hits), %d cached" % (self.hits, self.misses, ratio, len(self._links))
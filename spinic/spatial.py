@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+"""
+Spatial index of the positions of the users in a scene.
+
+The users are stored in the cells of a uniform grid on the horizontal plane. The height of the users is ignored. Moving a user within its cell only updates its position. The queries only look at the cells around the point they are about:
+ * get_nearest: the N users closest to a point
+ * get_in_view: the users within a field of view, up to some distance
+
+The yaw is in degrees, counter-clockwise around the z axis, as in SPIN. A yaw of 0 looks along the y axis.
+
+The positions that are not finite, such as those of a peer that sends NaN, are ignored.
+
+Compare with a linear scan with:
+
+    python -m spinic.spatial
+"""
+import math
+import time
+import heapq
+import random
+
+DEFAULT_CELL_SIZE = 5.0 # meters
+
+def is_finite(value):
+    """
+    Tells if a number is neither infinite nor NaN.
+    @rtype: C{bool}
+    """
+    return not (math.isinf(value) or math.isnan(value))
+
+def get_view_direction(yaw):
+    """
+    Returns the unit vector we look along, on the horizontal plane, for a yaw in degrees.
+    @rtype: C{tuple}
+    """
+    radians = math.radians(yaw)
+    return (-math.sin(radians), math.cos(radians))
+
+class GridIndex(object):
+    """
+    Uniform grid of user IDs.
+    """
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = float(cell_size)
+        self._cells = {} # keys are (column, row) tuples. Values are sets of user IDs.
+        self._entries = {} # keys are user IDs. Values are [x, y, cell] lists.
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, user_id):
+        return user_id in self._entries
+
+    def _get_cell(self, x, y):
+        return (int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size)))
+
+    def update(self, user_id, x, y):
+        """
+        Adds a user, or moves it.
+        If the position is not finite, it is ignored, and the user stays where it was, if anywhere.
+        """
+        if not (is_finite(x) and is_finite(y)):
+            return
+        cell = (int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size)))
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self._entries[user_id] = [x, y, cell]
+        else:
+            entry[0] = x
+            entry[1] = y
+            if entry[2] == cell:
+                return
+            self._discard_from_cell(user_id, entry[2])
+            entry[2] = cell
+        users = self._cells.get(cell)
+        if users is None:
+            self._cells[cell] = set([user_id])
+        else:
+            users.add(user_id)
+
+    def remove(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._discard_from_cell(user_id, entry[2])
+
+    def _discard_from_cell(self, user_id, cell):
+        users = self._cells[cell]
+        users.discard(user_id)
+        if len(users) == 0:
+            del self._cells[cell]
+
+    def clear(self):
+        self._cells.clear()
+        self._entries.clear()
+
+    def get_position(self, user_id):
+        """
+        Returns the (x, y) position of a user, or None.
+        @rtype: C{tuple}
+        """
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        return (entry[0], entry[1])
+
+    def _get_ring(self, center, radius):
+        """
+        Returns the cells at a given Chebyshev distance of a cell.
+        """
+        column, row = center
+        if radius == 0:
+            return [center]
+        cells = []
+        for offset in xrange(-radius, radius + 1):
+            cells.append((column + offset, row - radius))
+            cells.append((column + offset, row + radius))
+        for offset in xrange(-radius + 1, radius):
+            cells.append((column - radius, row + offset))
+            cells.append((column + radius, row + offset))
+        return cells
+
+    def get_nearest(self, x, y, count, exclude=None):
+        """
+        Returns the IDs of the users closest to a point, closest first.
+        We look at the rings of cells around the point, until the next ring cannot hold anyone closer than the ones we found. If that would be more cells than the occupied ones, we look at every user instead.
+        @param exclude: A user ID to skip, such as ours.
+        @rtype: C{list}
+        """
+        if count <= 0 or len(self._entries) == 0:
+            return []
+        center = self._get_cell(x, y)
+        # Distance from the point to the border of its cell, which the first ring starts after:
+        margin = min(x - center[0] * self.cell_size, (center[0] + 1) * self.cell_size - x, y - center[1] * self.cell_size, (center[1] + 1) * self.cell_size - y)
+        total = len(self._entries)
+        if exclude in self._entries:
+            total -= 1
+        found = [] # (squared distance, user ID) tuples
+        radius = 0
+        cells_looked_at = 0
+        while len(found) < total:
+            ring = self._get_ring(center, radius)
+            cells_looked_at += len(ring)
+            if cells_looked_at > len(self._cells):
+                # The users are far apart: the occupied cells are fewer than the ones we would look at.
+                found = [((entry[0] - x) ** 2 + (entry[1] - y) ** 2, user_id) for user_id, entry in self._entries.iteritems() if user_id != exclude]
+                break
+            for cell in ring:
+                users = self._cells.get(cell)
+                if users is not None:
+                    for user_id in users:
+                        if user_id != exclude:
+                            entry = self._entries[user_id]
+                            found.append(((entry[0] - x) ** 2 + (entry[1] - y) ** 2, user_id))
+            if len(found) >= count:
+                # Anyone in the next rings is at least that far:
+                reach = margin + radius * self.cell_size
+                nearest = heapq.nsmallest(count, found)
+                if nearest[-1][0] <= reach * reach:
+                    return [user_id for distance, user_id in nearest]
+            radius += 1
+        return [user_id for distance, user_id in heapq.nsmallest(count, found)]
+
+    def get_in_view(self, x, y, yaw, field_of_view, max_distance, exclude=None):
+        """
+        Returns the IDs of the users within a field of view, closest first.
+        Only the cells within max_distance of the point are looked at. The users right at the point are in view, whatever the direction.
+        @param yaw: Direction we look at, in degrees.
+        @param field_of_view: Horizontal angle we see, in degrees.
+        @param max_distance: How far we see.
+        @param exclude: A user ID to skip, such as ours.
+        @rtype: C{list}
+        """
+        direction_x, direction_y = get_view_direction(yaw)
+        min_cosine = math.cos(math.radians(field_of_view / 2.0))
+        max_squared_distance = max_distance * max_distance
+        first_column, first_row = self._get_cell(x - max_distance, y - max_distance)
+        last_column, last_row = self._get_cell(x + max_distance, y + max_distance)
+        found = []
+        if (last_column - first_column + 1) * (last_row - first_row + 1) > len(self._cells):
+            # The occupied cells are fewer than the ones we would look at:
+            cells = [cell for cell in self._cells.iterkeys() if first_column <= cell[0] <= last_column and first_row <= cell[1] <= last_row]
+        else:
+            cells = [(column, row) for column in xrange(first_column, last_column + 1) for row in xrange(first_row, last_row + 1)]
+        for cell in cells:
+            users = self._cells.get(cell)
+            if users is None:
+                continue
+            for user_id in users:
+                if user_id == exclude:
+                    continue
+                entry = self._entries[user_id]
+                delta_x = entry[0] - x
+                delta_y = entry[1] - y
+                squared_distance = delta_x * delta_x + delta_y * delta_y
+                if squared_distance > max_squared_distance:
+                    continue
+                if (delta_x * direction_x + delta_y * direction_y) >= min_cosine * math.sqrt(squared_distance):
+                    found.append((squared_distance, user_id))
+        found.sort()
+        return [user_id for distance, user_id in found]
+
+def _scan_nearest(positions, x, y, count):
+    return [user_id for distance, user_id in heapq.nsmallest(count, [((px - x) ** 2 + (py - y) ** 2, user_id) for user_id, (px, py) in positions.iteritems()])]
+
+def _scan_in_view(positions, x, y, yaw, field_of_view, max_distance):
+    direction_x, direction_y = get_view_direction(yaw)
+    min_cosine = math.cos(math.radians(field_of_view / 2.0))
+    found = []
+    for user_id, (px, py) in positions.iteritems():
+        distance = math.sqrt((px - x) ** 2 + (py - y) ** 2)
+        if distance <= max_distance and (px - x) * direction_x + (py - y) * direction_y >= min_cosine * distance:
+            found.append((distance, user_id))
+    found.sort()
+    return [user_id for distance, user_id in found]
+
+def benchmark(sizes=(100, 1000, 10000), queries=200, density=0.02):
+    """
+    Compares the grid with a linear scan, for users spread uniformly at a given density, in users per square meter.
+    @rtype: C{str}
+    """
+    lines = []
+    lines.append("%8s %12s %12s %12s %12s" % ("users", "nearest 8", "scan", "in view", "scan"))
+    rand = random.Random(0)
+    for size in sizes:
+        side = math.sqrt(size / density)
+        positions = dict([("user%d" % (i), (rand.uniform(0, side), rand.uniform(0, side))) for i in xrange(size)])
+        index = GridIndex()
+        for user_id, (x, y) in positions.iteritems():
+            index.update(user_id, x, y)
+        points = [(rand.uniform(0, side), rand.uniform(0, side), rand.uniform(0, 360)) for i in xrange(queries)]
+        durations = []
+        for function in (
+                lambda x, y, yaw: index.get_nearest(x, y, 8),
+                lambda x, y, yaw: _scan_nearest(positions, x, y, 8),
+                lambda x, y, yaw: index.get_in_view(x, y, yaw, 90.0, 30.0),
+                lambda x, y, yaw: _scan_in_view(positions, x, y, yaw, 90.0, 30.0)):
+            start = time.time()
+            for x, y, yaw in points:
+                function(x, y, yaw)
+            durations.append((time.time() - start) * 1000000.0 / queries)
+        lines.append("%8d %9.1f us %9.1f us %9.1f us %9.1f us" % tuple([size] + durations))
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    print(benchmark())
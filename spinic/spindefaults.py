@@ -1,65 +1,169 @@
 #!/usr/bin/env python
 """
 Tools to parse the SPIN framework config file.
+
+The parsed defaults are cached in a small JSON file, keyed by the path of the header and its modification time, so that we do not need to scan the header at each startup.
+
+This module does not start the lunch logging, so that it can be imported before lunch master's logging has been set up. Its errors are printed to stderr.
 """
 import os
-from lunch import logger
+import re
+import json
+import logging
 
 if __name__ == "__main__":
+    from lunch import logger
     log = logger.start(name="spindefaults", to_stdout=True, level="debug")
 else:
-    class DummyLogger(object):
-        def debug(self, s):
-            pass
-            # print("Debug:" + str(s))
-        def info(self, s):
-            pass
-            # print("info:" + str(s))
-        def error(self, s):
-            print("Error:" + str(s))
-    log = DummyLogger() # FIXME: that's bad! The logging does not work in this module, since we need to start it before starting the main logging in lunch. This should be fixed.
-
-def read_spin_defaults():
+    log = logging.getLogger("spindefaults") # lunch never adds handlers to it
+    _handler = logging.StreamHandler() # stderr
+    _handler.setLevel(logging.ERROR)
+    _handler.setFormatter(logging.Formatter("%(name)s %(levelname)s %(message)s"))
+    log.addHandler(_handler)
+
+HEADER_FILE_NAME = "spinFramework/spinDefaults.h"
+HEADER_PREFIXES = ["/usr/local", "/usr"]
+DEFAULT_CACHE_FILE = "~/.cache/spinic/spindefaults.json"
+
+# Matches lines like: #define INFO_UDP_PORT "54320"
+_DEFINE_REGEX = re.compile(r'^\s*#\s*define\s+(\w+)\s+"([^"]*)"', re.MULTILINE)
+# Those that match this are ports, and are casted to int:
+_PORT_REGEX = re.compile(r'_PORT$')
+
+_defaults = None # in-memory result of read_spin_defaults
+_has_read_defaults = False
+
+def find_spin_defaults_header():
     """
-    Returns a dict of defaults parameters for spinframework.
-    (ports number and multicast group)
+    Returns the full path to the spinDefaults.h header, or None if not found.
+    @rtype: C{str}
     """
-    file_name = "spinFramework/spinDefaults.h"
-    prefixes = ["/usr/local", "/usr"]
-    is_found = False
-    for prefix in prefixes:
-        full_path = os.path.join(prefix, "include", file_name)
+    for prefix in HEADER_PREFIXES:
+        full_path = os.path.join(prefix, "include", HEADER_FILE_NAME)
         log.debug("Trying to find %s" % (full_path))
         if os.path.exists(full_path):
             log.info("Found %s" % (full_path))
-            is_found = True
-            break
-    if not is_found:
-        log.error("Could not find the %s header." % (file_name))
+            return full_path
+    return None
+
+def parse_spin_defaults(text):
+    """
+    Parses the contents of the spinDefaults.h header.
+
+    Returns a dict whose keys are the names of the macros that are defined as a string literal.
+    The values of those that end with _PORT are casted to int.
+
+    @param text: Contents of the header.
+    @type text: C{str}
+    @rtype: C{dict}
+    """
+    ret = {
+        "MULTICAST_GROUP": "",
+        "INFO_UDP_PORT": 0
+        }
+    for name, word in _DEFINE_REGEX.findall(text):
+        if _PORT_REGEX.search(name) is not None:
+            try:
+                ret[name] = int(word)
+            except ValueError, e:
+                log.error("Could not parse %s: %s" % (name, e))
+                continue
+        else:
+            ret[name] = str(word)
+        log.debug("Parsed %s %s" % (name, word))
+    return ret
+
+def _read_cache(cache_file, full_path, mtime):
+    """
+    Returns the cached defaults if they are for the given header path and modification time, or None.
+    """
+    file_name = os.path.expanduser(cache_file)
+    if not os.path.isfile(file_name):
         return None
-    else:
+    try:
+        f = open(file_name, "r")
+        try:
+            data = json.loads(f.read())
+        finally:
+            f.close()
+    except (IOError, ValueError), e:
+        log.error("Could not read the SPIN defaults cache %s: %s" % (file_name, e))
+        return None
+    if type(data) != dict or data.get("path") != full_path or data.get("mtime") != mtime:
+        log.debug("SPIN defaults cache %s is outdated." % (file_name))
+        return None
+    ret = {}
+    for key, value in data.get("defaults", {}).iteritems():
+        if type(value) == unicode:
+            value = str(value)
+        ret[str(key)] = value
+    return ret
+
+def _write_cache(cache_file, full_path, mtime, defaults):
+    """
+    Writes the parsed defaults to the cache file.
+    """
+    file_name = os.path.expanduser(cache_file)
+    data = {
+        "path": full_path,
+        "mtime": mtime,
+        "defaults": defaults,
+        }
+    try:
+        directory = os.path.dirname(file_name)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        f = open(file_name, "w")
+        f.write(json.dumps(data))
+        f.close()
+    except (IOError, OSError), e:
+        log.error("Could not write the SPIN defaults cache %s: %s" % (file_name, e))
+
+def read_spin_defaults(cache_file=DEFAULT_CACHE_FILE):
+    """
+    Returns a dict of defaults parameters for spinframework.
+    (ports number and multicast group)
+
+    The result is cached in memory and in the cache file.
+    Returns None if the header could not be found.
+
+    @param cache_file: Path to the cache file, or None to disable it.
+    @rtype: C{dict}
+    """
+    global _defaults
+    global _has_read_defaults
+    if _has_read_defaults:
+        return _defaults
+    full_path = find_spin_defaults_header()
+    if full_path is None:
+        log.error("Could not find the %s header." % (HEADER_FILE_NAME))
+        return None
+    try:
+        mtime = os.stat(full_path).st_mtime
+    except OSError, e:
+        log.error(str(e))
+        return None
+    ret = None
+    if cache_file is not None:
+        ret = _read_cache(cache_file, full_path, mtime)
+        if ret is not None:
+            log.debug("Using the cached SPIN defaults for %s" % (full_path))
+    if ret is None:
         try:
             f = open(full_path, "r")
-        except os.OSError, e:
+        except IOError, e:
             log.error(str(e))
             return None
         else:
-            ret = {
-                "MULTICAST_GROUP": "",
-                "INFO_UDP_PORT": 0
-                }
-            for line in f.readlines():
-                if "INFO_UDP_PORT" in line:
-                    word = line.split("\"")[1]
-                    log.debug("Parsed INFO_UDP_PORT %s" % (word))
-                    ret["INFO_UDP_PORT"] = int(word)
-                elif "MULTICAST_GROUP" in line:
-                    word = line.split("\"")[1]
-                    log.debug("Parsed MULTICAST_GROUP %s" % (word))
-                    ret["MULTICAST_GROUP"] = str(word)
+            text = f.read()
             f.close()
-            return ret
-        
+            ret = parse_spin_defaults(text)
+            if cache_file is not None:
+                _write_cache(cache_file, full_path, mtime, ret)
+    _defaults = ret
+    _has_read_defaults = True
+    return ret
+
 if __name__ == "__main__":
     defaults = read_spin_defaults()
     log.debug("Results: " + str(defaults))
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Sends the OSC messages that change the state of a SPIN scene over TCP.
+
+Multicast UDP loses datagrams. Messages such as createNode, setParam and createStateSet must not be lost, so we send them to the TCP receiving port of the SPIN server instead.
+The connection is kept open and messages are written as soon as they are sent, without waiting for each other. TCP preserves their order.
+
+While the first connection attempt is in progress, the messages are queued. If we cannot connect, or if the connection is lost, the messages are given to a fallback callable (which sends them with UDP) until we are connected again.
+"""
+import struct
+from collections import deque
+from twisted.internet import reactor
+from twisted.internet import protocol
+from lunch import logger
+
+log = logger.start(name="tcpsender")
+
+MAX_QUEUE_LENGTH = 1000 # messages
+
+class _SenderProtocol(protocol.Protocol):
+    """
+    OSC over TCP, as in OSC 1.0: each packet is prefixed by its size as an int32.
+    """
+    def connectionMade(self):
+        self.factory.on_connected(self)
+
+    def dataReceived(self, data):
+        pass # we do not expect anything from the server
+
+    def send_data(self, data):
+        self.transport.write(struct.pack(">i", len(data)) + data)
+
+class TcpSender(protocol.ReconnectingClientFactory):
+    """
+    Persistent TCP connection to a SPIN server.
+    """
+    protocol = _SenderProtocol
+    maxDelay = 10 # seconds between reconnection attempts
+
+    def __init__(self, host, port, fallback=None):
+        """
+        @param fallback: Callable that takes an OSC element, called for the elements we cannot send over TCP.
+        """
+        self.host = host
+        self.port = port
+        self.fallback = fallback
+        self.messages_sent = 0
+        self.messages_sent_with_fallback = 0
+        self._protocol = None
+        self._has_failed = False # once true, we stop queuing and use the fallback while disconnected
+        self._queue = deque()
+        self._connector = None
+
+    def start(self):
+        log.info("Connecting to osc.tcp://%s:%d" % (self.host, self.port))
+        self._connector = reactor.connectTCP(self.host, self.port, self)
+
+    def stop(self):
+        """
+        Closes the connection. The messages that are still queued are for a scene we are leaving, so we drop them.
+        """
+        self.stopTrying()
+        self.fallback = None
+        self._queue.clear()
+        if self._connector is not None:
+            self._connector.disconnect()
+
+    def is_connected(self):
+        return self._protocol is not None
+
+    def send(self, element):
+        """
+        @param element: L{txosc.osc.Message}, L{txosc.osc.Bundle} or L{spinic.sendcache.EncodedMessage}
+        """
+        if self._protocol is not None:
+            self._protocol.send_data(element.toBinary())
+            self.messages_sent += 1
+        elif not self._has_failed and len(self._queue) < MAX_QUEUE_LENGTH:
+            self._queue.append(element)
+        else:
+            self._send_with_fallback(element)
+
+    def on_connected(self, connected_protocol):
+        log.info("Connected to osc.tcp://%s:%d" % (self.host, self.port))
+        self.resetDelay()
+        self._protocol = connected_protocol
+        self._has_failed = False
+        while len(self._queue) != 0:
+            self.send(self._queue.popleft())
+
+    def clientConnectionLost(self, connector, reason):
+        log.warning("Lost the connection to osc.tcp://%s:%d: %s" % (self.host, self.port, reason.getErrorMessage()))
+        self._on_disconnected()
+        protocol.ReconnectingClientFactory.clientConnectionLost(self, connector, reason)
+
+    def clientConnectionFailed(self, connector, reason):
+        log.warning("Could not connect to osc.tcp://%s:%d: %s" % (self.host, self.port, reason.getErrorMessage()))
+        self._on_disconnected()
+        protocol.ReconnectingClientFactory.clientConnectionFailed(self, connector, reason)
+
+    def _on_disconnected(self):
+        self._protocol = None
+        self._has_failed = True
+        self._flush_queue_to_fallback()
+
+    def _flush_queue_to_fallback(self):
+        while len(self._queue) != 0:
+            self._send_with_fallback(self._queue.popleft())
+
+    def _send_with_fallback(self, element):
+        if self.fallback is not None:
+            self.fallback(element)
+            self.messages_sent_with_fallback += 1
+        else:
+            log.error("Dropping %s since we are not connected to osc.tcp://%s:%d" % (element, self.host, self.port))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+Tests for the decoding of the global6DOF messages without txosc.
+"""
+from twisted.trial import unittest
+from txosc import osc
+from spinic import fastosc
+from spinic import runner
+from spinic import replay
+from spinic import udpstats
+from spinic import osc as spinic_osc
+
+POSE = (1.0, -2.5, 0.5, 0.125, -45.0, 90.0)
+
+class _FakeReplayer(object):
+    def get_replay_time(self):
+        return 0.0
+
+class _FakeReceiver(object):
+    """
+    Records what the txosc receiver would dispatch.
+    """
+    def __init__(self):
+        self.elements = []
+
+    def dispatch(self, element, client):
+        self.elements.append(element)
+
+class TestDecode(unittest.TestCase):
+    def test_round_trip(self):
+        # Addresses of every length modulo 4, since their padding differs.
+        for address in ["/SPIN/default/kiosk1", "/SPIN/default/kiosk12", "/SPIN/default/kiosk123", "/SPIN/default/kiosk1234", "/SPIN/a/b"]:
+            data = osc.Message(address, "global6DOF", *POSE).toBinary()
+            expected = osc._elementFromBinary(data).getValues()[1:]
+            self.assertEqual(fastosc.decode_global6dof(data), (address, tuple(expected)), address)
+
+    def test_bundle(self):
+        bundle = osc.Bundle([osc.Message("/SPIN/default/kiosk1", "global6DOF", *POSE)])
+        self.assertEqual(fastosc.decode_global6dof(bundle.toBinary()), None)
+
+    def test_seven_floats(self):
+        data = osc.Message("/SPIN/default/kiosk1", "global6DOF", *(POSE + (1.0,))).toBinary()
+        self.assertEqual(fastosc.decode_global6dof(data), None)
+
+    def test_five_floats(self):
+        data = osc.Message("/SPIN/default/kiosk1", "global6DOF", *POSE[:5]).toBinary()
+        self.assertEqual(fastosc.decode_global6dof(data), None)
+
+    def test_other_methods(self):
+        for method in ["setTranslation", "global6dof", "global6DOFs", "global6DO"]:
+            data = osc.Message("/SPIN/default/kiosk1", method, *POSE).toBinary()
+            self.assertEqual(fastosc.decode_global6dof(data), None, method)
+
+    def test_other_types(self):
+        data = osc.Message("/SPIN/default/kiosk1", "global6DOF", 1.0, -2.5, 0.5, 0.125, -45.0, 90).toBinary() # ends with an int
+        self.assertEqual(fastosc.decode_global6dof(data), None)
+
+    def test_truncated(self):
+        data = osc.Message("/SPIN/default/kiosk1", "global6DOF", *POSE).toBinary()
+        self.assertEqual(fastosc.decode_global6dof(data[4:]), None)
+        self.assertEqual(fastosc.decode_global6dof(data[:-4]), None)
+        self.assertEqual(fastosc.decode_global6dof(""), None)
+
+class TestFallback(unittest.TestCase):
+    """
+    The global6DOF messages that the pose handler does not handle are given to the txosc receiver.
+    """
+    def setUp(self):
+        config = runner.Configuration()
+        config.headless = True
+        config.enable_tcp_sender = False
+        config.enable_receiver_thread = False
+        config.user_id = "kiosk1"
+        self.app = replay.ReplayApplication(config, _FakeReplayer())
+        self.osc_interface = self.app.osc_interface
+        self.osc_interface.current_server_id = "default"
+        self.receiver = _FakeReceiver()
+        self.protocol = spinic_osc.CountingMulticastDatagramServerProtocol(self.receiver, "224.0.0.1", udpstats.ChannelStats("scene"), pose_handler=self.osc_interface.handle_global6dof)
+
+    def test_handled(self):
+        self.protocol.datagramReceived(osc.Message("/SPIN/default/kiosk2", "global6DOF", *POSE).toBinary(), ("127.0.0.1", 54324))
+        self.assertEqual(self.receiver.elements, [])
+
+    def test_not_handled(self):
+        for address in ["/SPIN/default", "/SPIN/default/kiosk2/extra", "/other/default/kiosk2"]:
+            self.assertFalse(self.osc_interface.handle_global6dof(address, POSE, ("127.0.0.1", 54324)))
+            self.protocol.datagramReceived(osc.Message(address, "global6DOF", *POSE).toBinary(), ("127.0.0.1", 54324))
+        self.assertEqual([element.address for element in self.receiver.elements], ["/SPIN/default", "/SPIN/default/kiosk2/extra", "/other/default/kiosk2"])
+        self.assertEqual(self.receiver.elements[0].getValues(), ["global6DOF"] + list(POSE))
+
+    def test_not_decoded(self):
+        self.protocol.datagramReceived(osc.Message("/SPIN/default/kiosk2", "setParam", "width", "640").toBinary(), ("127.0.0.1", 54324))
+        self.assertEqual([element.address for element in self.receiver.elements], ["/SPIN/default/kiosk2"])
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+Tests for the tracing of the joins with the peers.
+"""
+import os
+import tempfile
+from twisted.internet import task
+from twisted.trial import unittest
+from spinic import jointrace
+
+class TestFirstFrame(unittest.TestCase):
+    def setUp(self):
+        self.now = 100.0
+        self.patch(jointrace.time, "time", lambda: self.now)
+        self.directory = tempfile.mkdtemp()
+        self.patch(jointrace, "SHARED_MEMORY_DIRECTORY", self.directory)
+        self.tracer = jointrace.JoinTracer()
+        self.tracer._looping_poll.clock = task.Clock()
+        self.tracer.on_peer_seen("kiosk2")
+        self.tracer.on_streamers_launched("kiosk2", ["kiosk2_video"], ["kiosk2_shm"])
+        self.tracer.on_command_running("kiosk2_video")
+
+    def tearDown(self):
+        if self.tracer._looping_poll.running:
+            self.tracer._looping_poll.stop()
+        for file_name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, file_name))
+        os.rmdir(self.directory)
+
+    def test_first_frame(self):
+        self.now = 101.5
+        open(os.path.join(self.directory, "kiosk2_shm"), "w").close()
+        self.tracer._poll_first_frames()
+        peer = self.tracer.peers["kiosk2"]
+        self.assertEqual(peer.frame_time, 101.5)
+        self.assertFalse(peer.timed_out)
+        self.assertEqual(list(self.tracer.durations["first_frame"]), [1.5])
+        self.assertFalse(self.tracer._looping_poll.running)
+
+    def test_first_frame_timeout(self):
+        self.now = 100.0 + jointrace.FIRST_FRAME_TIMEOUT - 1.0
+        self.tracer._poll_first_frames()
+        self.assertTrue(self.tracer._looping_poll.running)
+        self.now = 100.0 + jointrace.FIRST_FRAME_TIMEOUT
+        self.tracer._poll_first_frames()
+        peer = self.tracer.peers["kiosk2"]
+        self.assertTrue(peer.timed_out)
+        self.assertEqual(peer.frame_time, None)
+        self.assertEqual(len(self.tracer.durations["first_frame"]), 0)
+        self.assertEqual(len(self.tracer.durations["join"]), 0)
+        self.assertFalse(self.tracer._looping_poll.running)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Tests for the timer wheel that forgets the servers and users we have not heard of for a while.
+"""
+from twisted.trial import unittest
+from spinic import liveness
+
+class TestTimerWheel(unittest.TestCase):
+    def setUp(self):
+        self.wheel = liveness.TimerWheel(10.0, resolution=1.0)
+        self.last_seen = {} # key: time
+
+    def _sweep(self, now):
+        return sorted(self.wheel.sweep(now, self.last_seen.get))
+
+    def _add(self, key, last_seen):
+        self.last_seen[key] = last_seen
+        self.wheel.add(key, last_seen)
+
+    def test_expire(self):
+        self._add("alice", 100.0)
+        self._add("bob", 105.0)
+        self.assertEqual(self._sweep(100.0), [])
+        self.assertEqual(self._sweep(109.5), [])
+        self.assertEqual(self._sweep(111.0), ["alice"])
+        self.assertEqual(self._sweep(116.0), ["bob"])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_refreshed_last_seen(self):
+        self._add("alice", 100.0)
+        self._sweep(100.0)
+        self.last_seen["alice"] = 108.0 # seen again. The wheel is not told.
+        self.assertEqual(self._sweep(111.0), [])
+        self.assertEqual(len(self.wheel), 1)
+        self.assertEqual(self._sweep(117.0), [])
+        self.assertEqual(self._sweep(119.0), ["alice"])
+
+    def test_add_twice(self):
+        self._add("alice", 100.0)
+        self._add("alice", 100.0)
+        self.assertEqual(len(self.wheel), 1)
+        self.assertEqual(self._sweep(111.0), ["alice"])
+
+    def test_discard(self):
+        self._add("alice", 100.0)
+        self._add("bob", 100.0)
+        self._sweep(100.0)
+        self.wheel.discard("alice")
+        self.wheel.discard("carol") # not tracked
+        self.assertEqual(len(self.wheel), 1)
+        self.assertEqual(self._sweep(111.0), ["bob"])
+
+    def test_discard_and_add_again(self):
+        self._add("alice", 100.0)
+        self._sweep(100.0)
+        self.wheel.discard("alice")
+        self._add("alice", 105.0)
+        self.assertEqual(self._sweep(111.0), [])
+        self.assertEqual(self._sweep(116.0), ["alice"])
+        self.assertEqual(self._sweep(130.0), [])
+
+    def test_not_tracked_anymore(self):
+        self._add("alice", 100.0)
+        del self.last_seen["alice"] # get_last_seen returns None
+        self.assertEqual(self._sweep(111.0), [])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_sweep_after_a_long_time(self):
+        # More than a full turn of the wheel between two sweeps.
+        self._add("alice", 100.0)
+        self._add("bob", 103.0)
+        self._sweep(100.0)
+        self.assertEqual(self._sweep(200.0), ["alice", "bob"])
+
+    def test_add_in_the_past(self):
+        # Its slot has already been swept, so it goes in the next one.
+        self._sweep(200.0)
+        self._add("alice", 100.0)
+        self.assertEqual(self._sweep(201.0), ["alice"])
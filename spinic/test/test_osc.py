@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+Tests for the publication of the params of our UserNode, its ping, the culling of the peers, and the drops of the receiver thread.
+
+Run them with:
+
+    trial spinic.test
+"""
+from twisted.trial import unittest
+from txosc import osc
+from spinic import runner
+from spinic import replay
+from spinic import userparams
+
+class _FakeReplayer(object):
+    def get_replay_time(self):
+        return 0.0
+
+class TestPublishParams(unittest.TestCase):
+    def setUp(self):
+        config = runner.Configuration()
+        config.headless = True
+        config.enable_tcp_sender = False
+        config.enable_receiver_thread = False
+        config.user_id = "kiosk1"
+        self.app = replay.ReplayApplication(config, _FakeReplayer())
+        self.osc_interface = self.app.osc_interface
+        self.osc_interface.current_server_id = "default"
+        self.sent_params = [] # list of lists of keys, one per bundle
+        def _send_element(element, reliable=False):
+            if isinstance(element, osc.Bundle):
+                self.sent_params.append([message.arguments[1].value for message in element.elements])
+        self.osc_interface.send_element = _send_element
+
+    def test_publish_once(self):
+        self.osc_interface.on_connected_to_spin_server()
+        self.assertEqual(len(self.sent_params), 1)
+        self.assertIn(userparams.MANIFEST_KEY, self.sent_params[0])
+        self.assertIn("videocodec", self.sent_params[0])
+        self.osc_interface._set_params_for_my_user_node()
+        self.assertEqual(len(self.sent_params), 1)
+
+    def test_publish_all_after_reconnect(self):
+        self.osc_interface.on_connected_to_spin_server()
+        self.osc_interface.on_connected_to_spin_server()
+        self.assertEqual(len(self.sent_params), 2)
+        self.assertEqual(sorted(self.sent_params[1]), sorted(self.sent_params[0]))
+
+    def test_publish_all_after_our_node_is_deleted(self):
+        self.osc_interface.on_connected_to_spin_server()
+        self.osc_interface._scene_receiver_protocol = replay._NullListeningPort() # connected
+        self.osc_interface._handle_delete_node("kiosk1")
+        self.osc_interface._handle_delete_node("kiosk1") # only one republication is scheduled
+        republish_call = self.osc_interface._republish_call
+        self.assertTrue(republish_call.active())
+        self.assertEqual(republish_call.args, ("default",))
+        republish_call.cancel()
+        self.osc_interface._republish_params("default")
+        self.assertEqual(len(self.sent_params), 2)
+        self.assertEqual(sorted(self.sent_params[1]), sorted(self.sent_params[0]))
+
+    def test_no_republish_after_we_left(self):
+        self.osc_interface.on_connected_to_spin_server()
+        self.osc_interface._handle_delete_node("kiosk1")
+        republish_call = self.osc_interface._republish_call
+        republish_call.cancel()
+        self.osc_interface._republish_params("default") # not connected
+        self.assertEqual(len(self.sent_params), 1)
+
+class TestPing(unittest.TestCase):
+    def setUp(self):
+        from spinic import loadshedding
+        config = runner.Configuration()
+        config.headless = True
+        config.enable_tcp_sender = False
+        config.enable_receiver_thread = False
+        config.user_id = "kiosk1"
+        self.app = replay.ReplayApplication(config, _FakeReplayer())
+        self.osc_interface = self.app.osc_interface
+        self.osc_interface.current_server_id = "default"
+        self.app.load_shedder.tier = loadshedding.TIER_DEFER_SENDS
+        self.sent = [] # addresses
+        self.osc_interface.send_element = lambda element, reliable=False: self.sent.append(element.address)
+
+    def test_ping_is_never_deferred(self):
+        self.osc_interface._keep_user_alive()
+        self.assertEqual(self.sent, ["/SPIN/default/kiosk1"])
+
+    def test_refresh_is_deferred(self):
+        self.osc_interface._scene_receiver_protocol = replay._NullListeningPort() # connected
+        self.osc_interface._auto_refresh()
+        self.assertEqual(self.sent, [])
+        self.assertEqual(self.app.load_shedder._deferred.keys(), ["refresh"])
+
+class TestCulling(unittest.TestCase):
+    def setUp(self):
+        from spinic import culling
+        from spinic import osc as spinic_osc
+        self.patch(culling, "PAUSE_DELAY", 0.0)
+        config = runner.Configuration()
+        config.headless = True
+        config.enable_tcp_sender = False
+        config.enable_receiver_thread = False
+        config.user_id = "kiosk1"
+        self.app = replay.ReplayApplication(config, _FakeReplayer())
+        self.osc_interface = self.app.osc_interface
+        self.osc_interface.current_server_id = "default"
+        self.osc_interface._set_params_for_my_user_node = lambda: None
+        self.scene = self.osc_interface.get_current_scene()
+        for user_id in ["kiosk1", "kiosk2"]:
+            self.scene.user_nodes[user_id] = spinic_osc.UserNodeInfo(user_id)
+        self.scene.user_nodes["kiosk2"].streaming_is_on = True
+        self.scene.spatial_index.update("kiosk1", 0.0, 0.0) # looking along the y axis
+
+    def test_pause_behind(self):
+        self.scene.spatial_index.update("kiosk2", 0.0, -10.0)
+        self.osc_interface._cull_peers()
+        self.assertEqual(self.osc_interface.culler.paused, set(["kiosk2"]))
+        self.scene.spatial_index.update("kiosk2", 0.0, 10.0)
+        self.osc_interface._cull_peers()
+        self.assertEqual(self.osc_interface.culler.paused, set())
+
+    def test_unknown_position_is_in_view(self):
+        self.osc_interface._cull_peers()
+        self.assertEqual(self.osc_interface.culler.paused, set())
+
+    def test_same_position_is_in_view(self):
+        self.scene.spatial_index.update("kiosk2", 0.0, 0.0)
+        self.osc_interface._cull_peers()
+        self.assertEqual(self.osc_interface.culler.paused, set())
+        self.assertEqual(self.osc_interface.get_users_in_view(90.0, 50.0), ["kiosk2"])
+
+    def test_pose_not_finite(self):
+        user_info = self.scene.user_nodes["kiosk2"]
+        self.osc_interface._store_user_pose("kiosk2", user_info, (0.0, 10.0, 0.0, 0.0, 0.0, 0.0))
+        self.osc_interface._store_user_pose("kiosk2", user_info, (float("nan"), 10.0, 0.0, 0.0, 0.0, 0.0))
+        self.osc_interface._store_user_pose("kiosk2", user_info, (0.0, 10.0, 0.0, 0.0, 0.0, float("inf")))
+        self.assertEqual(self.scene.spatial_index.get_position("kiosk2"), (0.0, 10.0))
+        self.assertEqual(list(user_info.position[:2]), [0.0, 10.0])
+        self.assertEqual(user_info.orientation[2], 0.0)
+
+class TestReceiverThreadDrops(unittest.TestCase):
+    def setUp(self):
+        from spinic import oscthread
+        config = runner.Configuration()
+        config.headless = True
+        config.enable_tcp_sender = False
+        config.enable_receiver_thread = False
+        self.app = replay.ReplayApplication(config, _FakeReplayer())
+        self.osc_interface = self.app.osc_interface
+        self.osc_interface.receiver_thread = oscthread.ReceiverThread() # not started
+        self.refreshes = []
+        self.osc_interface._auto_refresh = lambda: self.refreshes.append(True)
+
+    def test_poses_dropped_do_not_refresh(self):
+        self.osc_interface.receiver_thread.poses_dropped = 100
+        self.osc_interface._update_network_stats()
+        self.assertEqual(self.refreshes, [])
+
+    def test_elements_dropped_refresh(self):
+        self.osc_interface.receiver_thread.poses_dropped = 100
+        self.osc_interface.receiver_thread.elements_dropped = 1
+        self.osc_interface._update_network_stats()
+        self.assertEqual(len(self.refreshes), 1)
+        self.osc_interface._update_network_stats()
+        self.assertEqual(len(self.refreshes), 1)
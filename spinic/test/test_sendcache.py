@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""
+Tests for the cache of the OSC messages we send often.
+"""
+from twisted.trial import unittest
+from txosc import osc
+from spinic import sendcache
+
+class _UnhashableArgument(osc.StringArgument):
+    """
+    txosc takes L{txosc.osc.Argument} instances as arguments, whose subclasses might not be hashable.
+    """
+    __hash__ = None
+
+class TestEncodedMessageCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = sendcache.EncodedMessageCache(max_size=3)
+
+    def _get_addresses(self):
+        return [key[0] for key in self.cache.get_keys()]
+
+    def test_same_as_txosc(self):
+        for arguments in [("ping",), ("setParam", "width", 640), ("global6DOF", 1.0, -2.5, 0.5, 0.0, 0.0, 90.0), ()]:
+            message = self.cache.get_message("/SPIN/default/kiosk1", arguments)
+            self.assertEqual(message.toBinary(), osc.Message("/SPIN/default/kiosk1", *arguments).toBinary())
+
+    def test_hit(self):
+        message = self.cache.get_message("/SPIN/default/kiosk1", ("ping",))
+        self.assertIdentical(self.cache.get_message("/SPIN/default/kiosk1", ("ping",)), message)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_eviction_order(self):
+        for address in ["/a", "/b", "/c"]:
+            self.cache.get_message(address, ("ping",))
+        self.cache.get_message("/a", ("ping",)) # now the most recently used
+        self.assertEqual(self._get_addresses(), ["/b", "/c", "/a"])
+        self.cache.get_message("/d", ("ping",))
+        self.assertEqual(self._get_addresses(), ["/c", "/a", "/d"])
+        self.cache.get_message("/c", ("ping",))
+        self.cache.get_message("/e", ("ping",))
+        self.assertEqual(self._get_addresses(), ["/d", "/c", "/e"])
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 5))
+
+    def test_int_and_float(self):
+        # 1 == 1.0, but they are encoded with different type tags.
+        as_int = self.cache.get_message("/SPIN/default/kiosk1", ("setAlpha", 1))
+        as_float = self.cache.get_message("/SPIN/default/kiosk1", ("setAlpha", 1.0))
+        self.assertNotEqual(as_int.toBinary(), as_float.toBinary())
+        self.assertEqual(as_int.toBinary(), osc.Message("/SPIN/default/kiosk1", "setAlpha", 1).toBinary())
+        self.assertEqual(as_float.toBinary(), osc.Message("/SPIN/default/kiosk1", "setAlpha", 1.0).toBinary())
+        self.assertEqual(len(self.cache.get_keys()), 2)
+
+    def test_unhashable_arguments(self):
+        argument = _UnhashableArgument("width")
+        self.assertRaises(TypeError, hash, argument)
+        message = self.cache.get_message("/SPIN/default/kiosk1", ("setParam", argument))
+        self.assertEqual(message.toBinary(), osc.Message("/SPIN/default/kiosk1", "setParam", "width").toBinary())
+        self.cache.get_message("/SPIN/default/kiosk1", ("setParam", argument))
+        self.assertEqual(self.cache.get_keys(), [])
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+
+    def test_clear(self):
+        for address in ["/a", "/b"]:
+            self.cache.get_message(address, ("ping",))
+        self.cache.clear()
+        self.assertEqual(self.cache.get_keys(), [])
+        self.cache.get_message("/c", ("ping",))
+        self.assertEqual(self._get_addresses(), ["/c"])
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Tests for the spatial index of the positions of the users, against a linear scan.
+"""
+import random
+from twisted.trial import unittest
+from spinic import spatial
+
+INFINITY = float("inf")
+NAN = float("nan")
+
+class TestGridIndex(unittest.TestCase):
+    def setUp(self):
+        self.rand = random.Random(1234)
+        self.index = spatial.GridIndex()
+        self.positions = {} # user ID: (x, y)
+
+    def _update(self, user_id, x, y):
+        self.index.update(user_id, x, y)
+        self.positions[user_id] = (x, y)
+
+    def _remove(self, user_id):
+        self.index.remove(user_id)
+        del self.positions[user_id]
+
+    def _add_users(self, count, side):
+        for i in xrange(count):
+            self._update("user%d" % (i), self.rand.uniform(-side, side), self.rand.uniform(-side, side))
+
+    def _compare(self, side, queries=200):
+        """
+        Compares the queries of the grid with the linear scans, around random points.
+        """
+        user_ids = sorted(self.positions.keys())
+        for i in xrange(queries):
+            x = self.rand.uniform(-side, side)
+            y = self.rand.uniform(-side, side)
+            exclude = None
+            positions = self.positions
+            if i % 2 == 1:
+                exclude = self.rand.choice(user_ids)
+                positions = dict(self.positions)
+                del positions[exclude]
+            count = self.rand.randint(1, 10)
+            self.assertEqual(self.index.get_nearest(x, y, count, exclude=exclude), spatial._scan_nearest(positions, x, y, count))
+            yaw = self.rand.uniform(-360.0, 360.0)
+            field_of_view = self.rand.uniform(10.0, 180.0)
+            max_distance = self.rand.uniform(1.0, side)
+            self.assertEqual(self.index.get_in_view(x, y, yaw, field_of_view, max_distance, exclude=exclude), spatial._scan_in_view(positions, x, y, yaw, field_of_view, max_distance))
+
+    def _move_and_remove(self, side):
+        for user_id in sorted(self.positions.keys()):
+            choice = self.rand.random()
+            if choice < 0.2:
+                self._remove(user_id)
+            elif choice < 0.7:
+                self._update(user_id, self.rand.uniform(-side, side), self.rand.uniform(-side, side))
+            else:
+                # Within its cell, most of the time:
+                x, y = self.positions[user_id]
+                self._update(user_id, x + self.rand.uniform(-1.0, 1.0), y + self.rand.uniform(-1.0, 1.0))
+        self.assertEqual(len(self.index), len(self.positions))
+
+    def test_sparse(self):
+        self._add_users(30, 2000.0)
+        self._compare(2000.0)
+        self._move_and_remove(2000.0)
+        self._compare(2000.0)
+
+    def test_dense(self):
+        self._add_users(400, 30.0)
+        self._compare(30.0)
+        self._move_and_remove(30.0)
+        self._compare(30.0)
+
+    def test_far_apart(self):
+        # 2.8 km between the two users: many more cells than users between them.
+        self._update("kiosk1", -1000.0, -1000.0)
+        self._update("kiosk2", 1000.0, 1000.0)
+        self.assertEqual(self.index.get_nearest(-1000.0, -1000.0, 1, exclude="kiosk1"), ["kiosk2"])
+        self.assertEqual(self.index.get_nearest(0.0, 0.0, 2), spatial._scan_nearest(self.positions, 0.0, 0.0, 2))
+        self.assertEqual(self.index.get_in_view(-1000.0, -1000.0, -45.0, 10.0, 3000.0, exclude="kiosk1"), ["kiosk2"])
+        self.assertEqual(self.index.get_in_view(-1000.0, -1000.0, 135.0, 10.0, 3000.0, exclude="kiosk1"), [])
+        self.assertEqual(self.index.get_in_view(-1000.0, -1000.0, -45.0, 10.0, 2000.0, exclude="kiosk1"), [])
+
+    def test_remove(self):
+        self._update("kiosk1", 0.0, 0.0)
+        self._update("kiosk2", 1.0, 0.0)
+        self.index.remove("kiosk2")
+        self.index.remove("kiosk3") # not there
+        self.assertEqual(self.index.get_nearest(1.0, 0.0, 2), ["kiosk1"])
+        self.assertFalse("kiosk2" in self.index)
+        self.index.update("kiosk2", 1.0, 0.0)
+        self.assertEqual(self.index.get_nearest(1.0, 0.0, 2), ["kiosk2", "kiosk1"])
+
+    def test_not_finite(self):
+        self._update("kiosk1", 0.0, 0.0)
+        for x, y in [(NAN, 0.0), (0.0, NAN), (INFINITY, 0.0), (0.0, -INFINITY)]:
+            self.index.update("kiosk1", x, y) # stays where it was
+            self.index.update("kiosk2", x, y) # not added
+        self.assertEqual(self.index.get_position("kiosk1"), (0.0, 0.0))
+        self.assertFalse("kiosk2" in self.index)
+        self.assertEqual(self.index.get_nearest(1.0, 1.0, 2), ["kiosk1"])
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""
+Tests for the publication of the params of our UserNode, and the readiness of the params of the other UserNode.
+"""
+from twisted.trial import unittest
+from spinic import userparams
+
+NODE_PATH = "/SPIN/default/kiosk1"
+
+def _get_messages(bundle):
+    """
+    Returns the (key, value) of the setParam messages of a bundle.
+    """
+    return [(message.arguments[1].value, message.arguments[2].value) for message in bundle.elements]
+
+class _Peer(object):
+    """
+    What we know of a peer: its params and its readiness, as in L{spinic.osc.SpinicOscInterface._handle_user_param}.
+    """
+    def __init__(self):
+        self.params = {}
+        self.readiness = userparams.ReadinessTracker()
+
+    def receive(self, messages):
+        for key, value in messages:
+            is_new = not self.params.has_key(key)
+            self.params[key] = value
+            self.readiness.on_param(key, value, self.params, is_new)
+
+class TestManifest(unittest.TestCase):
+    def test_format_and_parse(self):
+        self.assertEqual(userparams.parse_manifest(userparams.format_manifest(3, 20, 0xabc)), (3, 20, 0xabc))
+
+    def test_parse_older(self):
+        self.assertEqual(userparams.parse_manifest("3:20"), (3, 20, None))
+
+    def test_parse_invalid(self):
+        self.assertRaises(RuntimeError, userparams.parse_manifest, "3")
+        self.assertRaises(RuntimeError, userparams.parse_manifest, "a:b:c")
+
+    def test_digest_does_not_depend_on_order(self):
+        params = {"a": "1", "b": "2", "c": "3"}
+        digest = 0
+        for key in ["c", "a", "b"]:
+            digest += userparams.get_param_digest(key, params[key])
+        self.assertEqual(digest & 0xffffffff, userparams.get_params_digest(params))
+
+class TestPublishAndReadiness(unittest.TestCase):
+    def setUp(self):
+        self.publisher = userparams.ParamsPublisher()
+        self.params = {"width": 640, "height": 480, "number_of_cameras": 0}
+
+    def test_only_changes(self):
+        bundle = self.publisher.create_bundle(NODE_PATH, self.params)
+        self.assertEqual(len(bundle.elements), 4)
+        self.assertEqual(self.publisher.create_bundle(NODE_PATH, self.params), None)
+        self.params["width"] = 320
+        bundle = self.publisher.create_bundle(NODE_PATH, self.params)
+        self.assertEqual([key for key, value in _get_messages(bundle)], ["width", userparams.MANIFEST_KEY])
+        self.publisher.forget()
+        self.assertEqual(len(self.publisher.create_bundle(NODE_PATH, self.params).elements), 4)
+
+    def test_ready(self):
+        peer = _Peer()
+        peer.receive(_get_messages(self.publisher.create_bundle(NODE_PATH, self.params)))
+        self.assertTrue(peer.readiness.is_ready())
+
+    def test_manifest_first(self):
+        peer = _Peer()
+        messages = _get_messages(self.publisher.create_bundle(NODE_PATH, self.params))
+        peer.receive(messages[-1:])
+        self.assertFalse(peer.readiness.is_ready())
+        peer.receive(messages[:-1])
+        self.assertTrue(peer.readiness.is_ready())
+
+    def test_lost_delta(self):
+        peer = _Peer()
+        peer.receive(_get_messages(self.publisher.create_bundle(NODE_PATH, self.params)))
+        self.params["width"] = 320
+        messages = _get_messages(self.publisher.create_bundle(NODE_PATH, self.params))
+        # The setParam for the width is lost. We have as many params as the manifest says, but the width of the previous version.
+        peer.receive(messages[-1:])
+        self.assertFalse(peer.readiness.is_ready())
+        peer.receive(messages[:-1])
+        self.assertTrue(peer.readiness.is_ready())
+
+    def test_new_params_before_their_manifest(self):
+        peer = _Peer()
+        peer.receive(_get_messages(self.publisher.create_bundle(NODE_PATH, self.params)))
+        self.params["width"] = 320
+        messages = _get_messages(self.publisher.create_bundle(NODE_PATH, self.params))
+        peer.receive(messages[:-1])
+        self.assertFalse(peer.readiness.is_ready()) # the manifest we have is for the previous version
+        peer.receive(messages[-1:])
+        self.assertTrue(peer.readiness.is_ready())
+
+    def test_params_we_no_longer_have(self):
+        # The scene keeps the params we published before, and a peer that joins later gets them.
+        self.params["number_of_cameras"] = 1
+        self.params["cameras[1]"] = "0001@10.0.0.1:10000"
+        server_params = dict(_get_messages(self.publisher.create_bundle(NODE_PATH, self.params)))
+        self.params["number_of_cameras"] = 0
+        del self.params["cameras[1]"]
+        server_params.update(dict(_get_messages(self.publisher.create_bundle(NODE_PATH, self.params))))
+        peer = _Peer()
+        peer.receive(sorted(server_params.items()))
+        self.assertTrue(peer.readiness.is_ready())
+
+    def test_older_manifest(self):
+        peer = _Peer()
+        peer.receive([("width", "640"), ("height", "480"), (userparams.MANIFEST_KEY, "1:2")])
+        self.assertTrue(peer.readiness.is_ready())
+
+    def test_progress(self):
+        peer = _Peer()
+        peer.receive(_get_messages(self.publisher.create_bundle(NODE_PATH, self.params))[:-1])
+        self.params["width"] = 320
+        peer.receive(_get_messages(self.publisher.create_bundle(NODE_PATH, self.params))[-1:])
+        self.assertIn("version 2", peer.readiness.get_progress())
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Statistics on the UDP sockets we receive SPIN messages on.
+
+The number of datagrams dropped by the kernel for a socket is read from /proc/net/udp, so it only works on Linux.
+"""
+import os
+import time
+import socket
+from lunch import logger
+
+log = logger.start(name="udpstats")
+
+PROC_NET_UDP = "/proc/net/udp"
+
+def set_receive_buffer_size(sock, size):
+    """
+    Sets the SO_RCVBUF option of a socket.
+    Returns the size that the kernel actually uses, which is often twice the one asked for.
+    @rtype: C{int}
+    """
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+    except socket.error, e:
+        log.error("Could not set the receive buffer size to %d: %s" % (size, e))
+    return get_receive_buffer_size(sock)
+
+def get_receive_buffer_size(sock):
+    """
+    @rtype: C{int}
+    """
+    return sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+
+def read_socket_drops(sock):
+    """
+    Returns how many datagrams the kernel dropped for a socket, or None if we cannot know.
+    @rtype: C{int}
+    """
+    try:
+        inode = str(os.fstat(sock.fileno()).st_ino)
+        f = open(PROC_NET_UDP, "r")
+    except (OSError, IOError, socket.error), e:
+        return None
+    try:
+        f.readline() # header
+        for line in f:
+            fields = line.split()
+            # sl local_address rem_address st tx_queue:rx_queue tr:tm->when retrnsmt uid timeout inode ref pointer drops
+            if len(fields) >= 13 and fields[9] == inode:
+                return int(fields[12])
+    finally:
+        f.close()
+    return None
+
+class ChannelStats(object):
+    """
+    Receive rate and drops for one of the channels we listen to.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.socket = None
+        self.datagrams_received = 0 # incremented by the protocol or the receiver thread
+        self.rate = 0.0 # datagrams per second
+        self.drops = 0 # total, as counted by the kernel
+        self.new_drops = 0 # since the previous update
+        self.receive_buffer_size = None
+        self._previous_count = 0
+        self._previous_time = time.time()
+
+    def set_socket(self, sock, receive_buffer_size=None):
+        """
+        Called when we start listening on a new socket.
+        @param receive_buffer_size: SO_RCVBUF to set, or None to keep the kernel default.
+        """
+        self.socket = sock
+        if receive_buffer_size is not None:
+            self.receive_buffer_size = set_receive_buffer_size(sock, receive_buffer_size)
+            log.info("Receive buffer size for the %s channel is %d bytes." % (self.name, self.receive_buffer_size))
+        else:
+            self.receive_buffer_size = get_receive_buffer_size(sock)
+        self.drops = 0 # the kernel counts them for each socket
+
+    def update(self):
+        """
+        Updates the rate and drops. Should be called periodically.
+        """
+        now = time.time()
+        elapsed = now - self._previous_time
+        if elapsed > 0:
+            self.rate = (self.datagrams_received - self._previous_count) / elapsed
+        self._previous_count = self.datagrams_received
+        self._previous_time = now
+        self.new_drops = 0
+        if self.socket is not None:
+            drops = read_socket_drops(self.socket)
+            if drops is not None:
+                self.new_drops = max(0, drops - self.drops)
+                self.drops = drops
+
+    def __str__(self):
+        return "%.1f msg/s, %d received, %d dropped, %s bytes buffer" % (self.rate, self.datagrams_received, self.drops, self.receive_buffer_size)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""
+Publication of the params of our UserNode, and readiness of the params of the other UserNode.
+
+Our params are sent as one OSC bundle of setParam messages. The last message of the bundle sets the manifest param, whose value is "<version>:<count>:<digest>". The version is incremented each time we publish some changes. The count is the total number of params, manifest excluded. The digest identifies the values of all the params of that version.
+
+Once a set of params has been published to a scene, we only send the params whose value changed, along with a new manifest. The SPIN server keeps the others.
+
+Some setParam messages of a bundle might be lost, or arrive after its manifest. The setParam messages don't say which version they are from, so a peer keeps the digest of the params it has, updated in O(1) as each of them arrives. They are those of the version of the manifest once the digests match, and it has all our params once the count is reached too. Manifests without a digest, from older spinics, are trusted on their count only.
+
+For peers that don't send a manifest, we keep the set of params that we still need from them. It starts with the static list of required params, and shrinks as they arrive.
+"""
+import time
+import zlib
+from txosc import osc
+from spinic import cameras
+
+MANIFEST_KEY = "params_manifest"
+NUMBER_OF_CAMERAS_KEY = cameras.NUMBER_OF_CAMERAS_PARAM
+# Params we need to stream with a peer. The cameras[n] params are added once we know how many cameras it has.
+REQUIRED_PARAMS = frozenset([name for name, decoder, default in cameras.CAMERAS_CONFIG_SCHEMA if name not in cameras.OPTIONAL_CONFIG_PARAMS] + [NUMBER_OF_CAMERAS_KEY])
+
+def format_manifest(version, count, digest):
+    """
+    @rtype: C{str}
+    """
+    return "%d:%d:%08x" % (version, count, digest)
+
+def parse_manifest(value):
+    """
+    Returns a (version, count, digest) tuple. The digest is None for the manifests of older spinics, which don't have one.
+
+    Might raise a RuntimeError
+    @rtype: C{tuple}
+    """
+    try:
+        tokens = str(value).split(":")
+        if len(tokens) == 2:
+            return (int(tokens[0]), int(tokens[1]), None)
+        version, count, digest = tokens
+        return (int(version), int(count), int(digest, 16))
+    except ValueError, e:
+        raise RuntimeError("Invalid %s value %s: %s" % (MANIFEST_KEY, value, e))
+
+def get_param_digest(key, value):
+    """
+    Digest of a single param. The digest of a set of params is the sum of theirs, modulo 2**32, so that it does not depend on their order.
+    @rtype: C{int}
+    """
+    return zlib.crc32("%s=%s" % (key, value)) & 0xffffffff
+
+def get_params_digest(params):
+    """
+    Digest of a set of params, manifest excluded.
+    @param params: dict of params. The values are compared as strings.
+    @rtype: C{int}
+    """
+    digest = 0
+    for key, value in params.iteritems():
+        if key != MANIFEST_KEY:
+            digest += get_param_digest(key, value)
+    return digest & 0xffffffff
+
+class ParamsPublisher(object):
+    """
+    Remembers what we published for our UserNode in a scene, and computes what we need to send.
+    """
+    def __init__(self):
+        self.version = 0
+        self._published = {} # key: value as sent
+
+    def get_changes(self, params):
+        """
+        Returns the params whose value is not the one we published, as a dict of strings.
+        Keys we published, but that are no longer in params, are left as is.
+        @param params: dict of all our params.
+        @rtype: C{dict}
+        """
+        ret = {}
+        for key, value in params.iteritems():
+            value = str(value)
+            if self._published.get(key) != value:
+                ret[key] = value
+        return ret
+
+    def create_bundle(self, node_path, params):
+        """
+        Returns the bundle of setParam messages to send, or None if all those params are already published.
+
+        Assumes that the bundle will be sent: the params are recorded as published.
+        @param node_path: OSC path of our UserNode.
+        @param params: dict of all our params.
+        @rtype: L{txosc.osc.Bundle}
+        """
+        changes = self.get_changes(params)
+        if len(changes) == 0:
+            return None
+        self.version += 1
+        self._published.update(changes)
+        bundle = osc.Bundle()
+        for key in sorted(changes.keys()):
+            bundle.add(osc.Message(node_path, "setParam", key, changes[key]))
+        # The scene also has the params we published before, and that are no longer in params:
+        digest = get_params_digest(self._published)
+        bundle.add(osc.Message(node_path, "setParam", MANIFEST_KEY, format_manifest(self.version, len(params), digest)))
+        return bundle
+
+    def forget(self):
+        """
+        Forgets what we published. The next bundle will contain all the params.
+        """
+        self._published = {}
+
+class ReadinessTracker(object):
+    """
+    Tells if we have all the params of a UserNode that we need to stream with it.
+    """
+    def __init__(self):
+        self.missing = set(REQUIRED_PARAMS)
+        self.since = time.time() # when we started waiting for its params
+        self.ready_time = None # when we got them all
+        self.version = None # from its manifest, if it sends one
+        self.count = None # idem
+        self.digest = None # idem, and if it is not an older spinic
+        self.received_count = 0 # number of distinct params we got, manifest excluded
+        self.received_digest = 0 # of the params we got, manifest excluded
+        self._param_digests = {} # key: digest of the value we got
+
+    def on_param(self, key, value, params, is_new):
+        """
+        Called each time we get a param for that UserNode, once it is stored.
+        @param params: all the params of the UserNode.
+        @param is_new: True if we did not have that key yet.
+        """
+        if key == MANIFEST_KEY:
+            # Might raise a RuntimeError
+            self.version, self.count, self.digest = parse_manifest(value)
+        else:
+            if is_new:
+                self.received_count += 1
+            param_digest = get_param_digest(key, value)
+            self.received_digest = (self.received_digest - self._param_digests.get(key, 0) + param_digest) & 0xffffffff
+            self._param_digests[key] = param_digest
+            self.missing.discard(key)
+            if key == NUMBER_OF_CAMERAS_KEY:
+                try:
+                    number_of_cameras = int(value)
+                except ValueError:
+                    number_of_cameras = 0
+                for number in range(number_of_cameras):
+                    camera_key = "cameras[%d]" % (number + 1)
+                    if not params.has_key(camera_key):
+                        self.missing.add(camera_key)
+        if self.ready_time is None and self.is_ready():
+            self.ready_time = time.time()
+
+    def is_ready(self):
+        """
+        With a manifest, we trust its count, even if the peer has a different set of params than ours. The params we got must also be those of the version of the manifest.
+        @rtype: C{bool}
+        """
+        if self.count is not None:
+            return self.received_count >= self.count and (self.digest is None or self.digest == self.received_digest)
+        return len(self.missing) == 0
+
+    def get_progress(self):
+        """
+        Returns a human-readable string for the join progress.
+        @rtype: C{str}
+        """
+        if self.ready_time is not None:
+            return "ready after %.1f s" % (self.ready_time - self.since)
+        elapsed = time.time() - self.since
+        if self.count is not None and self.received_count >= self.count:
+            return "got %d params, but not all those of version %d, for %.1f s" % (self.received_count, self.version, elapsed)
+        if self.count is not None:
+            return "got %d of %d params, missing %s, for %.1f s" % (self.received_count, self.count, ", ".join(sorted(self.missing)) or "none of the required ones", elapsed)
+        return "missing %s, for %.1f s" % (", ".join(sorted(self.missing)), elapsed)